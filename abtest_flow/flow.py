@@ -1,6 +1,5 @@
 from prefect import flow, task
 from datetime import datetime
-timestamp = datetime.now()
 from pathlib import Path
 import warnings
 warnings.filterwarnings("ignore")
@@ -15,6 +14,13 @@ import json
 import sys
 import re
 
+# The flows share helper modules in flow_common/ at the repository root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from flow_common.instrumentation import export_step_metrics, instrumented, record_steps
+from flow_common.batch import main as batch_main
+from flow_common.payload import parse_payload
+from flow_common.ledger import RunLedger, record_flow_run
 
 
 
@@ -28,59 +34,89 @@ from task2 import main as run_test
     name="Step 1 of AB Test Flow",
     description="This splits the dataset into two parts according to the hash and split functions"
 )
+@instrumented("step_one")
 def step_one(*args, **kwargs):
     return split_dataset(*args, **kwargs)
 
 @task(
     name="Step 2 of AB Test Flow",
     description="This tasks tests the first model (A) on the first dataset ")
+@instrumented("step_two")
 def step_two(*args, **kwargs):
     return run_test(*args, **kwargs)
 
 @task(
     name="Step 3 of AB Test Flow",
     description="This tasks tests the first model (B) on the second dataset ")
+@instrumented("step_three")
 def step_three(*args, **kwargs):
     return run_test(*args, **kwargs)
 
+@task(
+    name="Arm evaluation of AB Test Flow",
+    description="This tasks tests the model of one arm on its dataset in an N-arm test",
+    task_run_name="Evaluate arm {arm}")
+@instrumented("evaluate_arm_{arm}")
+def evaluate_arm(arm, *args, **kwargs):
+    return run_test(*args, **kwargs)
+
+async def _read_json_from_artifact(client, flow_run_id):
+    result = None
+    artifacts = await client.read_artifacts(
+        flow_run_filter=FlowRunFilter(
+            id=FlowRunFilterId(any_=[flow_run_id])
+        )
+    )
+    if not artifacts or len(artifacts) == 0:
+        raise ValueError(f"Encountered no artifacts for given flow run id: {flow_run_id}")
+    elif len(artifacts) > 1:
+        raise ValueError(f"Encountered more than one artifact for given flow run id: {flow_run_id}")
+
+    artifact = artifacts[0]
+
+    # Extract JSON from markdown code block
+    match = re.search(r"```json\s*\n(.*?)\n```", artifact.data, re.DOTALL)
+    if match:
+        try:
+            result = json.loads(match.group(1))
+        except json.JSONDecodeError as e:
+            print(f"[ERROR] JSON decode error: {e}")
+    else:
+        print("[ERROR] No JSON code block found")
+    return artifact.key, result
+
+def get_artifacts(flow_run_ids) -> dict:
+    """Load the metadata of several flow runs, keyed by flow run id.
+
+    Runs are looked up in the local ledger first. The remaining ones are fetched
+    concurrently from the Prefect API on a single client and added to the ledger.
+    """
+    flow_run_ids = [str(flow_run_id) for flow_run_id in flow_run_ids]
+    ledger = RunLedger()
+    artifacts = ledger.get_many(flow_run_ids)
+
+    missing = [flow_run_id for flow_run_id in dict.fromkeys(flow_run_ids) if flow_run_id not in artifacts]
+    if missing:
+        async def _read_all():
+            async with get_client() as client:
+                return await asyncio.gather(*[_read_json_from_artifact(client, flow_run_id) for flow_run_id in missing])
+
+        for flow_run_id, (key, artifact) in zip(missing, asyncio.run(_read_all())):
+            if not artifact:
+                raise FileNotFoundError(f"Could not load artifact for flow run ID '{flow_run_id}'")
+            ledger.record(key, artifact)
+            artifacts[flow_run_id] = artifact
+
+    return artifacts
+
 def get_artifact(flow_run_id: str) -> dict:
-    async def _read_json_from_artifact():
-        result = None
-        async with get_client() as client:
-            artifacts = await client.read_artifacts(
-                flow_run_filter=FlowRunFilter(
-                    id=FlowRunFilterId(any_=[flow_run_id])
-                )
-            )
-            if not artifacts or len(artifacts) == 0:
-                raise ValueError(f"Encountered no artifacts for given flow run id: {flow_run_id}")
-            elif len(artifacts) > 1:
-                raise ValueError(f"Encountered more than one artifact for given flow run id: {flow_run_id}")
-
-            artifact = artifacts[0]
-
-            # Extract JSON from markdown code block
-            match = re.search(r"```json\s*\n(.*?)\n```", artifact.data, re.DOTALL)
-            if match:
-                try:
-                    result = json.loads(match.group(1))
-                except json.JSONDecodeError as e:
-                    print(f"[ERROR] JSON decode error: {e}")
-            else:
-                print("[ERROR] No JSON code block found")
-        return result
-
-    artifact = asyncio.run(_read_json_from_artifact())
-
-    if not artifact:
-        raise FileNotFoundError(f"Could not load artifact for flow run ID '{flow_run_id}'")
-
-    return artifact
+    return get_artifacts([flow_run_id])[str(flow_run_id)]
 
 
 @flow(
     name="MLOpsEx3 AB-Test Flow",
-    flow_run_name=f"MLOpsEx3 model A/B test flow at {timestamp.strftime('%Y%m%d-%H%M')}",
+    # Evaluated per run, a warm worker runs the same flow many times
+    flow_run_name=lambda: f"MLOpsEx3 model A/B test flow at {datetime.now().strftime('%Y%m%d-%H%M')}",
     description="This flow performs an A/B test one two different models, splitting input data randomly.",
     version="1.0.0",
     retries=0,
@@ -89,46 +125,59 @@ def get_artifact(flow_run_id: str) -> dict:
 def myflow_runner(
         working_dir,
         dataset_name,
-        flow_run_id_A,
-        flow_run_id_B,
+        flow_run_id_A=None,
+        flow_run_id_B=None,
         hash_function_string = None,
         split_function_string = None,
         seed = 42,
         cutoff_year=2020,
+        flow_run_ids=None,
         commit_id=None
 ):
-    A_artifact = get_artifact(flow_run_id_A)
-    A_modelpath = A_artifact["model_path_full"]
+    timestamp = datetime.now()
+    # Either a classic A/B test of two training flow runs, or an N-arm test of flow_run_ids
+    if flow_run_ids is not None:
+        arms = [str(i) for i in range(len(flow_run_ids))]
+        n_groups = len(flow_run_ids)
+    elif flow_run_id_A is not None and flow_run_id_B is not None:
+        arms = ["A", "B"]
+        flow_run_ids = [flow_run_id_A, flow_run_id_B]
+        n_groups = None
+    else:
+        raise ValueError("Pass either flow_run_id_A and flow_run_id_B, or a list of flow_run_ids")
 
-    B_artifact = get_artifact(flow_run_id_B)
-    B_modelpath = B_artifact["model_path_full"]
+    steps = record_steps()
+    artifacts = get_artifacts(flow_run_ids)
+    modelpaths = [artifacts[str(flow_run_id)]["model_path_full"] for flow_run_id in flow_run_ids]
 
     orig_working_dir = working_dir
     working_dir = Path(working_dir)
+    flow_id = get_run_context().flow_run.id
 
-    dataset_name_A, dataset_name_B = step_one(
+    dataset_names = step_one(
         working_dir=working_dir,
         dataset_name=dataset_name,
         hash_function_string=hash_function_string,
         split_function_string=split_function_string,
         seed=seed,
         cutoff_year=cutoff_year,
+        n_groups=n_groups,
+        run_id=str(flow_id),
     )
 
-    results_A = step_two(
-        working_dir=working_dir,
-        dataset_name=dataset_name_A,
-        modelpath=A_modelpath
-    )
-
-    results_B = step_three(
-        working_dir=working_dir,
-        dataset_name=dataset_name_B,
-        modelpath=B_modelpath
-    )
-
+    # Submit all arms at once so they are evaluated concurrently by the task runner
+    if n_groups is None:
+        futures = [
+            step.submit(working_dir=working_dir, dataset_name=arm_dataset_name, modelpath=modelpath)
+            for step, arm_dataset_name, modelpath in zip([step_two, step_three], dataset_names, modelpaths)
+        ]
+    else:
+        futures = [
+            evaluate_arm.submit(arm, working_dir=working_dir, dataset_name=arm_dataset_name, modelpath=modelpath)
+            for arm, arm_dataset_name, modelpath in zip(arms, dataset_names, modelpaths)
+        ]
+    results = {f"results_{arm}": future.result() for arm, future in zip(arms, futures)}
 
-    flow_id = get_run_context().flow_run.id
 
     metadata = {
         "flow_run_id": str(flow_id),
@@ -137,15 +186,14 @@ def myflow_runner(
             "dataset_name": dataset_name,
             "flow_run_id_A": flow_run_id_A,
             "flow_run_id_B": flow_run_id_B,
+            "flow_run_ids": flow_run_ids,
             "hash_function_string": hash_function_string,
             "split_function_string": split_function_string,
             "seed": seed,
             "cutoff_year": cutoff_year,
         },
-        "Results": {
-            "results_A": results_A,
-            "results_B": results_B,
-        },
+        "Results": results,
+        "steps": steps,
         "git_commit_hexsha": commit_id,
         "timestamp_start": timestamp.isoformat(),
         "timestamp_end": datetime.now().isoformat(),
@@ -161,9 +209,9 @@ def myflow_runner(
         description="Flow metadata serialized as JSON"
     )
 
-    # Dump the artifact locally too
-    with open("Flow_Artifacts_Local.txt", "a+", encoding="utf-8") as f:
-        f.write(metadata_json)
+    # Record the run in the local ledger too
+    record_flow_run("abtest-flow", metadata)
+    export_step_metrics("abtest-flow", str(flow_id), steps)
 
     with open("Flow_Ids.txt", "a+", encoding="utf-8") as f:
         f.write(str(flow_id) + '\n')
@@ -174,14 +222,15 @@ def myflow_runner(
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        # python flow.py --batch <payloads.jsonl> [--concurrency N] [--output results.csv]
+        batch_main(sys.argv[2:], flow_name="abtest_flow", myflow_runner=myflow_runner)
+        return
+
     if len(sys.argv) > 1:
         try:
             # sys.argv[1] is a JSON string
-            param_blob = sys.argv[1]
-            params = json.loads(param_blob)
-            args = params.get("args", [])
-            kwargs = params.get("kwargs", {})
-            commit_id = params.get("commit_id", None)
+            args, kwargs, commit_id = parse_payload(sys.argv[1])
         except Exception as e:
             print(f"❌ Failed to parse args: {e}")
             args = []
@@ -1,10 +1,79 @@
 import pandas as pd
+import numpy as np
 from pathlib import Path
 
 import hashlib
 import base64
 import cloudpickle
 
+from flow_common.dataset_io import read_dataset, write_dataset
+from flow_common.schema import DATE_COLUMN, FEATURE_COLUMNS, TARGET_COLUMN
+
+
+def batched(fn):
+    """Mark a hash or split function as working on whole arrays instead of single values.
+
+    A batched hash function receives all distinct release dates (a DatetimeIndex),
+    a batched split function the matching array of hashes, and both return an
+    array of the same length. Unmarked functions are called once per distinct value.
+    Functions shipped via cloudpickle keep the marker.
+    """
+    fn.batched = True
+    return fn
+
+
+def hash_fn(datetime, seed=42):
+    """Generates a hash from datetime and a seed, then returns a float between 0 and 1."""
+    data_str = f"{seed}_{datetime}"
+    hash_obj = hashlib.sha256(data_str.encode('utf-8'))
+    hash_int = int(hash_obj.hexdigest(), 16)
+    return hash_int % 1000 / 1000.0
+
+
+@batched
+def hash_fn_batched(datetimes, seed=42):
+    return np.fromiter((hash_fn(d, seed=seed) for d in datetimes), dtype=np.float64, count=len(datetimes))
+
+
+def split_fn(h, seed=42):
+    if h < 0.33:
+        return -1
+    elif h < 0.66:
+        return 0
+    else:
+        return 1
+
+
+@batched
+def split_fn_batched(h, seed=42):
+    return np.select([h < 0.33, h < 0.66], [-1, 0], default=1)
+
+
+def n_way_split_fn(n_groups):
+    """Default split for an N-arm test: equally sized hash ranges mapped to groups 0..n_groups-1."""
+    @batched
+    def split_fn(h, seed=42):
+        return np.minimum((np.asarray(h) * n_groups).astype(np.int64), n_groups - 1)
+    return split_fn
+
+
+def _apply(fn, values, seed):
+    if getattr(fn, "batched", False):
+        result = np.asarray(fn(values, seed=seed))
+        if len(result) != len(values):
+            raise ValueError(f"Batched function {fn.__name__} returned {len(result)} values for {len(values)} inputs")
+        return result
+    return np.array([fn(v, seed=seed) for v in values])
+
+
+def assign_groups(release_dates, hash_fn, split_fn, seed=42):
+    """Compute the hash and group of every row, hashing each distinct release date only once."""
+    codes, uniques = pd.factorize(release_dates, use_na_sentinel=False)
+    hashes = _apply(hash_fn, uniques, seed)
+    groups = _apply(split_fn, hashes, seed)
+    return hashes[codes], groups[codes]
+
+
 def main(
         working_dir,
         dataset_name,
@@ -12,7 +81,17 @@ def main(
         split_function_string=None,
         seed=42,
         cutoff_year=2020,
+        n_groups=None,
+        run_id=None,
 ):
+    """Split the post-cutoff rows into test groups and write one dataset per group.
+
+    Without ``n_groups`` this is the classic A/B split, where the split function maps
+    rows to -1 (A), 1 (B) or 0 (left out). With ``n_groups`` the split function has to
+    return groups 0..n_groups-1. Returns the written dataset names in group order;
+    with ``run_id`` they include it, so concurrent runs in one working_dir do not
+    overwrite each other's groups.
+    """
     if hash_function_string is not None:
         try:
             hash_func_bytes = base64.b64decode(hash_function_string.encode("utf-8"))
@@ -20,12 +99,7 @@ def main(
         except:
             raise ValueError("Could not load hash function from pickle file. Did you pass a cloudpickle.dumps object?")
     else:
-        def hash_fn(datetime, seed=42):
-            """Generates a hash from datetime and a seed, then returns a float between 0 and 1."""
-            data_str = f"{seed}_{datetime}"
-            hash_obj = hashlib.sha256(data_str.encode('utf-8'))
-            hash_int = int(hash_obj.hexdigest(), 16)
-            return hash_int % 1000 / 1000.0
+        hash_fn = hash_fn_batched
 
     if split_function_string is not None:
         try:
@@ -33,56 +107,39 @@ def main(
             split_fn = cloudpickle.loads(split_func_bytes)
         except:
             raise ValueError("Could not load splitter function from pickle file. Did you pass a cloudpickle.dumps object?")
+    elif n_groups is None:
+        split_fn = split_fn_batched
     else:
-        def split_fn(h, seed=42):
-            if h < 0.33:
-                return -1
-            elif h < 0.66:
-                return 0
-            else:
-                return 1
+        split_fn = n_way_split_fn(n_groups)
 
 
     input_path = working_dir / dataset_name
-    dataset = pd.read_csv(input_path, index_col=False)
-    dataset.release_date = pd.to_datetime(dataset.release_date)
-
-    input_cols = ['release_date', 'price', 'positive_reviews', 'negative_reviews', 'metacritic_score', 'peak_ccu', 'recommendations', 'required_age', 'on_linux', 'on_mac', 'on_windows']
-    input_cols.append('estimated_owners')
-    ds = dataset[input_cols]
+    ds = read_dataset(input_path, columns=[DATE_COLUMN, *FEATURE_COLUMNS, TARGET_COLUMN], from_year=cutoff_year)
 
-    mask = ds.release_date.dt.year >= cutoff_year
+    ds['hash'], ds['group'] = assign_groups(ds.release_date, hash_fn, split_fn, seed=seed)
 
-    ds = ds.loc[mask]
-
-    def split_fn_seeded(x):
-        return split_fn(x, seed=seed)
-    def hash_fn_seeded(x):
-        return hash_fn(x, seed=seed)
-
-    ds['hash'] = ds.release_date.apply(hash_fn_seeded)
-    ds['group'] = ds.hash.apply(split_fn_seeded)
-
-    mask_A = ds['group'] == -1
-    mask_B = ds['group'] == 1
-
-    ds_A = ds.loc[mask_A]
-    ds_B = ds.loc[mask_B]
-
-    ds_A.drop(columns=['group', 'hash', 'release_date'], inplace=True)
-    ds_B.drop(columns=['group', 'hash', 'release_date'], inplace=True)
+    if n_groups is None:
+        arms = {"A": -1, "B": 1}
+    else:
+        arms = {str(group): group for group in range(n_groups)}
 
+    # Row positions of every group, computed in a single pass over the data
+    group_rows = ds.groupby('group', sort=False).indices
 
-    outfile_name_A = input_path.stem + "_A.csv"
-    outfile_name_B = input_path.stem + "_B.csv"
+    outfile_names = []
+    for arm, group in arms.items():
+        ds_arm = ds.iloc[group_rows.get(group, [])]
+        ds_arm = ds_arm.drop(columns=['group', 'hash', 'release_date'])
 
-    ds_A.to_csv(working_dir / outfile_name_A, index=False)
-    ds_B.to_csv(working_dir / outfile_name_B, index=False)
+        # The group datasets are written in the same format as the input dataset, as Parquet file for a partitioned one
+        outfile_name = input_path.stem + (f"_{run_id}" if run_id is not None else "") + f"_{arm}" \
+            + (input_path.suffix if input_path.is_file() else ".parquet")
+        write_dataset(ds_arm, working_dir / outfile_name)
+        print(f"Saving to {working_dir / outfile_name}, len={len(ds_arm)}")
 
-    print(f"Saving to {working_dir / outfile_name_A}, len={len(ds_A)}")
-    print(f"Saving to {working_dir / outfile_name_B}, len={len(ds_B)}")
+        outfile_names.append(outfile_name)
 
-    return outfile_name_A, outfile_name_B
+    return tuple(outfile_names)
 
 
 if __name__ == "__main__":
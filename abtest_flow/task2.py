@@ -1,6 +1,8 @@
-import mlflow.sklearn
 import pandas as pd
-from sklearn.metrics import balanced_accuracy_score, accuracy_score, f1_score
+
+from flow_common.feature_store import feature_store
+from flow_common.metrics import ConfusionMatrix
+from flow_common.predictions import predict
 
 
 def main(
@@ -8,24 +10,14 @@ def main(
         dataset_name,
         modelpath
 ):
-    input_path = working_dir / dataset_name
-    dataset = pd.read_csv(input_path, index_col=False)
-
-    input_cols = ['price', 'positive_reviews', 'negative_reviews', 'metacritic_score', 'peak_ccu', 'recommendations', 'required_age', 'on_linux', 'on_mac', 'on_windows']
-    X, y = dataset[input_cols], dataset['estimated_owners']
-
-    model = mlflow.sklearn.load_model(modelpath)
-
-    y_pred = model.predict(X)
+    # The arm datasets have no release date, all rows are used
+    store = feature_store(working_dir / dataset_name, dated=False)
+    X, y = store.X(), store.y()
 
-    accuracy = accuracy_score(y, y_pred)
-    f1 = f1_score(y, y_pred, average='macro')
-    balanced_accuracy = balanced_accuracy_score(y, y_pred)
+    y_pred = predict(modelpath, X)
 
     return {
-            "accuracy": accuracy,
-            "balanced_accuracy": balanced_accuracy,
-            "f1": f1,
+            **ConfusionMatrix.from_labels(y, y_pred).metrics(),
             "groupsize": len(X),
             "model": modelpath
         },
\ No newline at end of file
@@ -0,0 +1,147 @@
+from prefect import flow, task
+from datetime import datetime
+from pathlib import Path
+import warnings
+warnings.filterwarnings("ignore")
+from prefect.artifacts import create_markdown_artifact, get_run_context
+
+
+import json
+import sys
+
+# The flows share helper modules in flow_common/ at the repository root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from flow_common.instrumentation import export_step_metrics, instrumented, record_steps
+from flow_common.batch import main as batch_main
+from flow_common.payload import parse_payload
+from flow_common.ledger import record_flow_run
+
+
+
+from task1 import main as run_backtest
+from task2 import main as report_backtest
+
+@task(
+    name="Step 1 of Backtest Flow",
+    description="This trains and evaluates one model per cutoff year, in parallel worker processes"
+)
+@instrumented("step_one")
+def step_one(*args, **kwargs):
+    return run_backtest(*args, **kwargs)
+
+@task(
+    name="Step 2 of Backtest Flow",
+    description="This writes the accuracy / f1 versus cutoff year table and logs it to MLflow"
+)
+@instrumented("step_two")
+def step_two(*args, **kwargs):
+    return report_backtest(*args, **kwargs)
+
+
+@flow(
+    name="MLOpsEx3 Backtest Flow",
+    # Evaluated per run, a warm worker runs the same flow many times
+    flow_run_name=lambda: f"MLOpsEx3 model backtest flow at {datetime.now().strftime('%Y%m%d-%H%M')}",
+    description="This flow shows how the model ages, by training and evaluating one Random Forest Model per cutoff year.",
+    version="1.0.0",
+    retries=0,
+    timeout_seconds=3600
+)
+def myflow_runner(
+        working_dir,
+        dataset_name,
+        first_cutoff_year,
+        last_cutoff_year,
+        report_name="backtest.csv",
+        horizon_years=1,
+        hyperparameter_file=None,
+        n_jobs=None,
+        commit_id=None
+):
+    timestamp = datetime.now()
+    steps = record_steps()
+    working_dir_pth = Path(working_dir)
+
+    results = step_one(working_dir_pth,
+                       dataset_name,
+                       first_cutoff_year,
+                       last_cutoff_year,
+                       horizon_years=horizon_years,
+                       hyperparameter_file=hyperparameter_file,
+                       n_jobs=n_jobs)
+
+    step_two(working_dir_pth, report_name, results)
+
+    flow_id = get_run_context().flow_run.id
+
+    metadata = {
+        "flow_run_id": str(flow_id),
+        "kwargs": {
+            "working_dir": working_dir,
+            "dataset_name": dataset_name,
+            "first_cutoff_year": first_cutoff_year,
+            "last_cutoff_year": last_cutoff_year,
+            "report_name": report_name,
+            "horizon_years": horizon_years,
+            "hyperparameter_file": hyperparameter_file,
+            "n_jobs": n_jobs
+        },
+        "git_commit_hexsha": commit_id,
+        # NaN metrics of skipped cutoffs become null
+        "backtest": [{key: (None if value != value else value) for key, value in row.items()} for row in results],
+        "steps": steps,
+        "timestamp_start": timestamp.isoformat(),
+        "timestamp_end": datetime.now().isoformat(),
+    }
+
+    # Convert to JSON string
+    metadata_json = json.dumps(metadata, indent=2)
+
+    # Create artifact with JSON content
+    artifact_id = create_markdown_artifact(
+        key="backtest-flow",
+        markdown=f"```json\n{metadata_json}\n```",
+        description="Flow metadata serialized as JSON"
+    )
+
+    # Record the run in the local ledger too
+    record_flow_run("backtest-flow", metadata)
+    export_step_metrics("backtest-flow", str(flow_id), steps)
+
+    with open("Flow_Ids.txt", "a+", encoding="utf-8") as f:
+        f.write(str(flow_id) + '\n')
+
+
+    return flow_id, artifact_id
+
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        # python flow.py --batch <payloads.jsonl> [--concurrency N] [--output results.csv]
+        batch_main(sys.argv[2:], flow_name="backtest_flow", myflow_runner=myflow_runner)
+        return
+
+    if len(sys.argv) > 1:
+        try:
+            # sys.argv[1] is a JSON string
+            args, kwargs, commit_id = parse_payload(sys.argv[1])
+        except Exception as e:
+            print(f"❌ Failed to parse args: {e}")
+            args = []
+            kwargs = {}
+            commit_id = None
+    else:
+        args = []
+        kwargs = {}
+        commit_id = None
+
+    kwargs.update({"commit_id": commit_id})
+    flow_id, artifact_id = myflow_runner(*args, **kwargs)
+
+    print(f"Flow ID: {flow_id}, Artifact ID: {artifact_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import json
+from pathlib import Path
+
+from flow_common.backtest import run_backtest
+
+DEFAULT_HYPERPARAMETER_FILE = Path("./flows_git/training_flow/model_hyperparameters.txt")
+
+
+def main(working_dir,
+         dataset_name,
+         first_cutoff_year,
+         last_cutoff_year,
+         horizon_years=1,
+         hyperparameter_file=None,
+         n_jobs=None):
+    hp_path = Path(hyperparameter_file) if hyperparameter_file is not None else DEFAULT_HYPERPARAMETER_FILE
+    try:
+        with open(hp_path, "r", encoding="utf-8") as f:
+            params = json.loads(f.read())
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"Could not find (or read) hyperparameter file at {hp_path} : {e}")
+
+    if "search_space" in params:
+        raise ValueError("The backtest trains one configuration per cutoff, a hyperparameter search file is not supported")
+
+    cutoff_years = range(first_cutoff_year, last_cutoff_year + 1)
+    return run_backtest(working_dir / dataset_name, cutoff_years, params, horizon_years=horizon_years, n_jobs=n_jobs)
+
+
+if __name__ == "__main__":
+    print(main(Path("./data"), "steam_games_dataset.csv", 2015, 2024))
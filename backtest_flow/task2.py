@@ -0,0 +1,23 @@
+import pandas as pd
+
+
+def main(working_dir, report_name, results):
+    """Write the accuracy / f1 versus cutoff table and log it as one MLflow run, with the cutoff year as step."""
+    import mlflow
+
+    table = pd.DataFrame(results)
+    print(table.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+
+    working_dir.mkdir(parents=True, exist_ok=True)
+    table.to_csv(working_dir / report_name, index=False)
+
+    mlflow.set_experiment("MLOpsEx3")
+    with mlflow.start_run(run_name="Backtest"):
+        mlflow.set_tag("Backtest Info", "Walk-forward backtest of the RF model over cutoff years")
+        for row in table.dropna(subset=["accuracy"]).itertuples():
+            mlflow.log_metric("accuracy", row.accuracy, step=row.cutoff_year)
+            mlflow.log_metric("balanced_accuracy", row.balanced_accuracy, step=row.cutoff_year)
+            mlflow.log_metric("f1_score_macro", row.f1, step=row.cutoff_year)
+        mlflow.log_artifact(str(working_dir / report_name))
+
+    return table
@@ -0,0 +1 @@
+"""Benchmarks of the flow tasks on synthetic datasets, run from the repository root with ``python -m benchmarks.run``."""
@@ -0,0 +1,77 @@
+"""Compare two benchmark result files written by ``benchmarks.run``.
+
+A task is flagged as a regression when it failed, or when its wall clock time
+or peak RSS grew by more than ``tolerance`` relative to the baseline and by more
+than a small absolute amount (so tasks of a few milliseconds do not flap)::
+
+    python -m benchmarks.compare baseline.json current.json --tolerance 0.25
+"""
+import argparse
+import json
+import sys
+
+
+METRICS = ("wall_seconds", "peak_rss_mb")
+MIN_DELTA = {"wall_seconds": 0.2, "cpu_seconds": 0.2, "peak_rss_mb": 20}
+
+
+def _key(result):
+    return result["task"], result["rows"], result["format"]
+
+
+def compare(baseline, current, tolerance=0.25, metrics=METRICS):
+    """One row per task of ``current`` with the ratio to the baseline of every metric."""
+    baseline_results = {_key(result): result for result in baseline["results"]}
+
+    rows = []
+    for result in current["results"]:
+        row = {"task": result["task"], "rows": result["rows"], "format": result["format"], "regression": False}
+        reference = baseline_results.get(_key(result))
+
+        if not result["ok"]:
+            row.update(status="failed", regression=True)
+        elif reference is None or not reference["ok"]:
+            row["status"] = "new"
+        else:
+            row["status"] = "ok"
+            for metric in metrics:
+                before, after = reference[metric], result[metric]
+                ratio = after / before if before else None
+                row[metric] = (before, after, ratio)
+                if ratio is not None and ratio > 1 + tolerance and after - before > MIN_DELTA.get(metric, 0):
+                    row["status"] = "regression"
+                    row["regression"] = True
+        rows.append(row)
+    return rows
+
+
+def print_comparison(rows, metrics=METRICS):
+    for row in rows:
+        line = f"{row['task']:<36} {row['rows']:>10} rows  {row['status']:<10}"
+        for metric in metrics:
+            if metric in row:
+                before, after, ratio = row[metric]
+                change = f"{ratio:6.2f}x" if ratio is not None else "   n/a"
+                line += f"  {metric} {before:.2f} -> {after:.2f} ({change})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results against a baseline")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, "r", encoding="utf-8") as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, tolerance=args.tolerance)
+    print_comparison(rows)
+    sys.exit(1 if any(row["regression"] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
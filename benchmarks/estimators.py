@@ -0,0 +1,109 @@
+"""Side-by-side fit time, predict time and model size of the estimator backends.
+
+Every hyperparameter file (see ``flow_common.estimators``) is trained on the
+rows of one synthetic dataset released before the cutoff year and evaluated on
+the later ones, as ``training_flow/task2`` and ``task3`` would::
+
+    python -m benchmarks.estimators --rows 100000 1000000 --output estimators.json
+
+The model size is the size of the pickled estimator, the file mlflow logs.
+Backends with a compiled form (the random forest, see ``flow_common.forest_engine``)
+are also timed predicting through it, as the flows do.
+"""
+import argparse
+import json
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate_dataset import generate_dataset
+from benchmarks.run import CUTOFF_YEAR, REPO_ROOT, environment
+from flow_common.cpu import cpu_allocation
+from flow_common.estimators import split_params
+from flow_common.metrics import ConfusionMatrix
+from flow_common.schema import FEATURE_COLUMNS, TARGET_COLUMN
+
+
+HYPERPARAMETER_FILES = [
+    REPO_ROOT / "training_flow" / "model_hyperparameters.txt",
+    REPO_ROOT / "training_flow" / "model_hyperparameters_hgb.txt",
+]
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def compare_backends(n_rows, hyperparameter_files=HYPERPARAMETER_FILES, seed=0, cutoff_year=CUTOFF_YEAR):
+    from flow_common.forest_engine import compile_forest
+
+    dataset = generate_dataset(n_rows, seed=seed)
+    is_train = (dataset.release_date.dt.year < cutoff_year).to_numpy()
+    is_test = (dataset.release_date.dt.year >= cutoff_year).to_numpy()
+    # The features as the flows train on them, float32 from the feature store
+    X = dataset[FEATURE_COLUMNS].astype(np.float32)
+    X_train, y_train = X[is_train], dataset[TARGET_COLUMN][is_train]
+    X_test, y_test = X[is_test], dataset[TARGET_COLUMN][is_test]
+
+    results = []
+    for path in hyperparameter_files:
+        with open(path, "r", encoding="utf-8") as f:
+            backend, params = split_params(json.load(f))
+
+        with cpu_allocation(f"benchmark {backend.name}") as cores:
+            model = backend.make(params)
+            _, fit_seconds = _timed(model.fit, X_train, y_train)
+            y_pred, predict_seconds = _timed(model.predict, X_test)
+            compiled_seconds = None
+            if backend.compilable:
+                _, compiled_seconds = _timed(compile_forest(model).predict, X_test)
+
+        matrix = ConfusionMatrix.from_labels(y_test, y_pred)
+        result = {
+            "hyperparameters": Path(path).name,
+            "estimator": backend.name,
+            "rows": n_rows,
+            "train_rows": len(X_train),
+            "test_rows": len(X_test),
+            "cores": cores,
+            "fit_seconds": fit_seconds,
+            "predict_seconds": predict_seconds,
+            "predict_compiled_seconds": compiled_seconds,
+            "model_mb": len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 1024 ** 2,
+            "accuracy": matrix.accuracy(),
+            "f1": matrix.f1_macro(),
+        }
+        results.append(result)
+        print(f"{result['hyperparameters']:<36} {n_rows:>10} rows  fit {fit_seconds:8.2f}s  "
+              f"predict {predict_seconds:6.2f}s  {result['model_mb']:8.1f} MB  f1 {result['f1']:.3f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fit / predict time and model size of the estimator backends")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--hyperparameter-files", nargs="+", default=HYPERPARAMETER_FILES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [
+        result for n_rows in args.rows
+        for result in compare_backends(n_rows, args.hyperparameter_files, seed=args.seed)
+    ]
+    print()
+    print(pd.DataFrame(results).drop(columns=["train_rows", "test_rows"]).to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
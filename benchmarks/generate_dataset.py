@@ -0,0 +1,134 @@
+"""Offline generator of synthetic Steam games datasets.
+
+The generated files have the schema of the output of ``training_flow/task1``
+(name, release_date, estimated_owners, price, review counts, metacritic score,
+peak CCU, recommendations, required age, platform flags), so every flow step
+after the download can run on them. Review counts, CCU and recommendations grow
+with the owner bucket, so the classifier has something to learn, and prices and
+platform shares shift slightly after 2020 to give the drift tests a signal.
+
+Rows are generated and written in chunks, so sizes of 10M rows and more only
+need memory for one chunk::
+
+    python -m benchmarks.generate_dataset 1000000 data/steam_games_1m.parquet
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from flow_common.dataset_io import write_dataset_chunks
+from flow_common.partitions import write_partitioned
+from flow_common.schema import OWNER_BUCKETS, OWNERS_DTYPE, apply_schema
+
+
+# Roughly the bucket shares of the real dataset: most games have few owners
+OWNER_PROBABILITIES = np.array([2, 60, 12, 7, 5, 5, 3, 2.5, 1.5, 0.9, 0.5, 0.3, 0.1, 0.05])
+OWNER_PROBABILITIES = OWNER_PROBABILITIES / OWNER_PROBABILITIES.sum()
+
+FIRST_YEAR = 1998
+LAST_YEAR = 2025
+DRIFT_YEAR = 2020
+MISSING_DATE_SHARE = 0.002
+DEFAULT_CHUNKSIZE = 500_000
+
+
+def _release_dates(rng, n):
+    # Far more games are released every year, so later years are more likely
+    years = np.arange(FIRST_YEAR, LAST_YEAR + 1)
+    weights = np.exp((years - FIRST_YEAR) / 8.0)
+    year = rng.choice(years, size=n, p=weights / weights.sum())
+    day = rng.integers(0, 365, size=n)
+    dates = pd.to_datetime(year.astype(str), format="%Y") + pd.to_timedelta(day, unit="D")
+    dates = pd.Series(dates)
+    dates[rng.random(n) < MISSING_DATE_SHARE] = pd.NaT
+    return dates
+
+
+def generate_chunk(rng, start, n):
+    """``n`` synthetic rows, named from ``start`` on."""
+    release_date = _release_dates(rng, n)
+    after_drift = (release_date.dt.year >= DRIFT_YEAR).to_numpy()
+
+    bucket = rng.choice(len(OWNER_BUCKETS), size=n, p=OWNER_PROBABILITIES)
+    # Popularity on a log scale, driven by the owner bucket plus noise
+    popularity = bucket + rng.normal(0, 0.8, size=n)
+
+    reviews = np.expm1(np.clip(popularity * 1.1 + rng.normal(0, 0.7, size=n), 0, None))
+    positive_share = np.clip(rng.beta(6, 2, size=n), 0, 1)
+    positive_reviews = np.round(reviews * positive_share).astype(np.int64)
+    negative_reviews = np.round(reviews * (1 - positive_share)).astype(np.int64)
+
+    peak_ccu = np.round(np.expm1(np.clip(popularity * 0.9 - 2 + rng.normal(0, 1.0, size=n), 0, None))).astype(np.int64)
+    recommendations = np.where(
+        rng.random(n) < 0.4 + 0.04 * bucket,
+        np.round(reviews * rng.uniform(0.1, 0.9, size=n)),
+        0,
+    ).astype(np.int64)
+
+    has_metacritic = rng.random(n) < 0.02 + 0.06 * bucket
+    metacritic_score = np.where(has_metacritic, np.clip(rng.normal(72, 10, size=n), 20, 97).round(), 0).astype(np.int64)
+
+    free = rng.random(n) < 0.18
+    price = np.round(np.exp(rng.normal(1.8, 0.9, size=n)) * np.where(after_drift, 1.15, 1.0)) - 0.01
+    price = np.where(free, 0.0, np.clip(price, 0.49, 199.99)).round(2)
+
+    required_age = rng.choice([0, 13, 16, 17, 18], size=n, p=[0.93, 0.02, 0.01, 0.02, 0.02])
+
+    return apply_schema(pd.DataFrame({
+        "name": [f"Synthetic Game {i}" for i in range(start, start + n)],
+        "release_date": release_date,
+        "estimated_owners": pd.Categorical.from_codes(bucket, dtype=OWNERS_DTYPE),
+        "price": price,
+        "positive_reviews": positive_reviews,
+        "negative_reviews": negative_reviews,
+        "metacritic_score": metacritic_score,
+        "peak_ccu": peak_ccu,
+        "recommendations": recommendations,
+        "required_age": required_age,
+        "on_windows": rng.random(n) < 0.995,
+        "on_linux": rng.random(n) < np.where(after_drift, 0.22, 0.15),
+        "on_mac": rng.random(n) < np.where(after_drift, 0.25, 0.2),
+    }))
+
+
+def generate_chunks(n_rows, seed=0, chunksize=DEFAULT_CHUNKSIZE):
+    """Yield ``n_rows`` synthetic rows as DataFrames of at most ``chunksize`` rows.
+
+    The rows only depend on ``seed`` and ``chunksize``.
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_rows, chunksize):
+        yield generate_chunk(rng, start, min(chunksize, n_rows - start))
+
+
+def generate_dataset(n_rows, seed=0):
+    """``n_rows`` synthetic rows as one DataFrame."""
+    return pd.concat(generate_chunks(n_rows, seed=seed), ignore_index=True)
+
+
+def write_synthetic_dataset(path, n_rows, seed=0, chunksize=DEFAULT_CHUNKSIZE, partition_by_year=False):
+    """Generate ``n_rows`` rows into ``path``, in any format supported by ``dataset_io``."""
+    chunks = generate_chunks(n_rows, seed=seed, chunksize=chunksize)
+    if partition_by_year:
+        write_partitioned(chunks, path)
+    else:
+        write_dataset_chunks(chunks, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Steam games dataset")
+    parser.add_argument("n_rows", type=int)
+    parser.add_argument("path", help="Output file, the format is picked from the suffix (.csv, .parquet, .feather)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--partition-by-year", action="store_true", help="Write a directory partitioned by release year")
+    args = parser.parse_args()
+
+    write_synthetic_dataset(args.path, args.n_rows, seed=args.seed, chunksize=args.chunksize,
+                            partition_by_year=args.partition_by_year)
+    print(f"Wrote {args.n_rows} rows to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
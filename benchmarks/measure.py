@@ -0,0 +1,103 @@
+"""Run one task function in this process and record what it cost.
+
+The suite starts this script once per task, because every flow directory has its
+own ``task1`` / ``task2`` modules and because the peak RSS of a process can only
+be attributed to a single task if nothing else ran in it::
+
+    python benchmarks/measure.py <spec.json> <result.json>
+
+The spec names the flow directory, the task module, the keyword arguments of its
+``main`` (``path_kwargs`` are converted to ``Path``) and an optional setup step
+that runs before the measurement starts.
+"""
+import importlib
+import json
+import platform
+import resource
+import sys
+import time
+import traceback
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    return cpu, max(own.ru_maxrss, children.ru_maxrss)
+
+
+def _rss_mb(maxrss):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return maxrss / (1024 ** 2 if platform.system() == "Darwin" else 1024)
+
+
+def seed_dataset_cache(module, spec):
+    """Put the benchmark dataset into the dataset cache under the key of the pinned download.
+
+    training_flow/task1 then runs fully offline and the measurement covers the
+    checks and the write, not the network.
+    """
+    from flow_common.dataset_cache import DatasetCache
+    from flow_common.dataset_io import read_dataset
+
+    cache = DatasetCache()
+    key = cache.key(module.REPO_ID, module.FILENAME, module.REVISION, module.PREPROCESSING_VERSION)
+    cache.put(key, read_dataset(spec["dataset"]))
+
+
+SETUPS = {
+    "seed_dataset_cache": seed_dataset_cache,
+}
+
+
+def measure(spec):
+    sys.path.insert(0, str(REPO_ROOT / spec["flow"]))
+    sys.path.insert(1, str(REPO_ROOT))
+
+    start = time.perf_counter()
+    module = importlib.import_module(spec["module"])
+    import_seconds = time.perf_counter() - start
+
+    if spec.get("setup"):
+        SETUPS[spec["setup"]](module, spec)
+
+    kwargs = dict(spec.get("kwargs", {}))
+    for name in spec.get("path_kwargs", []):
+        kwargs[name] = Path(kwargs[name])
+
+    cpu_start, _ = _usage()
+    start = time.perf_counter()
+    module.main(**kwargs)
+    wall_seconds = time.perf_counter() - start
+    cpu_end, maxrss = _usage()
+
+    return {
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_end - cpu_start,
+        "peak_rss_mb": _rss_mb(maxrss),
+        "import_seconds": import_seconds,
+    }
+
+
+def main():
+    spec_path, result_path = sys.argv[1], sys.argv[2]
+    with open(spec_path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+
+    try:
+        result = {"ok": True, **measure(spec)}
+    except Exception:
+        traceback.print_exc()
+        result = {"ok": False, "error": traceback.format_exc(limit=3)}
+
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    sys.exit(0 if result["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Benchmark suite for the task functions of all flows.
+
+For every dataset size a synthetic dataset is generated (see
+``benchmarks.generate_dataset``) and the task functions run in flow order:
+
+* training_flow/task1 (dataset checks and write, downloaded dataset served from a warm cache),
+* training_flow/task2 and task3 (training and evaluation of one registered model),
+* training_flow/task2 in streaming mode (registered as a separate model),
+* abtest_flow/task1 and task2 (split and evaluation of arm A),
+* monitoring_flow/task1 once per drift mode.
+
+Every task runs in its own process (``benchmarks/measure.py``) against a
+throwaway MLflow tracking store and cache directory, and wall clock time, CPU
+time and peak RSS are saved as JSON. A saved file serves as the baseline of a
+later run::
+
+    python -m benchmarks.run --rows 10000 100000 1000000 --output baseline.json
+    python -m benchmarks.run --rows 10000 100000 1000000 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.compare import compare, print_comparison
+from benchmarks.generate_dataset import write_synthetic_dataset
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+MEASURE_SCRIPT = Path(__file__).resolve().parent / "measure.py"
+
+MODEL_NAME = "BenchmarkRandomForest"
+STREAMING_CHUNKSIZE = 100_000
+CUTOFF_YEAR = 2020
+DRIFT_MODES = ["evidently", "profile", "streaming"]
+
+
+def task_specs(workdir, dataset_name, drift_modes=DRIFT_MODES, partition_by_year=False):
+    """Name and measure.py spec of every benchmarked task, in the order the flows run them."""
+    stem, suffix = Path(dataset_name).stem, Path(dataset_name).suffix
+    dataset = str(workdir / dataset_name)
+    specs = [
+        ("training_flow/task1", {
+            "flow": "training_flow", "module": "task1", "setup": "seed_dataset_cache", "dataset": dataset,
+            "kwargs": {"output_dir": str(workdir), "outfile_name": f"{stem}_task1{suffix}", "report_name": f"{stem}_task1.html",
+                       "partition_by_year": partition_by_year},
+            "path_kwargs": ["output_dir"],
+        }),
+        ("training_flow/task2", {
+            "flow": "training_flow", "module": "task2",
+            "kwargs": {
+                "infile_dir": str(workdir), "infile_name": dataset_name, "model_name": MODEL_NAME,
+                "cutoff_year": CUTOFF_YEAR,
+                "hyperparameter_file": str(REPO_ROOT / "training_flow" / "model_hyperparameters.txt"),
+            },
+            "path_kwargs": ["infile_dir"],
+        }),
+        ("training_flow/task2[streaming]", {
+            "flow": "training_flow", "module": "task2",
+            "kwargs": {
+                "infile_dir": str(workdir), "infile_name": dataset_name, "model_name": f"{MODEL_NAME}Streaming",
+                "cutoff_year": CUTOFF_YEAR,
+                "hyperparameter_file": str(REPO_ROOT / "training_flow" / "model_hyperparameters.txt"),
+                "streaming": True, "chunksize": STREAMING_CHUNKSIZE,
+            },
+            "path_kwargs": ["infile_dir"],
+        }),
+        ("training_flow/task3", {
+            "flow": "training_flow", "module": "task3",
+            "kwargs": {"infile_dir": str(workdir), "infile_name": dataset_name, "model_name": MODEL_NAME, "cutoff_year": CUTOFF_YEAR},
+            "path_kwargs": ["infile_dir"],
+        }),
+        ("abtest_flow/task1", {
+            "flow": "abtest_flow", "module": "task1",
+            "kwargs": {"working_dir": str(workdir), "dataset_name": dataset_name, "cutoff_year": CUTOFF_YEAR},
+            "path_kwargs": ["working_dir"],
+        }),
+        ("abtest_flow/task2", {
+            "flow": "abtest_flow", "module": "task2",
+            "kwargs": {"working_dir": str(workdir), "dataset_name": f"{stem}_A{suffix}", "modelpath": f"models:/{MODEL_NAME}/latest"},
+            "path_kwargs": ["working_dir"],
+        }),
+    ]
+    for drift_mode in drift_modes:
+        specs.append((f"monitoring_flow/task1[{drift_mode}]", {
+            "flow": "monitoring_flow", "module": "task1",
+            "kwargs": {
+                "infile_dir": str(workdir), "infile_name": dataset_name, "report_name": f"{stem}_drift_{drift_mode}.html",
+                "model_name": MODEL_NAME, "cutoff_year": CUTOFF_YEAR, "drift_mode": drift_mode,
+            },
+            "path_kwargs": ["infile_dir"],
+        }))
+    return specs
+
+
+def run_task(name, spec, workdir, log_path):
+    spec_path, result_path = workdir / "spec.json", workdir / "result.json"
+    with open(spec_path, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+    result_path.unlink(missing_ok=True)
+
+    env = dict(
+        os.environ,
+        FLOW_CACHE_DIR=str(workdir / "cache"),
+        MLFLOW_TRACKING_URI=f"sqlite:///{workdir / 'mlflow.db'}",
+    )
+    with open(log_path, "a", encoding="utf-8") as log:
+        log.write(f"===== {name}\n")
+        log.flush()
+        subprocess.run(
+            [sys.executable, str(MEASURE_SCRIPT), str(spec_path), str(result_path)],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+
+    if not result_path.exists():
+        return {"ok": False, "error": f"No result written, see {log_path}"}
+    with open(result_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def summarize(runs):
+    """Median of the timings and maximum of the peak RSS over the repetitions of one task."""
+    ok_runs = [run for run in runs if run["ok"]]
+    if len(ok_runs) < len(runs):
+        return {"ok": False, "error": next(run["error"] for run in runs if not run["ok"])}
+    return {
+        "ok": True,
+        "wall_seconds": statistics.median(run["wall_seconds"] for run in runs),
+        "cpu_seconds": statistics.median(run["cpu_seconds"] for run in runs),
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "import_seconds": statistics.median(run["import_seconds"] for run in runs),
+        "runs": runs,
+    }
+
+
+def environment():
+    import numpy
+    import pandas
+    import sklearn
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "scikit-learn": sklearn.__version__,
+        "git_commit_hexsha": commit,
+    }
+
+
+def run_suite(rows, dataset_format="parquet", repeat=1, tasks=None, drift_modes=DRIFT_MODES, workdir=None, seed=0):
+    keep_workdir = workdir is not None
+    workdir = Path(workdir) if workdir is not None else Path(tempfile.mkdtemp(prefix="flow-benchmark-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    log_path = workdir / "benchmark.log"
+
+    results = []
+    try:
+        for n_rows in rows:
+            partition_by_year = dataset_format == "partitioned"
+            dataset_name = f"steam_games_{n_rows}.{'parquet' if partition_by_year else dataset_format}"
+            print(f"Generating {n_rows} rows into {workdir / dataset_name}")
+            write_synthetic_dataset(workdir / dataset_name, n_rows, seed=seed, partition_by_year=partition_by_year)
+
+            for name, spec in task_specs(workdir, dataset_name, drift_modes, partition_by_year):
+                if tasks is not None and not any(name.startswith(task) for task in tasks):
+                    continue
+                runs = [run_task(name, spec, workdir, log_path) for _ in range(repeat)]
+                result = {"task": name, "rows": n_rows, "format": dataset_format, **summarize(runs)}
+                results.append(result)
+                if result["ok"]:
+                    print(f"{name:<36} {n_rows:>10} rows  {result['wall_seconds']:8.2f}s wall  "
+                          f"{result['cpu_seconds']:8.2f}s cpu  {result['peak_rss_mb']:8.0f} MB peak RSS")
+                else:
+                    error = result["error"].strip().splitlines()[-1]
+                    print(f"{name:<36} {n_rows:>10} rows  FAILED: {error}")
+    finally:
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "created": datetime.now().isoformat(),
+        "environment": environment(),
+        "config": {"rows": rows, "format": dataset_format, "repeat": repeat, "seed": seed, "drift_modes": drift_modes},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the flow tasks on synthetic datasets")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--format", default="parquet", choices=["csv", "parquet", "feather", "partitioned"])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--tasks", nargs="+", help="Only run tasks whose name starts with one of these, e.g. training_flow "
+                             "(the evaluation tasks need the model registered by training_flow/task2)")
+    parser.add_argument("--drift-modes", nargs="+", default=DRIFT_MODES, choices=DRIFT_MODES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keep datasets, models and logs in this directory instead of a temporary one")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against the results in this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    report = run_suite(
+        args.rows, dataset_format=args.format, repeat=args.repeat, tasks=args.tasks,
+        drift_modes=args.drift_modes, workdir=args.workdir, seed=args.seed,
+    )
+
+    output = args.output or f"benchmark_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    failed = any(not result["ok"] for result in report["results"])
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(baseline, report, tolerance=args.tolerance)
+        print_comparison(rows)
+        failed = failed or any(row["regression"] for row in rows)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Cold start time of the flow entry points.
+
+``report`` imports a flow module in a fresh interpreter under ``-X importtime``
+and lists the packages that cost the most, ``check`` measures the wall clock
+time of a fresh interpreter importing each ``flow.py`` and fails if one of them
+exceeds the budget (``--budget`` or ``FLOW_STARTUP_BUDGET_SECONDS``, default 5s)::
+
+    python -m benchmarks.startup report training_flow
+    python -m benchmarks.startup check --budget 3
+
+The task modules only import mlflow, scikit-learn, scipy, evidently and
+huggingface_hub when a task function first needs them (prefect is still
+imported by every ``flow.py``, which defines the flow with it), so ``check``
+mostly guards against a heavy import creeping back to module level.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FLOWS = ["training_flow", "abtest_flow", "monitoring_flow", "backtest_flow"]
+DEFAULT_BUDGET_SECONDS = 5.0
+
+
+def _run_import(flow, module, importtime=False):
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", f"import {module}"]
+    # flow.py puts the repository root on sys.path itself, the task modules rely on it being there
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=REPO_ROOT / flow, env=env, capture_output=True, text=True)
+    return time.perf_counter() - start, completed
+
+
+def import_times(flow, module="flow"):
+    """Self and cumulative import time in seconds per module, in import order."""
+    _, completed = _run_import(flow, module, importtime=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {flow}/{module} failed:\n{completed.stderr.strip().splitlines()[-1]}")
+
+    times = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return times
+
+
+def report(flow, module="flow", top=20):
+    times = import_times(flow, module)
+    by_package = defaultdict(float)
+    for name, self_seconds, _ in times:
+        by_package[name.split(".")[0]] += self_seconds
+
+    total = sum(by_package.values())
+    print(f"{flow}/{module}: {total:.2f}s import time, {len(times)} modules")
+    for package, seconds in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<32} {seconds:7.3f}s  {seconds / total:6.1%}")
+
+
+def startup_time(flow, module="flow", repeat=3):
+    """Median wall clock time of a fresh interpreter importing ``module``."""
+    durations = []
+    for _ in range(repeat):
+        duration, completed = _run_import(flow, module)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Importing {flow}/{module} failed:\n{completed.stderr.strip().splitlines()[-1]}")
+        durations.append(duration)
+    return statistics.median(durations)
+
+
+def check(flows, module="flow", budget=DEFAULT_BUDGET_SECONDS, repeat=3):
+    """Print the startup time of every flow, return whether all stayed within ``budget``."""
+    within_budget = True
+    for flow in flows:
+        try:
+            duration = startup_time(flow, module, repeat)
+        except RuntimeError as e:
+            print(f"{flow:<20} FAILED  {e}")
+            within_budget = False
+            continue
+        ok = duration <= budget
+        within_budget = within_budget and ok
+        print(f"{flow:<20} {duration:6.2f}s  {'ok' if ok else f'over the budget of {budget:.2f}s'}")
+    return within_budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start time of the flows")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="Import time per package")
+    report_parser.add_argument("flows", nargs="*", default=FLOWS)
+    report_parser.add_argument("--module", default="flow", help="Module of the flow directory to import")
+    report_parser.add_argument("--top", type=int, default=20)
+
+    check_parser = subparsers.add_parser("check", help="Fail if a flow starts slower than the budget")
+    check_parser.add_argument("flows", nargs="*", default=FLOWS)
+    check_parser.add_argument("--module", default="flow", help="Module of the flow directory to import")
+    check_parser.add_argument("--budget", type=float,
+                              default=float(os.environ.get("FLOW_STARTUP_BUDGET_SECONDS", DEFAULT_BUDGET_SECONDS)))
+    check_parser.add_argument("--repeat", type=int, default=3)
+
+    args = parser.parse_args()
+    if args.command == "report":
+        for flow in args.flows:
+            report(flow, args.module, args.top)
+        return
+    sys.exit(0 if check(args.flows, args.module, args.budget, args.repeat) else 1)
+
+
+if __name__ == "__main__":
+    main()
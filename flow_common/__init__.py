@@ -0,0 +1,7 @@
+"""Helpers shared by the flows in this repository.
+
+Every flow directory is executed on its own (``python <flow>/flow.py '<json>'``),
+so each ``flow.py`` puts the repository root on ``sys.path`` to make this
+package importable from its task modules. ``flow_common.worker`` runs the same
+flows, started with the same JSON blob, in a long-lived process instead.
+"""
@@ -0,0 +1,96 @@
+"""Walk-forward backtest: one model per cutoff year, trained and evaluated in parallel.
+
+For every cutoff year a model is trained on the rows released before it and
+evaluated on the rows released in the ``horizon_years`` years from it on (all
+later rows for ``horizon_years=None``, like ``training_flow/task3``). The
+models are built from the hyperparameters like in ``training_flow/task2``,
+including the ``"estimator"`` backend (``flow_common.estimators``). The
+cutoffs run on a pool of worker processes, sized by the cores the host CPU
+budget grants (``flow_common.cpu``).
+
+The dataset is read and materialized once (``flow_common.feature_store``). The
+workers are started with the path of the materialized arrays and map the same
+files, so they share one copy of the features through the page cache instead
+of each receiving a pickled DataFrame; the training and evaluation rows of a
+cutoff are contiguous slices of the mapped arrays.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from flow_common.cpu import cpu_allocation
+from flow_common.estimators import split_params
+from flow_common.feature_store import FeatureStore, feature_store
+from flow_common.metrics import ConfusionMatrix
+
+
+MIN_TRAINING_ROWS = 1000
+
+_worker_store = None
+
+
+def _open_store(path):
+    global _worker_store
+    _worker_store = FeatureStore.open(path)
+
+
+def evaluate_cutoff(store, cutoff_year, params, horizon_years=1, n_jobs=1):
+    """Train on the rows before ``cutoff_year``, evaluate on the following ones; returns one result row."""
+    train_rows = store.before(cutoff_year)
+    test_rows = store.from_year(cutoff_year) if horizon_years is None else store.between(cutoff_year, cutoff_year + horizon_years)
+    result = {
+        "cutoff_year": cutoff_year,
+        "n_train": train_rows.stop - train_rows.start,
+        "n_test": max(0, test_rows.stop - test_rows.start),
+        "accuracy": np.nan, "balanced_accuracy": np.nan, "f1": np.nan, "fit_seconds": np.nan,
+    }
+    if result["n_train"] < MIN_TRAINING_ROWS or result["n_test"] == 0:
+        print(f"Skipping cutoff {cutoff_year}: {result['n_train']} training rows, {result['n_test']} test rows")
+        return result
+
+    # Trained on the label codes, so predictions and metrics need no label strings
+    start = time.perf_counter()
+    backend, estimator_params = split_params(params)
+    model = backend.make(estimator_params, n_jobs=n_jobs)
+    model.fit(store.X(train_rows), store.codes(train_rows))
+    result["fit_seconds"] = time.perf_counter() - start
+
+    matrix = ConfusionMatrix.from_codes(store.codes(test_rows), model.predict(store.X(test_rows)), store.labels)
+    result.update(matrix.metrics())
+    print(f"Cutoff {cutoff_year}: accuracy {result['accuracy']:.3f}, f1 {result['f1']:.3f} "
+          f"({result['n_train']} training rows, {result['n_test']} test rows)")
+    return result
+
+
+def _evaluate_in_worker(cutoff_year, params, horizon_years, n_jobs):
+    from threadpoolctl import threadpool_limits
+
+    # The OpenMP threads of e.g. gradient boosting stay within the share of the worker as well
+    with threadpool_limits(limits=n_jobs):
+        return evaluate_cutoff(_worker_store, cutoff_year, params, horizon_years, n_jobs)
+
+
+def run_backtest(dataset_path, cutoff_years, params, horizon_years=1, n_jobs=None):
+    """Result rows of every cutoff year, in the order of ``cutoff_years``.
+
+    ``n_jobs`` caps the cores requested from the host CPU budget (``None`` for
+    all); they are split between up to one worker process per cutoff.
+    """
+    cutoff_years = list(cutoff_years)
+    store = feature_store(dataset_path)
+
+    with cpu_allocation("backtest", want=n_jobs) as cores:
+        n_workers = max(1, min(cores, len(cutoff_years)))
+        fit_jobs = max(1, cores // n_workers)
+        if n_workers == 1:
+            return [evaluate_cutoff(store, year, params, horizon_years, fit_jobs) for year in cutoff_years]
+
+        # spawn instead of fork: the flows run with Prefect and mlflow threads in the parent
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(n_workers, mp_context=context, initializer=_open_store, initargs=(store.path,)) as pool:
+            futures = [
+                pool.submit(_evaluate_in_worker, year, params, horizon_years, fit_jobs) for year in cutoff_years
+            ]
+            return [future.result() for future in futures]
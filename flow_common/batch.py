@@ -0,0 +1,157 @@
+"""Run one flow for every parameter set of a JSONL file.
+
+Every line of the file is the JSON blob ``python <flow>/flow.py`` takes (see
+``flow_common.payload``), e.g. one line per cutoff year or seed of a sweep::
+
+    python -m flow_common.batch training_flow sweep.jsonl --concurrency 4 --output sweep.csv
+    python training_flow/flow.py --batch sweep.jsonl --concurrency 4
+
+The runs share one process: the flow and its libraries are imported once, and
+the model cache and the dataset read cache (``dataset_io.enable_read_cache``)
+serve all runs. With ``--address`` the runs are sent to a warm worker
+(``flow_common.worker``) instead, which then bounds the concurrency itself.
+
+At the end a CSV with one row per line is written: the status of the run, its
+flow_run_id and duration, joined with the metadata the flow recorded in the
+run ledger (``kwargs.*``, ``metrics.*`` and so on).
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flow_common.payload import parse_payload
+
+
+DEFAULT_CONCURRENCY = 2
+
+
+def read_payloads(path):
+    """``(line number, payload)`` of every non-empty line of a JSONL file; unparsable lines give the error as payload."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                json.loads(line)
+            except ValueError as e:
+                yield line_no, e
+                continue
+            yield line_no, line
+
+
+def local_runner(myflow_runner):
+    """Run a payload with ``myflow_runner`` in this process, like ``main()`` of the flow does."""
+    def run(payload):
+        args, kwargs, commit_id = parse_payload(payload)
+        kwargs.update({"commit_id": commit_id})
+        return myflow_runner(*args, **kwargs)
+    return run
+
+
+def worker_runner(flow_name, address):
+    from flow_common.worker import submit
+
+    def run(payload):
+        response = submit(flow_name, payload, address)
+        return response["flow_id"], response["artifact_id"]
+    return run
+
+
+def run_batch(runner, payloads, concurrency=DEFAULT_CONCURRENCY):
+    """Run every ``(line number, payload)`` with ``runner`` on up to ``concurrency`` threads.
+
+    Returns one result dict per payload, in input order. A failing run does not
+    stop the others.
+    """
+    def run_one(item):
+        line_no, payload = item
+        result = {"line": line_no, "payload": payload if isinstance(payload, str) else None,
+                  "status": "failed", "flow_id": None, "artifact_id": None, "seconds": None, "error": None}
+        if isinstance(payload, Exception):
+            result["error"] = f"Failed to parse args: {payload}"
+            print(f"[line {line_no}] failed: {result['error']}")
+            return result
+
+        start = time.perf_counter()
+        try:
+            flow_id, artifact_id = runner(payload)
+            result.update(status="ok", flow_id=str(flow_id), artifact_id=str(artifact_id))
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = time.perf_counter() - start
+        print(f"[line {line_no}] {result['status']} in {result['seconds']:.1f}s"
+              + (f": {result['error']}" if result["error"] else f", flow {result['flow_id']}"))
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(run_one, payloads))
+
+
+def results_table(results, ledger=None):
+    """The batch results joined with the ledger metadata of every successful run, as DataFrame."""
+    import pandas as pd
+
+    from flow_common.ledger import RunLedger
+
+    ledger = ledger if ledger is not None else RunLedger()
+    metadata = ledger.get_many(result["flow_id"] for result in results if result["flow_id"] is not None)
+
+    rows = []
+    for result in results:
+        recorded = dict(metadata.get(result["flow_id"], {}))
+        recorded.pop("flow_run_id", None)
+        recorded.pop("steps", None)
+        rows.append({**result, **recorded})
+
+    table = pd.json_normalize(rows)
+    # Lists (e.g. flow_run_ids of an N-arm test) are kept as JSON in their cell
+    for column in table.columns[table.dtypes == object]:
+        table[column] = table[column].map(lambda value: json.dumps(value) if isinstance(value, (list, dict)) else value)
+    return table
+
+
+def main(argv=None, flow_name=None, myflow_runner=None):
+    """Command line of the batch mode, also used by ``python <flow>/flow.py --batch``."""
+    parser = argparse.ArgumentParser(description="Run a flow for every parameter set of a JSONL file")
+    if flow_name is None:
+        parser.add_argument("flow", help="Flow directory, e.g. training_flow")
+    parser.add_argument("payloads", help="JSONL file with one {args, kwargs, commit_id} object per line")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--output", default=None, help="Results CSV, default batch_<flow>_<timestamp>.csv")
+    parser.add_argument("--address", default=None, help="Send the runs to the worker at this address")
+    parser.add_argument("--ledger", default=None, help="Path of the ledger database")
+    args = parser.parse_args(argv)
+    flow_name = flow_name or args.flow
+
+    if args.address is not None:
+        runner = worker_runner(flow_name, args.address)
+    else:
+        from flow_common.dataset_io import enable_read_cache
+
+        if myflow_runner is None:
+            from flow_common.worker import REPO_ROOT, load_flow
+
+            myflow_runner = load_flow(REPO_ROOT / flow_name).myflow_runner
+        enable_read_cache()
+        runner = local_runner(myflow_runner)
+
+    payloads = list(read_payloads(args.payloads))
+    print(f"Running {len(payloads)} parameter sets of {flow_name}, {args.concurrency} at a time")
+    results = run_batch(runner, payloads, args.concurrency)
+
+    from flow_common.ledger import RunLedger
+
+    output = args.output or f"batch_{flow_name}_{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+    results_table(results, RunLedger(args.ledger)).to_csv(output, index=False)
+
+    failed = sum(result["status"] != "ok" for result in results)
+    print(f"{len(results) - failed} of {len(results)} runs succeeded, results written to {output}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
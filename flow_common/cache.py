@@ -0,0 +1,72 @@
+"""Common pieces of the on-disk caches used by the flows.
+
+All caches live below one root directory, ``~/.cache/mlops_flows`` by default,
+which can be moved with the ``FLOW_CACHE_DIR`` environment variable (e.g. to a
+volume shared between flow containers).
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+
+def cache_root():
+    return Path(os.environ.get("FLOW_CACHE_DIR", Path.home() / ".cache" / "mlops_flows"))
+
+
+def cache_key(*parts):
+    """Stable hex digest of the JSON-serializable ``parts``."""
+    blob = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def entry_size(path):
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+def touch(path):
+    """Mark a cache entry as recently used."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict_lru(directory, max_bytes, keep=()):
+    """Delete the least recently used entries of ``directory`` until it fits in ``max_bytes``.
+
+    Entries are the files and folders directly inside ``directory``; names starting
+    with a dot are in-progress writes and are never evicted, neither are ``keep``.
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+
+    keep = {Path(p).name for p in keep}
+    entries = []
+    for path in directory.iterdir():
+        if path.name.startswith("."):
+            continue
+        try:
+            entries.append((path.stat().st_mtime, entry_size(path), path))
+        except FileNotFoundError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        if path.name in keep:
+            continue
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        total -= size
+        evicted.append(path)
+    return evicted
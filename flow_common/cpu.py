@@ -0,0 +1,184 @@
+"""Host-wide CPU budget for the flow tasks that run at the same time.
+
+Training, A/B tests and monitoring may run concurrently on one host, in separate
+processes or as threads of the worker (``flow_common.worker``). Without
+coordination every fit and prediction with ``n_jobs=-1`` starts a thread per
+core, and so do the BLAS / OpenMP pools, and the runs slow each other down.
+
+CPU heavy sections take a lease from the budget instead::
+
+    with cpu_allocation("training_flow/task2", want=params.get("n_jobs")) as cores:
+        model.fit(X, y)
+
+The budget is ``FLOW_CPU_BUDGET`` cores, by default the CPUs this process may
+run on. Leases of all processes of a host are kept in
+``FLOW_CACHE_DIR/cpu/<hostname>/leases.json`` and changed under a file lock;
+hosts or containers sharing the cache directory each have their own budget. A
+task gets the cores it wants (``None`` or ``-1`` for the whole budget) as long
+as they are free, otherwise the free rest, but at least one, so a task never
+waits for another one to finish. Leases of processes that died are dropped.
+
+Within the lease the default ``n_jobs`` of joblib, which sklearn estimators
+with ``n_jobs=None`` use, is the granted number of cores (for the calling
+thread), and the BLAS / OpenMP pools of the process are limited to the cores
+the process holds in total.
+"""
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from flow_common.cache import cache_root
+
+
+STALE_LEASE_SECONDS = 24 * 3600
+
+
+def cpu_budget():
+    if "FLOW_CPU_BUDGET" in os.environ:
+        return max(1, int(os.environ["FLOW_CPU_BUDGET"]))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def requested_cores(n_jobs, budget):
+    """Cores a task asks for with joblib's ``n_jobs`` convention (``None`` means as many as possible)."""
+    if n_jobs is None:
+        return budget
+    n_jobs = int(n_jobs)
+    if n_jobs < 0:
+        # -1 is all cores, -2 all but one and so on
+        return max(1, budget + 1 + n_jobs)
+    return max(1, n_jobs)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LeaseRegistry:
+    """The CPU leases of all processes on the host, in one JSON file guarded by a file lock."""
+
+    def __init__(self, directory=None):
+        self.host = socket.gethostname()
+        # Only processes of the same host share cores, and only they can be checked for being alive
+        self.directory = directory if directory is not None else cache_root() / "cpu" / self.host
+        self.path = self.directory / "leases.json"
+
+    @contextlib.contextmanager
+    def _locked(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / "leases.lock", "a+") as lock:
+            try:
+                import fcntl
+            except ImportError:
+                # No file locks on this platform, leases are still counted, but not atomically
+                fcntl = None
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield self._load()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                leases = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        now = time.time()
+        return {
+            lease_id: lease for lease_id, lease in leases.items()
+            if now - lease["since"] < STALE_LEASE_SECONDS and _pid_alive(lease["pid"])
+        }
+
+    def _save(self, leases):
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(leases, f)
+        os.replace(tmp_path, self.path)
+
+    def acquire(self, task, want, budget):
+        """Lease up to ``want`` cores of ``budget``, at least one; returns ``(lease id, cores)``."""
+        with self._locked() as leases:
+            free = budget - sum(lease["cores"] for lease in leases.values())
+            cores = max(1, min(want, free))
+            lease_id = uuid.uuid4().hex
+            leases[lease_id] = {"task": task, "cores": cores, "host": self.host, "pid": os.getpid(), "since": time.time()}
+            self._save(leases)
+        return lease_id, cores
+
+    def release(self, lease_id):
+        with self._locked() as leases:
+            leases.pop(lease_id, None)
+            self._save(leases)
+
+    def leases(self):
+        with self._locked() as leases:
+            return leases
+
+
+class _ProcessThreadLimit:
+    """Limits the BLAS / OpenMP pools of this process to the cores its leases hold together."""
+
+    def __init__(self):
+        self.cores = 0
+        self._limiter = None
+        self._lock = threading.Lock()
+
+    def change(self, delta):
+        with self._lock:
+            self.cores += delta
+            try:
+                from threadpoolctl import threadpool_limits
+            except ImportError:
+                return
+            if self.cores > 0:
+                # Leases granted beyond a full budget hold one core each, the pools stay within the budget
+                limiter = threadpool_limits(limits=min(self.cores, cpu_budget()))
+                # The first limiter remembers the limits from before any lease
+                self._limiter = self._limiter or limiter
+            elif self._limiter is not None:
+                self._limiter.restore_original_limits()
+                self._limiter = None
+
+
+_process_limit = _ProcessThreadLimit()
+
+
+@contextlib.contextmanager
+def cpu_allocation(task, want=None, registry=None):
+    """Lease cores for ``task`` for the duration of the block, yields the number of granted cores.
+
+    ``want`` follows the ``n_jobs`` convention of joblib, ``None`` asks for the
+    whole budget.
+    """
+    from joblib import parallel_config
+
+    registry = registry if registry is not None else LeaseRegistry()
+    budget = cpu_budget()
+    wanted = requested_cores(want, budget)
+    lease_id, cores = registry.acquire(task, wanted, budget)
+    if cores < wanted:
+        print(f"[{task}] running on {cores} of the {wanted} CPUs it asked for, the others are leased by other tasks")
+
+    _process_limit.change(cores)
+    try:
+        with parallel_config(n_jobs=cores):
+            yield cores
+    finally:
+        _process_limit.change(-cores)
+        registry.release(lease_id)
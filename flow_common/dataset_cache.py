@@ -0,0 +1,56 @@
+"""Content-addressed cache for preprocessed datasets.
+
+Entries are Parquet files named by a key derived from everything that determines
+their content (source repository, pinned revision, preprocessing version), so a
+hit can be returned without touching the network or redoing any preprocessing.
+The cache is bounded by ``FLOW_DATASET_CACHE_MAX_BYTES`` (default 2 GiB) and
+evicts the least recently used entries first.
+"""
+import os
+
+import pandas as pd
+
+from flow_common.cache import cache_key, cache_root, evict_lru, touch
+from flow_common.instrumentation import current_io
+
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+class DatasetCache:
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir if cache_dir is not None else cache_root() / "datasets"
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("FLOW_DATASET_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts):
+        return cache_key(*parts)
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.parquet"
+
+    def get(self, key):
+        path = self.path(key)
+        if not path.exists():
+            return None
+        touch(path)
+        dataset = pd.read_parquet(path)
+
+        io = current_io()
+        if io is not None:
+            io.add_read(rows=len(dataset), nbytes=path.stat().st_size, files=1)
+        return dataset
+
+    def put(self, key, dataset):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+
+        # Write under a hidden name first so concurrent readers never see a partial file
+        tmp_path = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+        dataset.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+
+        evict_lru(self.cache_dir, self.max_bytes, keep=[path])
+        return path
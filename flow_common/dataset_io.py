@@ -0,0 +1,377 @@
+"""Reading and writing of the intermediate Steam games dataset.
+
+The storage format is picked from the file suffix of the dataset name:
+
+* ``.csv`` keeps the original text format,
+* ``.parquet`` / ``.pq`` and ``.feather`` / ``.arrow`` store typed columns,
+  so readers get ``release_date`` back as a datetime column and can load only
+  the columns they need without parsing any text.
+
+Datasets are written and returned with the compact dtypes of
+``flow_common.schema`` whatever the format.
+
+``iter_dataset`` reads the same files in chunks of bounded size, and
+``write_dataset_chunks`` writes them from a stream of chunks.
+
+A dataset path can also be a directory partitioned by release year
+(``flow_common.partitions``), written with ``write_dataset(...,
+partition_by_year=True)``. ``read_dataset`` and ``iter_dataset`` take
+``before_year`` / ``from_year`` bounds on the release year: partitioned datasets only open the partitions on the needed side of the
+bound, Parquet files push the bound down to the row groups, and CSV and Feather
+files are filtered after reading. Like ``release_date.dt.year < cutoff_year``,
+a bound leaves out the rows without a release date.
+
+Rows and bytes moved by these functions are counted for the step instrumentation
+(see ``flow_common.instrumentation``).
+
+Processes that run many flows (the worker and the batch mode) call
+``enable_read_cache``, after which ``read_dataset`` keeps the DataFrames it read
+in memory, keyed by file, modification time and columns, and hands out copies
+of them, so runs over the same dataset parse it once.
+"""
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+from flow_common.cache import entry_size
+from flow_common.instrumentation import current_io
+from flow_common.partitions import MANIFEST, is_partitioned, partition_files, read_manifest, write_partitioned
+from flow_common.schema import DATE_COLUMN, TARGET_COLUMN, apply_schema
+
+
+_FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+
+def dataset_format(path):
+    if is_partitioned(path):
+        return "partitioned"
+    suffix = Path(path).suffix.lower()
+    try:
+        return _FORMATS[suffix]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported dataset format '{suffix}' for {path}, expected one of {sorted(_FORMATS)}"
+        )
+
+
+def _stored_bytes(path, fmt, columns):
+    """Bytes of ``path`` a reader of ``columns`` has to load (the whole file except for Parquet)."""
+    if fmt == "parquet" and columns is not None:
+        import pyarrow.parquet as pq
+
+        metadata = pq.ParquetFile(path).metadata
+        wanted = set(columns)
+        return sum(
+            row_group.column(i).total_compressed_size
+            for row_group in (metadata.row_group(r) for r in range(metadata.num_row_groups))
+            for i in range(row_group.num_columns)
+            if row_group.column(i).path_in_schema in wanted
+        )
+    return path.stat().st_size
+
+
+def _record_read(path, fmt, columns, rows, files=1):
+    io = current_io()
+    if io is not None:
+        io.add_read(rows=rows, nbytes=_stored_bytes(path, fmt, columns) if files else 0, files=files)
+
+
+def _record_written(path, rows):
+    io = current_io()
+    if io is not None:
+        io.add_written(rows=rows, nbytes=entry_size(path), files=1)
+
+
+class _ReadCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._datasets = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get_or_read(self, path, fmt, columns, years):
+        # A partitioned dataset is rewritten as a whole, together with its manifest
+        stat = (path / MANIFEST if fmt == "partitioned" else path).stat()
+        key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size, tuple(columns) if columns is not None else None, years)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent runs reading the same file wait for one read instead of parsing it twice
+        with key_lock:
+            with self._lock:
+                if key in self._datasets:
+                    self._datasets.move_to_end(key)
+                    dataset = self._datasets[key][0]
+                    _record_read(path, fmt, columns, len(dataset), files=0)
+                    return dataset.copy()
+
+            dataset = _read(path, fmt, columns, years)
+            size = int(dataset.memory_usage(deep=True).sum())
+            with self._lock:
+                self._datasets[key] = (dataset, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes and self._datasets:
+                    _, (_, evicted_size) = self._datasets.popitem(last=False)
+                    self._bytes -= evicted_size
+        return dataset.copy()
+
+
+DEFAULT_READ_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+_read_cache = None
+
+
+def enable_read_cache(max_bytes=None):
+    """Keep datasets read by ``read_dataset`` in memory, up to ``max_bytes`` (``FLOW_READ_CACHE_MAX_BYTES``, default 2 GiB)."""
+    global _read_cache
+    if max_bytes is None:
+        max_bytes = int(os.environ.get("FLOW_READ_CACHE_MAX_BYTES", DEFAULT_READ_CACHE_MAX_BYTES))
+    _read_cache = _ReadCache(max_bytes)
+
+
+def disable_read_cache():
+    global _read_cache
+    _read_cache = None
+
+
+def read_dataset(path, columns=None, before_year=None, from_year=None):
+    """Load the dataset at ``path``, restricted to ``columns`` if given.
+
+    Date columns are returned as ``datetime64`` regardless of the format. With
+    ``before_year`` / ``from_year`` only the rows released before / in or after
+    that year are returned.
+    """
+    path = Path(path)
+    fmt = dataset_format(path)
+    columns = list(columns) if columns is not None else None
+    years = (before_year, from_year)
+
+    read_cache = _read_cache
+    if read_cache is not None:
+        return read_cache.get_or_read(path, fmt, columns, years)
+    return _read(path, fmt, columns, years)
+
+
+def _read(path, fmt, columns, years=(None, None)):
+    if fmt == "partitioned":
+        return _read_partitioned(path, columns, years)
+
+    filtered = years != (None, None)
+    if fmt == "parquet":
+        dataset = pd.read_parquet(path, columns=columns, filters=_parquet_filters(*years))
+    else:
+        read_columns = _with_date_column(columns) if filtered else columns
+        if fmt == "feather":
+            dataset = pd.read_feather(path, columns=read_columns)
+        else:
+            dataset = pd.read_csv(path, index_col=False, usecols=read_columns, dtype=_csv_dtypes(read_columns))
+        if filtered:
+            dataset = dataset[_year_mask(apply_schema(dataset[[DATE_COLUMN]])[DATE_COLUMN], *years)]
+            dataset = dataset.reset_index(drop=True)
+        if columns is not None:
+            # usecols keeps the file order, the other formats return the requested order
+            dataset = dataset[columns]
+    dataset = apply_schema(dataset)
+
+    _record_read(path, fmt, columns, len(dataset))
+    return dataset
+
+
+def _read_partitioned(path, columns, years):
+    files = partition_files(path, *years)
+    if files:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # One conversion of all partitions; a dtype only some of them have (e.g. a float64 price) is widened
+        tables = [pq.read_table(file, columns=columns) for file in files]
+        dataset = apply_schema(pa.concat_tables(tables, promote_options="permissive").to_pandas())
+    else:
+        dataset = apply_schema(pd.DataFrame(columns=columns if columns is not None else read_manifest(path)["columns"]))
+
+    io = current_io()
+    if io is not None:
+        io.add_read(rows=len(dataset), nbytes=sum(_stored_bytes(file, "parquet", columns) for file in files),
+                    files=len(files))
+    return dataset
+
+
+def _with_date_column(columns):
+    return columns if columns is None or DATE_COLUMN in columns else [*columns, DATE_COLUMN]
+
+
+def _parquet_filters(before_year, from_year):
+    filters = []
+    if before_year is not None:
+        filters.append((DATE_COLUMN, "<", pd.Timestamp(year=before_year, month=1, day=1)))
+    if from_year is not None:
+        filters.append((DATE_COLUMN, ">=", pd.Timestamp(year=from_year, month=1, day=1)))
+    return filters or None
+
+
+def _year_mask(dates, before_year, from_year):
+    years = dates.dt.year
+    mask = years.notna()
+    if before_year is not None:
+        mask &= years < before_year
+    if from_year is not None:
+        mask &= years >= from_year
+    return mask.to_numpy()
+
+
+def _csv_dtypes(columns):
+    # Labels are parsed straight into a categorical, the numeric columns are converted after the read
+    return {TARGET_COLUMN: "category"} if columns is None or TARGET_COLUMN in columns else None
+
+
+def iter_dataset(path, columns=None, chunksize=100_000, before_year=None, from_year=None):
+    """Yield the dataset at ``path`` as DataFrames of at most ``chunksize`` rows.
+
+    ``before_year`` / ``from_year`` restrict the rows like for ``read_dataset``.
+    """
+    path = Path(path)
+    fmt = dataset_format(path)
+    columns = list(columns) if columns is not None else None
+    years = (before_year, from_year)
+
+    if fmt == "partitioned":
+        for file in partition_files(path, *years):
+            for i, chunk in enumerate(_iter_chunks(file, "parquet", columns, chunksize)):
+                chunk = apply_schema(chunk)
+                _record_read(file, "parquet", columns, len(chunk), files=int(i == 0))
+                yield chunk
+        return
+
+    if years == (None, None):
+        chunks = _iter_chunks(path, fmt, columns, chunksize)
+    elif fmt == "parquet":
+        chunks = _iter_parquet_filtered(path, columns, chunksize, years)
+    else:
+        chunks = _iter_filtered(_iter_chunks(path, fmt, _with_date_column(columns), chunksize), columns, years)
+
+    for i, chunk in enumerate(chunks):
+        chunk = apply_schema(chunk)
+        _record_read(path, fmt, columns, len(chunk), files=int(i == 0))
+        yield chunk
+
+
+def _iter_parquet_filtered(path, columns, chunksize, years):
+    import pyarrow.dataset as ds
+
+    # Row groups whose release_date statistics are all on the other side of the bound are skipped unread
+    expression = None
+    for column, op, value in _parquet_filters(*years):
+        condition = ds.field(column) < value if op == "<" else ds.field(column) >= value
+        expression = condition if expression is None else expression & condition
+    for batch in ds.dataset(path, format="parquet").to_batches(columns=columns, filter=expression, batch_size=chunksize):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def _iter_filtered(chunks, columns, years):
+    for chunk in chunks:
+        chunk = chunk[_year_mask(apply_schema(chunk[[DATE_COLUMN]])[DATE_COLUMN], *years)]
+        chunk = chunk.reset_index(drop=True)
+        yield chunk[columns] if columns is not None else chunk
+
+
+def _iter_chunks(path, fmt, columns, chunksize):
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    if fmt == "feather":
+        import pyarrow as pa
+
+        # Record batches of a memory-mapped Arrow file are only materialized when converted
+        reader = pa.ipc.open_file(pa.memory_map(str(path)))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for offset in range(0, batch.num_rows, chunksize):
+                yield batch.slice(offset, chunksize).to_pandas()
+        return
+
+    for chunk in pd.read_csv(path, index_col=False, usecols=columns, dtype=_csv_dtypes(columns), chunksize=chunksize):
+        yield chunk[columns] if columns is not None else chunk
+
+
+def write_dataset(dataset, path, partition_by_year=False):
+    """Write ``dataset`` to ``path``, as directory of one Parquet file per release year with ``partition_by_year``."""
+    path = Path(path)
+    if partition_by_year:
+        write_partitioned([dataset], path)
+        _record_written(path, len(dataset))
+        return
+
+    fmt = dataset_format(path)
+    dataset = apply_schema(dataset)
+
+    # Written next to the target and moved over it, so concurrent readers see either the old or the new file
+    tmp_path = path.parent / f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if fmt == "parquet":
+            dataset.to_parquet(tmp_path, index=False)
+        elif fmt == "feather":
+            dataset.reset_index(drop=True).to_feather(tmp_path)
+        else:
+            dataset.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    _record_written(path, len(dataset))
+
+
+def write_dataset_chunks(chunks, path):
+    """Write a stream of DataFrames with identical columns as one dataset file.
+
+    Only one chunk is held in memory at a time.
+    """
+    path = Path(path)
+    fmt = dataset_format(path)
+    chunks = (apply_schema(chunk) for chunk in chunks)
+
+    rows = 0
+    if fmt == "csv":
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+            rows += len(chunk)
+        _record_written(path, rows)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(path, schema) if fmt == "parquet" else pa.ipc.new_file(str(path), schema)
+            elif not table.schema.equals(schema):
+                # A later chunk may not fit a compact dtype the first one got, e.g. a price with more decimals
+                table = table.cast(schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    _record_written(path, rows)
@@ -0,0 +1,95 @@
+"""Streaming drift monitoring over time windows.
+
+The dataset is read in chunks, rows from ``cutoff_year`` on are assigned to a
+time window by ``release_date`` (monthly by default), and every window keeps
+mergeable per-column accumulators binned like the reference profile. Memory
+therefore depends on the number of windows and bins, not on the dataset size,
+and the result is a drift time series instead of a single snapshot.
+"""
+import numpy as np
+import pandas as pd
+
+from flow_common.dataset_io import iter_dataset
+from flow_common.profiles import ColumnAccumulator, compare_accumulators, reference_profile
+
+
+DEFAULT_CHUNKSIZE = 100_000
+REFERENCE_SAMPLE_SIZE = 200_000
+REFERENCE_SAMPLE_SEED = 0
+
+
+def reservoir_sample(chunks, sample_size, seed=0):
+    """Uniform sample of at most ``sample_size`` rows of a stream of DataFrames."""
+    rng = np.random.default_rng(seed)
+    sample, sample_keys = None, None
+    for chunk in chunks:
+        keys = rng.random(len(chunk))
+        if sample is not None:
+            chunk = pd.concat([sample, chunk], ignore_index=True)
+            keys = np.concatenate([sample_keys, keys])
+        # Keeping the rows with the smallest random keys is a uniform sample of everything seen
+        keep = np.argsort(keys, kind="stable")[:sample_size]
+        sample, sample_keys = chunk.iloc[keep].reset_index(drop=True), keys[keep]
+    return sample if sample is not None else pd.DataFrame()
+
+
+def streaming_drift(
+        dataset_path,
+        cutoff_year,
+        columns,
+        window="M",
+        rolling_windows=1,
+        chunksize=DEFAULT_CHUNKSIZE,
+):
+    """Drift time series of the rows from ``cutoff_year`` on against the pre-cutoff reference.
+
+    ``window`` is a pandas period frequency for the windows, ``rolling_windows``
+    merges that many consecutive windows into each data point. The reference
+    profile is built from a bounded uniform sample of the reference rows, and
+    cached apart from the exact profile of the profile drift mode.
+    """
+    read_columns = ['release_date', *columns]
+
+    def load_reference():
+        reference_chunks = iter_dataset(dataset_path, columns=read_columns, chunksize=chunksize, before_year=cutoff_year)
+        return reservoir_sample(reference_chunks, REFERENCE_SAMPLE_SIZE, seed=REFERENCE_SAMPLE_SEED)
+
+    method = f"reservoir_sample_{REFERENCE_SAMPLE_SIZE}_seed_{REFERENCE_SAMPLE_SEED}"
+    profile = reference_profile(dataset_path, cutoff_year, columns, load_reference, method=method)
+
+    windows = {}
+    for chunk in iter_dataset(dataset_path, columns=read_columns, chunksize=chunksize, from_year=cutoff_year):
+        periods = chunk.release_date.dt.to_period(window)
+        for period, rows in chunk.groupby(periods).indices.items():
+            accumulators = windows.setdefault(period, {
+                col: ColumnAccumulator(reference) for col, reference in profile["columns"].items()
+            })
+            for col, accumulator in accumulators.items():
+                accumulator.update(chunk[col].iloc[rows])
+
+    periods = sorted(windows)
+    series = []
+    for i, period in enumerate(periods):
+        merged = {col: ColumnAccumulator(reference) for col, reference in profile["columns"].items()}
+        for previous in periods[max(0, i - rolling_windows + 1):i + 1]:
+            for col, accumulator in windows[previous].items():
+                merged[col].merge(accumulator)
+
+        result = compare_accumulators(merged)
+        series.append({
+            "window": str(period),
+            "n_rows": result["n_rows"],
+            "n_drifted_columns": result["n_drifted_columns"],
+            "share_drifted_columns": result["share_drifted_columns"],
+            "dataset_drift": result["dataset_drift"],
+            **{f"jensenshannon_{col}": column["jensenshannon"] for col, column in result["columns"].items()},
+        })
+
+    return pd.DataFrame(series)
+
+
+def save_drift_timeseries_report(timeseries, path, title="Data drift per time window"):
+    n_drifted = int(timeseries["dataset_drift"].sum()) if len(timeseries) else 0
+    summary = f"<p>Windows: {len(timeseries)}, windows with dataset drift: {n_drifted}</p>"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"<html><head><title>{title}</title></head><body><h1>{title}</h1>{summary}{timeseries.to_html(index=False)}</body></html>")
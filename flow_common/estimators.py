@@ -0,0 +1,86 @@
+"""Estimators the training can use, picked by the ``"estimator"`` key of the hyperparameter file.
+
+* ``random_forest`` (the default): ``RandomForestClassifier``, parallel over the
+  trees through joblib (``n_jobs``). Fitted forests are also exported as
+  compiled forest for prediction (see ``flow_common.forest_engine``) and can
+  grow incrementally (``training_flow/incremental.py``).
+* ``hist_gradient_boosting``: ``HistGradientBoostingClassifier``. Every feature
+  is binned once into at most 255 buckets and the trees are grown over the bin
+  histograms, in OpenMP threads, so it fits much faster than deep forests on
+  large datasets and gives far smaller models.
+
+All other keys of the file are the parameters of the estimator. Both are plain
+sklearn classifiers predicting the label strings, so they are logged, registered
+and loaded with ``mlflow.sklearn`` and scored by ``flow_common.predictions``
+the same way.
+"""
+import importlib
+
+
+ESTIMATOR_KEY = "estimator"
+DEFAULT_ESTIMATOR = "random_forest"
+
+
+class EstimatorBackend:
+    def __init__(self, name, class_path, description, size_param, uses_n_jobs, compilable):
+        self.name = name
+        self.class_path = class_path
+        self.description = description
+        # The parameter successive halving grows by default, see training_flow/hyperparameter_search.py
+        self.size_param = size_param
+        self.uses_n_jobs = uses_n_jobs
+        self.compilable = compilable
+
+    @property
+    def estimator_class(self):
+        module, class_name = self.class_path.rsplit(".", 1)
+        return getattr(importlib.import_module(module), class_name)
+
+    def make(self, params, n_jobs=None):
+        """Unfitted estimator with ``params``.
+
+        Joblib parallel estimators get ``n_jobs`` (``None`` takes the cores of the
+        current ``flow_common.cpu`` allocation); the OpenMP threads of the others
+        are limited by the allocation directly.
+        """
+        params = dict(params)
+        if self.uses_n_jobs:
+            params["n_jobs"] = n_jobs
+        return self.estimator_class(**params)
+
+
+BACKENDS = {
+    backend.name: backend for backend in [
+        EstimatorBackend(
+            "random_forest", "sklearn.ensemble.RandomForestClassifier", "Basic RF model for steam games dataset",
+            size_param="n_estimators", uses_n_jobs=True, compilable=True,
+        ),
+        EstimatorBackend(
+            "hist_gradient_boosting", "sklearn.ensemble.HistGradientBoostingClassifier",
+            "Histogram gradient boosting model for steam games dataset",
+            size_param="max_iter", uses_n_jobs=False, compilable=False,
+        ),
+    ]
+}
+
+
+def get_backend(name=None):
+    name = name or DEFAULT_ESTIMATOR
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown estimator '{name}', expected one of {sorted(BACKENDS)}")
+
+
+def split_params(params):
+    """The backend named in the hyperparameters ``params`` and the parameters of its estimator."""
+    params = dict(params)
+    return get_backend(params.pop(ESTIMATOR_KEY, None)), params
+
+
+def backend_of(model):
+    """Backend of a fitted ``model``, or None for estimators of no backend."""
+    for backend in BACKENDS.values():
+        if type(model).__name__ == backend.class_path.rsplit(".", 1)[1]:
+            return backend
+    return None
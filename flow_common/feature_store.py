@@ -0,0 +1,185 @@
+"""Materialized model inputs of a dataset file, shared by the tasks of all flows.
+
+The first task that needs the features of a dataset file writes them once per
+dataset fingerprint to ``FLOW_CACHE_DIR/features/<key>/``:
+
+* ``X.npy``: ``FEATURE_COLUMNS`` as one C-contiguous float32 matrix, the dtype
+  the forests compute in anyway,
+* ``y.npy``: the codes of ``estimated_owners``, the labels are in ``meta.json``,
+* ``years.npy``: the release year of every dated row,
+* ``row_hashes.npy``: the content hash of every row (``schema.row_hashes``).
+
+Rows are sorted by release year, rows without a release date come last. Later
+tasks open the arrays with ``np.load(mmap_mode="r")``, so their pages are shared
+through the page cache, and the rows before / from a cutoff year are one
+contiguous slice found by ``np.searchsorted`` rather than a mask and a copy.
+Like the fancy-indexed frames this replaces, rows without a release date are in
+neither of the two slices.
+
+The store directory is bounded by ``FLOW_FEATURE_STORE_MAX_BYTES`` (default 8 GiB).
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from flow_common.cache import cache_key, cache_root, evict_lru, touch
+from flow_common.dataset_io import read_dataset
+from flow_common.fingerprint import dataset_fingerprint
+from flow_common.instrumentation import current_io
+from flow_common.schema import DATE_COLUMN, DTYPES, FEATURE_COLUMNS, TARGET_COLUMN, row_hashes
+
+
+FEATURE_STORE_VERSION = 1
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+ARRAYS = ("X", "y", "years", "row_hashes")
+
+ALL_ROWS = slice(None)
+
+
+class FeatureStore:
+    def __init__(self, arrays, meta, path=None):
+        self.arrays = arrays
+        self.meta = meta
+        self.labels = pd.Index(meta["labels"])
+        # Other processes open the same files to share the mapped pages, e.g. flow_common.backtest
+        self.path = path
+
+    @classmethod
+    def open(cls, path, mmap_mode="r"):
+        path = Path(path)
+        with open(path / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # np.memmap indexing goes through Python level __getitem__ overrides, plain views do not
+        arrays = {name: np.asarray(np.load(path / f"{name}.npy", mmap_mode=mmap_mode)) for name in ARRAYS}
+        return cls(arrays, meta, path)
+
+    def __len__(self):
+        return self.meta["n_rows"]
+
+    def before(self, cutoff_year):
+        """Rows released before ``cutoff_year``."""
+        return slice(0, int(np.searchsorted(self.arrays["years"], cutoff_year, side="left")))
+
+    def from_year(self, cutoff_year):
+        """Rows released in or after ``cutoff_year``."""
+        return slice(int(np.searchsorted(self.arrays["years"], cutoff_year, side="left")), self.meta["n_dated"])
+
+    def between(self, first_year, end_year):
+        """Rows released in ``first_year`` up to, not including, ``end_year``."""
+        return slice(self.from_year(first_year).start, self.before(end_year).stop)
+
+    def _record_read(self, array):
+        io = current_io()
+        if io is not None:
+            io.add_read(rows=len(array), nbytes=array.nbytes)
+
+    def X(self, rows=ALL_ROWS):
+        """Features of ``rows`` as float32 DataFrame, a view of the mapped matrix."""
+        values = self.arrays["X"][rows]
+        self._record_read(values)
+        return pd.DataFrame(values, columns=self.meta["feature_columns"], copy=False)
+
+    def codes(self, rows=ALL_ROWS):
+        return self.arrays["y"][rows]
+
+    def y(self, rows=ALL_ROWS):
+        """Labels of ``rows`` as categorical Series."""
+        labels = pd.Categorical.from_codes(self.codes(rows), dtype=pd.CategoricalDtype(self.labels, ordered=True))
+        return pd.Series(labels, name=TARGET_COLUMN)
+
+    def row_hashes(self, rows=ALL_ROWS):
+        return self.arrays["row_hashes"][rows]
+
+    def frame(self, rows=ALL_ROWS):
+        """Features of ``rows`` with the dtypes of ``flow_common.schema``, e.g. for the drift tests (a copy)."""
+        X = self.X(rows)
+        return pd.DataFrame({
+            column: X[column] != 0 if np.issubdtype(DTYPES[column], np.bool_) else X[column].astype(DTYPES[column])
+            for column in X.columns
+        })
+
+
+def _materialize(dataset_path, dated, path):
+    columns = [*FEATURE_COLUMNS, TARGET_COLUMN, *([DATE_COLUMN] if dated else [])]
+    dataset = read_dataset(dataset_path, columns=columns)
+
+    if dated:
+        years = dataset[DATE_COLUMN].dt.year.to_numpy()
+        is_dated = ~np.isnan(years)
+        dated_rows = np.flatnonzero(is_dated)
+        order = np.concatenate([dated_rows[np.argsort(years[dated_rows], kind="stable")], np.flatnonzero(~is_dated)])
+        years = years[order[:len(dated_rows)]].astype(np.int16)
+    else:
+        order = np.arange(len(dataset))
+        years = np.empty(0, dtype=np.int16)
+
+    target = dataset[TARGET_COLUMN].cat
+    code_dtype = np.int8 if len(target.categories) < np.iinfo(np.int8).max else np.int16
+    arrays = {
+        "X": np.ascontiguousarray(dataset[FEATURE_COLUMNS].to_numpy(dtype=np.float32)[order]),
+        "y": target.codes.to_numpy().astype(code_dtype)[order],
+        "years": years,
+        "row_hashes": row_hashes(dataset[[*FEATURE_COLUMNS, TARGET_COLUMN]])[order],
+    }
+    meta = {
+        "version": FEATURE_STORE_VERSION,
+        "dataset_fingerprint": dataset_fingerprint(dataset_path),
+        "n_rows": len(dataset),
+        "n_dated": len(years) if dated else len(dataset),
+        "feature_columns": FEATURE_COLUMNS,
+        "labels": [str(label) for label in target.categories],
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".", dir=path.parent))
+    for name, array in arrays.items():
+        np.save(tmp_dir / f"{name}.npy", array)
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    try:
+        os.replace(tmp_dir, path)
+    except OSError:
+        # Another process materialized the same dataset in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_key_locks = {}
+
+
+def feature_store(dataset_path, dated=True):
+    """The materialized features of the dataset at ``dataset_path``, written on first use.
+
+    ``dated=False`` is for datasets without a release date column, e.g. the arm
+    datasets of an A/B test; all their rows count as dated.
+    """
+    key = cache_key(dataset_fingerprint(dataset_path), dated, FEATURE_COLUMNS, FEATURE_STORE_VERSION)
+
+    with _stores_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        with _stores_lock:
+            if key in _stores:
+                return _stores[key]
+
+        directory = cache_root() / "features"
+        path = directory / key
+        if path.exists():
+            touch(path)
+        else:
+            _materialize(dataset_path, dated, path)
+            max_bytes = int(os.environ.get("FLOW_FEATURE_STORE_MAX_BYTES", DEFAULT_MAX_BYTES))
+            evict_lru(directory, max_bytes, keep=[path])
+
+        store = FeatureStore.open(path)
+        with _stores_lock:
+            _stores[key] = store
+    return store
@@ -0,0 +1,42 @@
+"""Content fingerprints of dataset files.
+
+The fingerprint is the SHA-256 of the file content. It is memoized per process
+by (path, size, mtime), so asking several times for an unchanged file reads it once.
+"""
+import hashlib
+import threading
+from pathlib import Path
+
+
+_CHUNK_SIZE = 1 << 20
+
+_fingerprints = {}
+_lock = threading.Lock()
+
+
+def _hash_file(path, digest):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+
+def dataset_fingerprint(path):
+    """Hex digest identifying the content of the dataset at ``path`` (a file or a directory of files)."""
+    path = Path(path).resolve()
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    stats = tuple((str(f), f.stat().st_size, f.stat().st_mtime_ns) for f in files)
+
+    with _lock:
+        if stats in _fingerprints:
+            return _fingerprints[stats]
+
+    digest = hashlib.sha256()
+    for f in files:
+        if path.is_dir():
+            digest.update(str(f.relative_to(path)).encode("utf-8"))
+        _hash_file(f, digest)
+    fingerprint = digest.hexdigest()
+
+    with _lock:
+        _fingerprints[stats] = fingerprint
+    return fingerprint
@@ -0,0 +1,302 @@
+"""Array-backed inference engine for fitted RandomForestClassifier models.
+
+``compile_forest`` flattens all trees of a forest into a few contiguous arrays
+(split feature, threshold, children, leaf class distributions). ``CompiledForest``
+stores them as plain ``.npy`` files that are opened with a memory map and
+predicts by walking all trees of a block of rows at once with numpy.
+
+Every row reaches the same leaves as in sklearn: sklearn compares float32
+inputs against float64 thresholds, so storing thresholds as float32 rounded
+*down* (the largest float32 not above the threshold) or as ranks within the
+sorted thresholds of each feature ("quantized") gives exactly the same splits.
+Leaf distributions are kept in float64 as sklearn stores them (class counts of
+older sklearn versions are normalized like their ``predict_proba``) and summed
+tree by tree in the same order, so probabilities and classes are identical to
+sklearn's.
+
+The array walk pays off for small batches, up to about a thousand rows; larger
+ones are faster with sklearn (see ``flow_common.predictions``).
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from flow_common.cache import cache_key, cache_root, evict_lru, touch
+from flow_common.model_cache import DEFAULT_DISK_MAX_BYTES
+
+
+THRESHOLD_MODES = ("float64", "float32", "quantized")
+COMPILED_ARTIFACT = "compiled_forest"
+
+# (row, tree) pairs traversed at once, and whose leaves are accumulated at once
+_BLOCK_SIZE = 1 << 14
+_CHUNK_SIZE = 1 << 22
+_ARRAYS = ("feature", "threshold", "left", "missing_go_to_left", "leaf_index", "leaf_proba", "roots")
+
+
+def _round_down_to_float32(values):
+    rounded = values.astype(np.float32)
+    too_large = rounded.astype(np.float64) > values
+    rounded[too_large] = np.nextafter(rounded[too_large], np.float32(-np.inf))
+    return rounded
+
+
+def _sibling_order(tree):
+    """Node ids of ``tree`` level by level, with the two children of every split next to each other."""
+    order, level = [np.array([0])], np.array([0])
+    while len(level):
+        level = level[tree.children_left[level] != -1]
+        level = np.stack([tree.children_left[level], tree.children_right[level]], axis=1).ravel()
+        order.append(level)
+    return np.concatenate(order)
+
+
+def compile_forest(model, threshold_mode="float32"):
+    """Flatten a fitted RandomForestClassifier into a CompiledForest.
+
+    Nodes are renumbered so that the right child of a split directly follows its
+    left child and leaves point to themselves, which turns every traversal step
+    into ``node = left[node] + (x > threshold[node])``.
+    """
+    if threshold_mode not in THRESHOLD_MODES:
+        raise ValueError(f"Unknown threshold_mode '{threshold_mode}', expected one of {THRESHOLD_MODES}")
+    if getattr(model, "n_outputs_", 1) != 1:
+        raise ValueError("Only single-output forests can be compiled")
+
+    features, thresholds, lefts, missing_left, leaf_indices, leaf_probas, roots = [], [], [], [], [], [], []
+    node_offset, leaf_offset = 0, 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        order = _sibling_order(tree)
+        new_id = np.empty(tree.node_count, dtype=np.int64)
+        new_id[order] = np.arange(tree.node_count)
+        is_leaf = tree.children_left[order] == -1
+
+        # sklearn >= 1.4 stores the class fractions, which are kept as they are; only leaves
+        # of older versions, which store class counts, are normalized like their predict_proba
+        proba = tree.value[order[is_leaf], 0, :]
+        normalizer = proba.sum(axis=1)
+        counts = (normalizer > 0.0) & ~np.isclose(normalizer, 1.0, rtol=0.0, atol=1e-12)
+        proba[counts] /= normalizer[counts, np.newaxis]
+        leaf_probas.append(proba)
+
+        leaf_index = np.full(tree.node_count, -1, dtype=np.int32)
+        leaf_index[is_leaf] = leaf_offset + np.arange(is_leaf.sum())
+        leaf_indices.append(leaf_index)
+
+        left = np.where(is_leaf, np.arange(tree.node_count), new_id[np.maximum(tree.children_left[order], 0)])
+        lefts.append((left + node_offset).astype(np.int32))
+        features.append(np.where(is_leaf, 0, tree.feature[order]).astype(np.int16))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold[order]))
+        missing = getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=bool))
+        missing_left.append(np.asarray(missing, dtype=bool)[order] | is_leaf)
+        roots.append(node_offset)
+
+        node_offset += tree.node_count
+        leaf_offset += int(is_leaf.sum())
+
+    arrays = {
+        "feature": np.concatenate(features),
+        "left": np.concatenate(lefts),
+        "missing_go_to_left": np.concatenate(missing_left),
+        "leaf_index": np.concatenate(leaf_indices),
+        "leaf_proba": np.concatenate(leaf_probas),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    threshold = np.concatenate(thresholds)
+    is_split = arrays["leaf_index"] < 0
+    n_features = int(model.n_features_in_)
+
+    if threshold_mode == "float64":
+        arrays["threshold"] = threshold
+    elif threshold_mode == "float32":
+        arrays["threshold"] = _round_down_to_float32(threshold)
+    else:
+        # Rank of every threshold within the sorted distinct thresholds of its feature;
+        # leaves get the largest rank so that every row stays in them
+        tables = [np.unique(threshold[is_split & (arrays["feature"] == f)]) for f in range(n_features)]
+        rank_dtype = np.uint16 if max(map(len, tables), default=0) < np.iinfo(np.uint16).max else np.uint32
+        ranks = np.full(len(threshold), np.iinfo(rank_dtype).max, dtype=rank_dtype)
+        for f, table in enumerate(tables):
+            nodes = is_split & (arrays["feature"] == f)
+            ranks[nodes] = np.searchsorted(table, threshold[nodes])
+        arrays["threshold"] = ranks
+        arrays["quant_table"] = np.concatenate(tables)
+        arrays["quant_offsets"] = np.cumsum([0] + [len(t) for t in tables]).astype(np.int64)
+
+    meta = {
+        "threshold_mode": threshold_mode,
+        "n_features": n_features,
+        "feature_names": [str(f) for f in getattr(model, "feature_names_in_", [])],
+        "classes": np.asarray(model.classes_).tolist(),
+        "classes_dtype": np.asarray(model.classes_).dtype.str,
+        "max_depth": int(max(e.tree_.max_depth for e in model.estimators_)),
+    }
+    return CompiledForest(arrays, meta)
+
+
+class CompiledForest:
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.classes_ = np.asarray(meta["classes"], dtype=np.dtype(meta["classes_dtype"]))
+        self.feature_names_in_ = meta["feature_names"] or None
+        self.n_estimators = len(arrays["roots"])
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(path / f"{name}.npy", np.ascontiguousarray(array))
+        with open(path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        path = Path(path)
+        with open(path / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        names = list(_ARRAYS)
+        if meta["threshold_mode"] == "quantized":
+            names += ["quant_table", "quant_offsets"]
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in names}
+        return cls(arrays, meta)
+
+    def _as_features(self, X):
+        if self.feature_names_in_ is not None and hasattr(X, "columns"):
+            X = X[self.feature_names_in_]
+        # sklearn evaluates all splits on float32 inputs
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.meta["n_features"]:
+            raise ValueError(f"Expected {self.meta['n_features']} features, got array of shape {X.shape}")
+        return X
+
+    def _quantize(self, X):
+        table, offsets = self.arrays["quant_table"], self.arrays["quant_offsets"]
+        codes = np.empty(X.shape, dtype=self.arrays["threshold"].dtype)
+        for f in range(X.shape[1]):
+            # x <= t_k  <=>  (number of thresholds below x) <= k
+            codes[:, f] = np.searchsorted(table[offsets[f]:offsets[f + 1]], X[:, f], side="left")
+        return codes
+
+    def _leaves(self, X):
+        """Leaf node of every (row, tree) pair of a block of rows."""
+        feature, threshold, left = (np.asarray(self.arrays[name]) for name in ("feature", "threshold", "left"))
+
+        values = self._quantize(X) if self.meta["threshold_mode"] == "quantized" else X
+        values, raw = values.ravel(), X.ravel()
+        has_missing = np.isnan(raw).any()
+        row_offsets = (np.arange(len(X), dtype=np.int32) * X.shape[1])[:, np.newaxis]
+        node = np.tile(np.asarray(self.arrays["roots"]), (len(X), 1))
+
+        for _ in range(self.meta["max_depth"]):
+            position = row_offsets + np.take(feature, node)
+            go_right = np.take(values, position) > np.take(threshold, node)
+            if has_missing:
+                missing_go_to_left = np.asarray(self.arrays["missing_go_to_left"])
+                go_right = np.where(np.isnan(np.take(raw, position)), ~np.take(missing_go_to_left, node), go_right)
+            node = np.take(left, node) + go_right
+        return node
+
+    def predict_proba(self, X):
+        X = self._as_features(X)
+        leaf_index, leaf_proba = np.asarray(self.arrays["leaf_index"]), np.asarray(self.arrays["leaf_proba"])
+        proba = np.zeros((len(X), len(self.classes_)), dtype=np.float64)
+        block_rows = max(1, _BLOCK_SIZE // self.n_estimators)
+        chunk_rows = max(1, _CHUNK_SIZE // self.n_estimators)
+        for start in range(0, len(X), chunk_rows):
+            X_chunk = X[start:start + chunk_rows]
+            leaves = np.concatenate([
+                self._leaves(X_chunk[block:block + block_rows]) for block in range(0, len(X_chunk), block_rows)
+            ])
+            leaves = np.take(leaf_index, leaves.T)
+            chunk = proba[start:start + chunk_rows]
+            # Summed tree by tree, in the same order as sklearn
+            for tree_leaves in leaves:
+                chunk += np.take(leaf_proba, tree_leaves, axis=0)
+        proba /= self.n_estimators
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+def log_compiled_forest(model, threshold_mode="float32"):
+    """Compile ``model`` and log it as an artifact of the active MLflow run."""
+    import mlflow
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        compile_forest(model, threshold_mode=threshold_mode).save(tmp_dir)
+        mlflow.log_artifacts(tmp_dir, artifact_path=COMPILED_ARTIFACT)
+
+
+def _run_id(resolved_uri):
+    from mlflow.tracking import MlflowClient
+
+    if resolved_uri.startswith("models:/"):
+        name, version = resolved_uri[len("models:/"):].rsplit("/", 1)
+        return MlflowClient().get_model_version(name, version).run_id
+    if resolved_uri.startswith("runs:/"):
+        return resolved_uri[len("runs:/"):].split("/", 1)[0]
+    return None
+
+
+def _download_compiled(run_id):
+    import mlflow
+    from mlflow.exceptions import MlflowException
+
+    path = cache_root() / "compiled" / cache_key(mlflow.get_tracking_uri(), run_id)
+    if path.exists():
+        touch(path)
+        return path
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".", dir=path.parent))
+    try:
+        downloaded = mlflow.artifacts.download_artifacts(
+            run_id=run_id, artifact_path=COMPILED_ARTIFACT, dst_path=str(tmp_dir)
+        )
+        if not (Path(downloaded) / "meta.json").exists():
+            return None
+        try:
+            os.replace(downloaded, path)
+        except OSError:
+            # Another process stored the same forest in the meantime
+            pass
+    except (MlflowException, OSError):
+        # Models registered before compiled forests were exported have no such artifact
+        return None
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    disk_max_bytes = int(os.environ.get("FLOW_MODEL_DISK_CACHE_MAX_BYTES", DEFAULT_DISK_MAX_BYTES))
+    evict_lru(path.parent, disk_max_bytes, keep=[path])
+    return path
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def load_compiled_forest(resolved_uri):
+    """Memory-mapped compiled forest logged in the run of ``resolved_uri``, or None.
+
+    ``resolved_uri`` has to be immutable (see ``resolve_model_uri``); local model
+    paths have no run and always give None.
+    """
+    with _compiled_lock:
+        if resolved_uri in _compiled:
+            return _compiled[resolved_uri]
+
+    run_id = _run_id(resolved_uri)
+    path = _download_compiled(run_id) if run_id is not None else None
+    forest = CompiledForest.load(path) if path is not None else None
+
+    with _compiled_lock:
+        _compiled[resolved_uri] = forest
+    return forest
@@ -0,0 +1,229 @@
+"""Resource instrumentation of the flow steps.
+
+``instrumented`` wraps a step function and records per call:
+
+* wall clock and CPU time (CPU time of the whole process, so steps running
+  concurrently, like the arms of an A/B test, see each other's work),
+* RSS at the start and peak RSS while the step ran, sampled in a background
+  thread, plus the peak of the Python allocations traced by tracemalloc if
+  ``FLOW_TRACEMALLOC=1`` (tracing slows allocation-heavy code down noticeably),
+* rows and bytes read and written through ``flow_common.dataset_io``.
+
+The records of all steps of a flow run are collected in the dict returned by
+``record_steps`` and end up in the flow metadata; ``export_step_metrics`` also
+logs them as metrics of an MLflow run and writes them in the Prometheus text
+format to ``FLOW_METRICS_DIR/<flow name>.prom`` (default ``FLOW_CACHE_DIR/metrics``),
+a directory the node exporter textfile collector can pick up.
+"""
+import contextvars
+import functools
+import inspect
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from flow_common.cache import cache_root
+
+
+RSS_SAMPLE_INTERVAL = 0.05
+
+_steps = contextvars.ContextVar("flow_steps", default=None)
+_io = contextvars.ContextVar("flow_step_io", default=None)
+
+
+class IOCounters:
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_written = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.files_read = 0
+        self.files_written = 0
+        self._lock = threading.Lock()
+
+    def add_read(self, rows=0, nbytes=0, files=0):
+        with self._lock:
+            self.rows_read += rows
+            self.bytes_read += nbytes
+            self.files_read += files
+
+    def add_written(self, rows=0, nbytes=0, files=0):
+        with self._lock:
+            self.rows_written += rows
+            self.bytes_written += nbytes
+            self.files_written += files
+
+    def as_dict(self):
+        return {
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "files_read": self.files_read,
+            "files_written": self.files_written,
+        }
+
+
+def current_io():
+    """IO counters of the step running in this context, or None outside of instrumented steps."""
+    return _io.get()
+
+
+def record_steps():
+    """Start collecting the records of all instrumented steps called from this context.
+
+    Returns the dict the records are added to, keyed by step name.
+    """
+    steps = {}
+    _steps.set(steps)
+    return steps
+
+
+def _current_rss():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs: fall back to the peak RSS of the process so far
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class _RSSSampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_rss = _current_rss()
+        self.peak_rss = self.start_rss
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(RSS_SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, _current_rss())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak_rss = max(self.peak_rss, _current_rss())
+
+
+def _step_name(name, func, args, kwargs):
+    if name is None:
+        return func.__name__
+    try:
+        bound = inspect.signature(func).bind_partial(*args, **kwargs)
+        return name.format(**bound.arguments)
+    except (TypeError, KeyError, IndexError):
+        return name
+
+
+def instrumented(name=None):
+    """Decorator recording the resources used by every call of a step function.
+
+    ``name`` defaults to the function name and may reference its arguments,
+    e.g. ``"evaluate_arm_{arm}"``. Apply it below ``@task`` so the Prefect task
+    runs the instrumented function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            step = _step_name(name, func, args, kwargs)
+            io = IOCounters()
+            io_token = _io.set(io)
+
+            trace = os.environ.get("FLOW_TRACEMALLOC") == "1"
+            if trace:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+
+            sampler = _RSSSampler()
+            sampler.start()
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                wall_seconds = time.perf_counter() - wall_start
+                cpu_seconds = time.process_time() - cpu_start
+                sampler.stop()
+                _io.reset(io_token)
+
+                record = {
+                    "wall_seconds": wall_seconds,
+                    "cpu_seconds": cpu_seconds,
+                    "rss_start_bytes": sampler.start_rss,
+                    "peak_rss_bytes": sampler.peak_rss,
+                    **io.as_dict(),
+                    "failed": failed,
+                }
+                if trace:
+                    record["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+
+                print(f"[{step}] {wall_seconds:.2f}s wall, {cpu_seconds:.2f}s CPU, "
+                      f"peak RSS {sampler.peak_rss / 1024 ** 2:.0f} MB, "
+                      f"{io.rows_read} rows read, {io.rows_written} rows written")
+
+                steps = _steps.get()
+                if steps is not None:
+                    steps[step] = record
+        return wrapper
+    return decorator
+
+
+def _metric_values(steps):
+    for step, record in steps.items():
+        for metric, value in record.items():
+            yield step, metric, float(value)
+
+
+def log_step_metrics_to_mlflow(flow_name, flow_run_id, steps, experiment_name="MLOpsEx3"):
+    import mlflow
+
+    mlflow.set_experiment(experiment_name)
+    with mlflow.start_run(run_name=f"{flow_name} steps"):
+        mlflow.set_tag("flow_name", flow_name)
+        mlflow.set_tag("flow_run_id", flow_run_id)
+        mlflow.log_metrics({f"{step}.{metric}": value for step, metric, value in _metric_values(steps)})
+
+
+def prometheus_text(flow_name, steps):
+    """The step records of one flow run in the Prometheus text exposition format."""
+    by_metric = {}
+    for step, metric, value in _metric_values(steps):
+        by_metric.setdefault(metric, []).append((step, value))
+
+    lines = []
+    for metric, values in by_metric.items():
+        metric_name = f"flow_step_{metric}"
+        lines.append(f"# HELP {metric_name} {metric.replace('_', ' ')} of the last run of a flow step")
+        lines.append(f"# TYPE {metric_name} gauge")
+        for step, value in values:
+            lines.append(f'{metric_name}{{flow="{flow_name}",step="{step}"}} {value!r}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(flow_name, steps, directory=None):
+    directory = Path(directory or os.environ.get("FLOW_METRICS_DIR", cache_root() / "metrics"))
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{flow_name}.prom"
+
+    # The collector may read at any time, so replace the file atomically
+    tmp_path = directory / f".{flow_name}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(flow_name, steps))
+    os.replace(tmp_path, path)
+    return path
+
+
+def export_step_metrics(flow_name, flow_run_id, steps):
+    """Log the step records of a flow run to MLflow and the Prometheus textfile."""
+    if not steps:
+        return
+    log_step_metrics_to_mlflow(flow_name, flow_run_id, steps)
+    write_prometheus_textfile(flow_name, steps)
@@ -0,0 +1,144 @@
+"""Indexed local ledger of flow run metadata.
+
+Every flow records the metadata it also publishes as Prefect artifact in an
+SQLite database (``Flow_Ledger.sqlite`` in the working directory, or
+``FLOW_LEDGER_PATH``). Runs are keyed by flow_run_id, and the columns needed
+for model selection are indexed, e.g.::
+
+    python -m flow_common.ledger best --cutoff-year 2020 --metric f1
+"""
+import argparse
+import json
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+
+METRICS = ("accuracy", "balanced_accuracy", "f1")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flow_runs (
+    flow_run_id TEXT PRIMARY KEY,
+    flow_name TEXT NOT NULL,
+    cutoff_year INTEGER,
+    model_path_full TEXT,
+    accuracy REAL,
+    balanced_accuracy REAL,
+    f1 REAL,
+    git_commit_hexsha TEXT,
+    timestamp_start TEXT,
+    timestamp_end TEXT,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_flow_runs_f1 ON flow_runs (flow_name, cutoff_year, f1);
+CREATE INDEX IF NOT EXISTS idx_flow_runs_accuracy ON flow_runs (flow_name, cutoff_year, accuracy);
+CREATE INDEX IF NOT EXISTS idx_flow_runs_balanced_accuracy ON flow_runs (flow_name, cutoff_year, balanced_accuracy);
+"""
+
+
+def default_ledger_path():
+    return Path(os.environ.get("FLOW_LEDGER_PATH", "Flow_Ledger.sqlite"))
+
+
+class RunLedger:
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else default_ledger_path()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def record(self, flow_name, metadata):
+        """Insert or replace the metadata of one flow run."""
+        kwargs = metadata.get("kwargs", {})
+        metrics = metadata.get("metrics", {})
+        row = (
+            str(metadata["flow_run_id"]),
+            flow_name,
+            kwargs.get("cutoff_year"),
+            metadata.get("model_path_full"),
+            metrics.get("accuracy"),
+            metrics.get("balanced_accuracy"),
+            metrics.get("f1-score", metrics.get("f1")),
+            metadata.get("git_commit_hexsha"),
+            metadata.get("timestamp_start"),
+            metadata.get("timestamp_end"),
+            json.dumps(metadata),
+        )
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO flow_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+
+    def get(self, flow_run_id):
+        return self.get_many([flow_run_id]).get(str(flow_run_id))
+
+    def get_many(self, flow_run_ids):
+        """Metadata of all given runs found in the ledger, keyed by flow_run_id."""
+        flow_run_ids = [str(i) for i in flow_run_ids]
+        if not flow_run_ids or not self.path.exists():
+            return {}
+        placeholders = ", ".join("?" for _ in flow_run_ids)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT flow_run_id, metadata FROM flow_runs WHERE flow_run_id IN ({placeholders})",
+                flow_run_ids,
+            ).fetchall()
+        return {flow_run_id: json.loads(metadata) for flow_run_id, metadata in rows}
+
+    def best_model(self, cutoff_year=None, metric="f1", flow_name="training-flow"):
+        """Metadata of the run with the highest ``metric`` that produced a model, or None."""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+        if not self.path.exists():
+            return None
+
+        query = "SELECT metadata FROM flow_runs WHERE flow_name = ? AND model_path_full IS NOT NULL"
+        params = [flow_name]
+        if cutoff_year is not None:
+            query += " AND cutoff_year = ?"
+            params.append(cutoff_year)
+        query += f" AND {metric} IS NOT NULL ORDER BY {metric} DESC LIMIT 1"
+
+        with closing(self._connect()) as conn:
+            row = conn.execute(query, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def record_flow_run(flow_name, metadata):
+    RunLedger().record(flow_name, metadata)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the local flow run ledger")
+    parser.add_argument("--ledger", default=None, help="Path of the ledger database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    get_parser = commands.add_parser("get", help="Print the metadata of a flow run")
+    get_parser.add_argument("flow_run_id")
+
+    best_parser = commands.add_parser("best", help="Print the best training run")
+    best_parser.add_argument("--cutoff-year", type=int, default=None)
+    best_parser.add_argument("--metric", choices=METRICS, default="f1")
+
+    args = parser.parse_args()
+    ledger = RunLedger(args.ledger)
+    if args.command == "get":
+        result = ledger.get(args.flow_run_id)
+    else:
+        result = ledger.best_model(cutoff_year=args.cutoff_year, metric=args.metric)
+
+    if result is None:
+        raise SystemExit("No matching flow run found")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Classification metrics of the flows, all derived from one integer confusion matrix.
+
+``ConfusionMatrix`` counts the (true label, predicted label) pairs of a set of
+rows in one vectorized pass over integer label codes: ``from_labels`` encodes
+both label arrays as categoricals of one shared dtype (``schema.label_dtype``,
+the owner buckets plus any other label present); callers that already have
+codes, like the feature store, pass them to ``from_codes`` directly.
+Accuracy, balanced accuracy and the macro F1 score are then computed from the
+matrix instead of re-scanning the labels once per metric, and give the same
+values as ``sklearn.metrics``:
+
+* classes that neither occur nor are predicted are left out of the macro F1
+  score, like sklearn only averages over the labels present,
+* balanced accuracy averages the recall over the classes that occur,
+* rows without a true label are not counted.
+
+Matrices are mergeable: the matrices of chunks or shards of the rows, computed
+in any order or process, add up exactly to the matrix of all rows::
+
+    matrix = sum((ConfusionMatrix.from_labels(y, model.predict(X)) for X, y in chunks), ConfusionMatrix())
+"""
+import numpy as np
+import pandas as pd
+
+from flow_common.schema import label_dtype
+
+
+class ConfusionMatrix:
+    """Counts of the rows per true label (rows of ``counts``) and predicted label (columns)."""
+
+    def __init__(self, labels=(), counts=None):
+        self.labels = pd.Index(labels)
+        n = len(self.labels)
+        self.counts = np.zeros((n, n), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        if self.counts.shape != (n, n):
+            raise ValueError(f"Confusion matrix of shape {self.counts.shape} does not match {n} labels")
+
+    @classmethod
+    def from_codes(cls, y_true, y_pred, labels):
+        """Matrix of the label codes ``y_true`` and ``y_pred``, indices into ``labels`` (-1 for missing)."""
+        n = len(labels)
+        y_true, y_pred = np.asarray(y_true, dtype=np.intp), np.asarray(y_pred, dtype=np.intp)
+        known = y_true >= 0
+        if not known.all():
+            y_true, y_pred = y_true[known], y_pred[known]
+        if len(y_pred) and (y_pred.min() < 0 or y_pred.max() >= n or y_true.max() >= n):
+            raise ValueError(f"Label codes out of range for {n} labels")
+        counts = np.bincount(y_true * n + y_pred, minlength=n * n).reshape(n, n)
+        return cls(labels, counts)
+
+    @classmethod
+    def from_labels(cls, y_true, y_pred):
+        """Matrix of the label arrays ``y_true`` and ``y_pred``, over the owner buckets and their labels."""
+        dtype = label_dtype(y_true, y_pred)
+        return cls.from_codes(
+            pd.Categorical(y_true, dtype=dtype).codes, pd.Categorical(y_pred, dtype=dtype).codes, dtype.categories
+        )
+
+    def __add__(self, other):
+        if not isinstance(other, ConfusionMatrix):
+            return NotImplemented
+        if self.labels.equals(other.labels):
+            return ConfusionMatrix(self.labels, self.counts + other.counts)
+
+        # Different label sets are aligned on their union, in the order of this matrix first
+        labels = self.labels.append(other.labels.difference(self.labels, sort=False))
+        counts = np.zeros((len(labels), len(labels)), dtype=np.int64)
+        for matrix in (self, other):
+            index = labels.get_indexer(matrix.labels)
+            counts[np.ix_(index, index)] += matrix.counts
+        return ConfusionMatrix(labels, counts)
+
+    def __radd__(self, other):
+        # sum() starts from 0
+        return self if isinstance(other, int) and other == 0 else self.__add__(other)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def _support(self):
+        tp = np.diag(self.counts)
+        return tp, self.counts.sum(axis=1), self.counts.sum(axis=0)
+
+    def accuracy(self):
+        n = len(self)
+        return np.trace(self.counts) / n if n else np.nan
+
+    def recall_by_class(self):
+        """Recall of every label, NaN for labels that do not occur."""
+        tp, true_sum, _ = self._support()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.Series(tp / true_sum, index=self.labels)
+
+    def balanced_accuracy(self):
+        recall = self.recall_by_class().to_numpy()
+        recall = recall[~np.isnan(recall)]
+        return np.mean(recall) if len(recall) else np.nan
+
+    def f1_by_class(self):
+        """F1 score of every label, 0 for labels predicted or occurring but never hit, NaN for the others."""
+        tp, true_sum, pred_sum = self._support()
+        denominator = true_sum + pred_sum
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f1 = np.where(denominator > 0, 2 * tp / denominator, np.nan)
+        return pd.Series(f1, index=self.labels)
+
+    def f1_macro(self):
+        f1 = self.f1_by_class().to_numpy()
+        f1 = f1[~np.isnan(f1)]
+        return np.mean(f1) if len(f1) else np.nan
+
+    def metrics(self):
+        """The metrics the flows log, under the keys of their metadata."""
+        return {"accuracy": self.accuracy(), "balanced_accuracy": self.balanced_accuracy(), "f1": self.f1_macro()}
+
+    def per_class(self):
+        """Precision, recall, F1 score and support of every label that occurs or is predicted."""
+        tp, true_sum, pred_sum = self._support()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(pred_sum > 0, tp / pred_sum, 0.0)
+        table = pd.DataFrame({
+            "precision": precision,
+            "recall": self.recall_by_class().fillna(0.0).to_numpy(),
+            "f1": self.f1_by_class().to_numpy(),
+            "support": true_sum,
+        }, index=self.labels)
+        return table[(true_sum + pred_sum) > 0]
+
+    def to_frame(self):
+        """The counts with the true labels as index and the predicted labels as columns."""
+        return pd.DataFrame(self.counts, index=self.labels.rename("true"), columns=self.labels.rename("predicted"))
+
+
+def save_classification_report(matrix, path, checks=(), title="Classifier evaluation"):
+    """HTML report of ``matrix``; ``checks`` are ``(name, value, threshold)`` tests of ``value >= threshold``."""
+    summary = pd.DataFrame(
+        [{"test": name, "value": value, "threshold": threshold, "passed": bool(value >= threshold)}
+         for name, value, threshold in checks],
+        columns=["test", "value", "threshold", "passed"],
+    )
+    present = matrix.per_class().index
+    counts = matrix.to_frame().loc[present, present]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            f"<html><head><title>{title}</title></head><body><h1>{title}</h1>"
+            f"<p>{len(matrix)} rows, {int(summary.passed.sum())} of {len(summary)} tests passed</p>"
+            f"{summary.to_html(index=False)}<h2>Per class</h2>{matrix.per_class().to_html()}"
+            f"<h2>Confusion matrix</h2>{counts.to_html()}</body></html>"
+        )
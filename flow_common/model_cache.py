@@ -0,0 +1,165 @@
+"""Process-wide cache of models loaded from MLflow.
+
+``load_model`` first pins the model URI to an immutable version
+(``models:/name/latest`` and ``models:/name@alias`` become ``models:/name/<version>``),
+then serves the estimator from an in-memory LRU cache bounded by
+``FLOW_MODEL_CACHE_MAX_BYTES`` (default 2 GiB, measured as the size of the
+serialized model). Downloaded artifacts of immutable URIs are additionally kept
+on disk below ``FLOW_CACHE_DIR``, bounded by ``FLOW_MODEL_DISK_CACHE_MAX_BYTES``
+(default 10 GiB, 0 disables the disk copy), so later processes skip the
+registry round trip as well.
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from flow_common.cache import cache_key, cache_root, entry_size, evict_lru, touch
+
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_DISK_MAX_BYTES = 10 * 1024 ** 3
+
+_REGISTRY_URI = re.compile(r"^models:/(?P<name>[^/@]+)(?:/(?P<version>[^/]+)|@(?P<alias>.+))$")
+
+
+def resolve_model_uri(model_uri):
+    """Return an immutable URI for ``model_uri``.
+
+    Registry versions given by alias, stage or ``latest`` are looked up once;
+    all other URIs (explicit versions, ``runs:/`` URIs, artifact URIs, local paths) are returned unchanged.
+    """
+    from mlflow.tracking import MlflowClient
+
+    match = _REGISTRY_URI.match(str(model_uri))
+    if match is None:
+        return str(model_uri)
+
+    name, version, alias = match.group("name"), match.group("version"), match.group("alias")
+    if version is not None and version.isdigit():
+        return str(model_uri)
+
+    client = MlflowClient()
+    if alias is not None:
+        version = client.get_model_version_by_alias(name, alias).version
+    elif version.lower() == "latest":
+        versions = client.search_model_versions(f"name='{name}'")
+        if not versions:
+            raise ValueError(f"Registered model '{name}' has no versions")
+        version = max(int(v.version) for v in versions)
+    else:
+        # Legacy stage names such as "Production" or "Staging"
+        versions = client.get_latest_versions(name, stages=[version])
+        if not versions:
+            raise ValueError(f"Registered model '{name}' has no version in stage '{version}'")
+        version = versions[0].version
+
+    return f"models:/{name}/{version}"
+
+
+def is_remote_uri(model_uri):
+    return model_uri.startswith("models:/") or model_uri.startswith("runs:/")
+
+
+class ModelCache:
+    def __init__(self, max_bytes=None, disk_dir=None, disk_max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("FLOW_MODEL_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        if disk_max_bytes is None:
+            disk_max_bytes = int(os.environ.get("FLOW_MODEL_DISK_CACHE_MAX_BYTES", DEFAULT_DISK_MAX_BYTES))
+
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir if disk_dir is not None else cache_root() / "models"
+        self.disk_max_bytes = disk_max_bytes
+
+        self._models = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def load(self, model_uri):
+        import mlflow
+        import mlflow.sklearn
+
+        resolved_uri = resolve_model_uri(model_uri)
+        key = (mlflow.get_tracking_uri(), resolved_uri)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent requests for the same model wait for one load instead of loading twice
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key][0]
+
+            if is_remote_uri(resolved_uri) and self.disk_max_bytes > 0:
+                local_path = self._local_copy(resolved_uri)
+                model = mlflow.sklearn.load_model(str(local_path))
+                size = entry_size(local_path)
+            elif not is_remote_uri(resolved_uri) and os.path.exists(resolved_uri):
+                model = mlflow.sklearn.load_model(resolved_uri)
+                size = entry_size(resolved_uri)
+            else:
+                # Other URIs (s3://, gs://, http(s)://, mlflow-artifacts:/) go to mlflow as strings, Path() would collapse their "//"
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    local_path = mlflow.artifacts.download_artifacts(artifact_uri=resolved_uri, dst_path=tmp_dir)
+                    model = mlflow.sklearn.load_model(local_path)
+                    size = entry_size(local_path)
+
+            with self._lock:
+                self._models[key] = (model, size)
+                self._bytes += size
+                # Always keep the model just loaded, even if it alone exceeds the budget
+                while self._bytes > self.max_bytes and len(self._models) > 1:
+                    _, (_, evicted_size) = self._models.popitem(last=False)
+                    self._bytes -= evicted_size
+
+        return model
+
+    def _local_copy(self, resolved_uri):
+        import mlflow
+
+        path = self.disk_dir / cache_key(mlflow.get_tracking_uri(), resolved_uri)
+        if path.exists():
+            touch(path)
+            return path
+
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".", dir=self.disk_dir))
+        downloaded = mlflow.artifacts.download_artifacts(artifact_uri=resolved_uri, dst_path=str(tmp_dir))
+        try:
+            os.replace(downloaded, path)
+        except OSError:
+            # Another process stored the same model in the meantime
+            pass
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        evict_lru(self.disk_dir, self.disk_max_bytes, keep=[path])
+        return path
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._bytes = 0
+
+
+_model_cache = None
+_model_cache_lock = threading.Lock()
+
+
+def get_model_cache():
+    global _model_cache
+    with _model_cache_lock:
+        if _model_cache is None:
+            _model_cache = ModelCache()
+        return _model_cache
+
+
+def load_model(model_uri):
+    """Drop-in replacement for ``mlflow.sklearn.load_model`` backed by the process-wide cache."""
+    return get_model_cache().load(model_uri)
@@ -0,0 +1,200 @@
+"""Datasets stored as one directory of Parquet files per release year.
+
+::
+
+    steam_games_dataset.parquet/
+        _manifest.json
+        release_year=2019/part-00000.parquet
+        release_year=2020/part-00000.parquet
+        release_year=__missing__/part-00000.parquet
+
+The manifest lists every partition with its files, its row count and per column
+statistics (null count, min and max, the labels present in categorical columns).
+Readers in ``flow_common.dataset_io`` open only the partitions on the needed
+side of a cutoff year, and questions like "how many rows are there before 2020"
+are answered from the manifest without reading any rows::
+
+    python -m flow_common.partitions summary data/steam_games_dataset.parquet --before-year 2020
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from flow_common.schema import DATE_COLUMN, apply_schema
+
+
+MANIFEST = "_manifest.json"
+MANIFEST_VERSION = 1
+PARTITION_COLUMN = "release_year"
+MISSING = "__missing__"
+
+_swap_lock = threading.Lock()
+
+
+def is_partitioned(path):
+    path = Path(path)
+    return path.is_dir() and (path / MANIFEST).is_file()
+
+
+def read_manifest(path):
+    with open(Path(path) / MANIFEST, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _json_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.floating):
+        # The shortest decimal of a float32 price, 199.99 rather than 199.99000549316406
+        return float(str(value))
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _column_stats(series):
+    stats = {"null_count": int(series.isna().sum())}
+    values = series.dropna()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        stats["values"] = sorted(str(value) for value in values.unique())
+    elif len(values) and (
+        pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series)
+    ):
+        stats["min"] = _json_value(values.min())
+        stats["max"] = _json_value(values.max())
+    return stats
+
+
+def _merge_stats(a, b):
+    merged = {"null_count": a["null_count"] + b["null_count"]}
+    if "values" in a or "values" in b:
+        merged["values"] = sorted(set(a.get("values", [])) | set(b.get("values", [])))
+    for key, pick in (("min", min), ("max", max)):
+        present = [stats[key] for stats in (a, b) if key in stats]
+        if present:
+            merged[key] = pick(present)
+    return merged
+
+
+def _partition_order(partition):
+    return (partition["year"] is None, partition["year"] or 0)
+
+
+def write_partitioned(chunks, path):
+    """Write a stream of DataFrames partitioned by release year to the directory ``path``.
+
+    Every chunk adds one file to each partition it has rows for. An existing
+    dataset at ``path`` is only replaced once the new one is complete.
+    """
+    path = Path(path)
+    # Unique per thread, concurrent runs of one process may write the same dataset
+    tmp_path = path.parent / f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+
+    partitions = {}
+    columns = None
+    for i, chunk in enumerate(chunks):
+        chunk = apply_schema(chunk).reset_index(drop=True)
+        columns = columns or list(chunk.columns)
+        years = chunk[DATE_COLUMN].dt.year
+        for year, rows in chunk.groupby(years, dropna=False, sort=True).indices.items():
+            year = None if pd.isna(year) else int(year)
+            name = f"{PARTITION_COLUMN}={MISSING if year is None else year}"
+            part = chunk.iloc[rows]
+
+            file_name = f"{name}/part-{i:05d}.parquet"
+            (tmp_path / name).mkdir(exist_ok=True)
+            part.to_parquet(tmp_path / file_name, index=False)
+
+            stats = {column: _column_stats(part[column]) for column in part.columns}
+            partition = partitions.setdefault(name, {"year": year, "files": [], "rows": 0, "columns": stats})
+            if partition["files"]:
+                partition["columns"] = {
+                    column: _merge_stats(partition["columns"][column], stats[column]) for column in stats
+                }
+            partition["files"].append(file_name)
+            partition["rows"] += len(part)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "partition_column": PARTITION_COLUMN,
+        "source_column": DATE_COLUMN,
+        "columns": columns or [],
+        "rows": sum(partition["rows"] for partition in partitions.values()),
+        "partitions": sorted(partitions.values(), key=_partition_order),
+    }
+    with open(tmp_path / MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+
+    old_path = path.parent / f".{path.name}.{os.getpid()}.{threading.get_ident()}.old"
+    # A directory cannot be moved over another one, the swap of concurrent writers is serialized
+    with _swap_lock:
+        if path.exists():
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+    if old_path.is_dir():
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        old_path.unlink(missing_ok=True)
+    return manifest
+
+
+def select_partitions(manifest, before_year=None, from_year=None):
+    """Partitions with rows released before ``before_year`` and in or after ``from_year``.
+
+    With a year bound, the partition of rows without a release date is left out,
+    like ``release_date.dt.year < before_year`` leaves these rows out.
+    """
+    if before_year is None and from_year is None:
+        return manifest["partitions"]
+    return [
+        partition for partition in manifest["partitions"]
+        if partition["year"] is not None
+        and (before_year is None or partition["year"] < before_year)
+        and (from_year is None or partition["year"] >= from_year)
+    ]
+
+
+def partition_files(path, before_year=None, from_year=None):
+    path = Path(path)
+    return [
+        path / file_name
+        for partition in select_partitions(read_manifest(path), before_year, from_year)
+        for file_name in partition["files"]
+    ]
+
+
+def summary(path, before_year=None, from_year=None):
+    """Row count and column statistics of the selected partitions, from the manifest alone."""
+    selected = select_partitions(read_manifest(path), before_year, from_year)
+    columns = {}
+    for partition in selected:
+        for column, stats in partition["columns"].items():
+            columns[column] = _merge_stats(columns[column], stats) if column in columns else stats
+    return {
+        "rows": sum(partition["rows"] for partition in selected),
+        "years": [partition["year"] for partition in selected],
+        "columns": columns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a year-partitioned dataset")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    summary_parser = commands.add_parser("summary", help="Rows and column statistics from the manifest")
+    summary_parser.add_argument("path")
+    summary_parser.add_argument("--before-year", type=int, default=None)
+    summary_parser.add_argument("--from-year", type=int, default=None)
+
+    args = parser.parse_args()
+    print(json.dumps(summary(args.path, args.before_year, args.from_year), indent=2))
+
+
+if __name__ == "__main__":
+    main()
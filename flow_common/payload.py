@@ -0,0 +1,21 @@
+"""The JSON parameter blob every flow is started with.
+
+``python <flow>/flow.py '{"args": [...], "kwargs": {...}, "commit_id": "..."}'``
+passes the positional and keyword arguments of ``myflow_runner`` and the git
+commit the flow code was checked out at. The warm worker (``flow_common.worker``)
+accepts the same blob.
+"""
+import json
+
+
+def parse_payload(blob):
+    """Return ``(args, kwargs, commit_id)`` of a JSON parameter blob (a string or an already decoded dict)."""
+    params = json.loads(blob) if isinstance(blob, (str, bytes)) else blob
+    if not isinstance(params, dict):
+        raise ValueError(f"Expected a JSON object, got {type(params).__name__}")
+    args = params.get("args", [])
+    kwargs = params.get("kwargs", {})
+    commit_id = params.get("commit_id", None)
+    if not isinstance(args, list) or not isinstance(kwargs, dict):
+        raise ValueError("'args' must be a list and 'kwargs' an object")
+    return args, kwargs, commit_id
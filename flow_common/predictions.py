@@ -0,0 +1,208 @@
+"""Lazy, memoized batch predictions of registered models.
+
+``LazyPredictions`` only loads the model and predicts when its values are first
+accessed. Rows are identified by a hash of their float32 feature values (the
+representation the sklearn estimators actually see), and predictions of models
+pinned to an immutable version are persisted per (model version, row hash) below
+``FLOW_CACHE_DIR/predictions``, so any flow scoring unchanged rows with the same
+version again only pays for a hash lookup. Rows that still have to be predicted
+are split into chunks of bounded size and scored on a thread pool, sized by the
+cores the host CPU budget grants (``flow_common.cpu``), by the cached sklearn
+model. Small batches, of at most ``FLOW_COMPILED_FOREST_MAX_ROWS`` rows (default
+500), are scored by the compiled forest logged with the model (see
+``forest_engine``) when there is one: it has no per-call overhead, but beyond
+about a thousand rows sklearn's Cython tree walk is faster.
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from flow_common.cache import cache_key, cache_root, evict_lru, touch
+from flow_common.cpu import cpu_allocation
+from flow_common.forest_engine import load_compiled_forest
+from flow_common.model_cache import is_remote_uri, load_model, resolve_model_uri
+
+
+DEFAULT_CHUNKSIZE = 50_000
+DEFAULT_MAX_BYTES = 1024 ** 3
+DEFAULT_COMPILED_MAX_ROWS = 500
+MAX_SHARDS = 16
+
+
+def row_hashes(X):
+    """64-bit hash of every row of ``X`` as float32 features, independent of dtypes and index."""
+    values = pd.DataFrame(np.asarray(X, dtype=np.float32))
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+class PredictionStore:
+    """Predictions of one model version, stored as shards of (row hash, prediction) arrays."""
+
+    def __init__(self, model_uri, columns, cache_dir=None, max_bytes=None):
+        import mlflow
+
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("FLOW_PREDICTION_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.cache_dir = cache_dir if cache_dir is not None else cache_root() / "predictions"
+        self.max_bytes = max_bytes
+        self.path = self.cache_dir / cache_key(mlflow.get_tracking_uri(), model_uri, columns)
+
+    def _read_shards(self):
+        hashes, predictions = [], []
+        for shard in sorted(self.path.glob("shard-*.npz")):
+            try:
+                with np.load(shard, allow_pickle=False) as data:
+                    hashes.append(data["hashes"])
+                    predictions.append(data["predictions"])
+            except FileNotFoundError:
+                # Removed by a concurrent compaction, its rows are in the compacted shard
+                continue
+        return hashes, predictions
+
+    def lookup(self, hashes):
+        """Cached predictions for ``hashes`` and a mask of the rows that were found."""
+        found = np.zeros(len(hashes), dtype=bool)
+        if not self.path.exists():
+            return None, found
+        touch(self.path)
+
+        shard_hashes, shard_predictions = self._read_shards()
+        if not shard_hashes:
+            return None, found
+
+        known_hashes = np.concatenate(shard_hashes)
+        known_predictions = np.concatenate(shard_predictions)
+        order = np.argsort(known_hashes, kind="stable")
+        known_hashes, known_predictions = known_hashes[order], known_predictions[order]
+
+        positions = np.minimum(np.searchsorted(known_hashes, hashes), len(known_hashes) - 1)
+        found = known_hashes[positions] == hashes
+        return _from_storage(known_predictions[positions]), found
+
+    def add(self, hashes, predictions):
+        hashes, first = np.unique(hashes, return_index=True)
+        predictions = _to_storage(np.asarray(predictions)[first])
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write_shard(hashes, predictions)
+
+        shards = sorted(self.path.glob("shard-*.npz"))
+        if len(shards) > MAX_SHARDS:
+            self._compact(shards)
+        evict_lru(self.cache_dir, self.max_bytes, keep=[self.path])
+
+    def _write_shard(self, hashes, predictions):
+        name = f"shard-{uuid.uuid4().hex}.npz"
+        tmp_path = self.path / f".{name}"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, hashes=hashes, predictions=predictions)
+        os.replace(tmp_path, self.path / name)
+
+    def _compact(self, shards):
+        hashes, predictions = self._read_shards()
+        hashes, first = np.unique(np.concatenate(hashes), return_index=True)
+        self._write_shard(hashes, np.concatenate(predictions)[first])
+        for shard in shards:
+            shard.unlink(missing_ok=True)
+
+
+def _to_storage(predictions):
+    # String labels come back from sklearn as object arrays, which np.savez can only pickle
+    return predictions.astype(str) if predictions.dtype == object else predictions
+
+
+def _from_storage(predictions):
+    return predictions.astype(object) if predictions.dtype.kind == "U" else predictions
+
+
+def load_predictor(resolved_uri, n_rows=None):
+    """The model to score ``n_rows`` rows with.
+
+    The compiled forest exported with the model for small batches, if there is
+    one, else the sklearn model.
+    """
+    max_rows = int(os.environ.get("FLOW_COMPILED_FOREST_MAX_ROWS", DEFAULT_COMPILED_MAX_ROWS))
+    if n_rows is not None and n_rows <= max_rows and is_remote_uri(resolved_uri):
+        compiled = load_compiled_forest(resolved_uri)
+        if compiled is not None:
+            return compiled
+    return load_model(resolved_uri)
+
+
+def predict_chunked(model, X, chunksize=DEFAULT_CHUNKSIZE, max_workers=None):
+    """``model.predict`` over row chunks of ``X`` on a thread pool, concatenated in order.
+
+    The pool has as many threads as cores are granted for up to ``max_workers``
+    (default one per chunk, at most 8).
+    """
+    if len(X) <= chunksize:
+        return model.predict(X)
+
+    chunks = [X[start:start + chunksize] for start in range(0, len(X), chunksize)]
+    want = max_workers if max_workers is not None else min(8, len(chunks))
+    with cpu_allocation("predictions", want=want) as cores:
+        with ThreadPoolExecutor(max_workers=cores) as pool:
+            return np.concatenate(list(pool.map(model.predict, chunks)))
+
+
+class LazyPredictions:
+    """Predictions of ``model_uri`` for the rows of ``X``, computed on first access of ``values``."""
+
+    def __init__(self, model_uri, X, chunksize=DEFAULT_CHUNKSIZE, max_workers=None, use_cache=True):
+        self.model_uri = model_uri
+        self.X = X
+        self.chunksize = chunksize
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        self._values = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.X)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    @property
+    def values(self):
+        with self._lock:
+            if self._values is None:
+                self._values = self._compute()
+            return self._values
+
+    def _compute(self):
+        resolved_uri = resolve_model_uri(self.model_uri)
+        if len(self.X) == 0:
+            return load_model(resolved_uri).predict(self.X)
+
+        # Only predictions of immutable model versions can be reused
+        store = None
+        if self.use_cache and is_remote_uri(resolved_uri):
+            columns = list(self.X.columns) if hasattr(self.X, "columns") else self.X.shape[1]
+            store = PredictionStore(resolved_uri, columns)
+
+        hashes = row_hashes(self.X)
+        cached, found = store.lookup(hashes) if store is not None else (None, np.zeros(len(hashes), dtype=bool))
+        if found.all():
+            return cached
+
+        missing = ~found
+        model = load_predictor(resolved_uri, n_rows=int(missing.sum()))
+        predicted = predict_chunked(model, self.X[missing], chunksize=self.chunksize, max_workers=self.max_workers)
+        if store is not None:
+            store.add(hashes[missing], predicted)
+
+        if cached is None:
+            return predicted
+        result = cached.astype(predicted.dtype) if cached.dtype != predicted.dtype else cached.copy()
+        result[missing] = predicted
+        return result
+
+
+def predict(model_uri, X, **kwargs):
+    """Eagerly computed, memoized predictions of ``model_uri`` for ``X``."""
+    return LazyPredictions(model_uri, X, **kwargs).values
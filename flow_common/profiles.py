@@ -0,0 +1,225 @@
+"""Compact statistical profiles of dataset columns for drift monitoring.
+
+A reference profile stores per column what the drift tests need, instead of the
+raw rows: fixed histogram bins, a quantile sketch and moments for numerical
+columns, category counts for categorical ones. Profiles are cached on disk per
+(dataset fingerprint, cutoff_year, column set, build method), so later
+monitoring runs only have to summarize the current data with the same bins and
+compare. A profile of a sample of the reference rows is cached apart from the
+exact one.
+
+Drift is measured per column as the Jensen-Shannon distance between the binned
+reference and current distributions (the test used by evidently for large
+samples); the population stability index is reported alongside.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from flow_common.cache import cache_key, cache_root, touch
+from flow_common.fingerprint import dataset_fingerprint
+
+
+PROFILE_VERSION = 1
+N_BINS = 20
+SKETCH_QUANTILES = np.linspace(0, 1, 101)
+DRIFT_THRESHOLD = 0.1
+DATASET_DRIFT_SHARE = 0.5
+
+
+def is_categorical(series):
+    return (
+        pd.api.types.is_bool_dtype(series)
+        or isinstance(series.dtype, pd.CategoricalDtype)
+        or pd.api.types.is_object_dtype(series)
+        or pd.api.types.is_string_dtype(series)
+    )
+
+
+def profile_column(series):
+    """Reference profile of one column."""
+    missing = int(series.isna().sum())
+    if is_categorical(series):
+        counts = series.dropna().astype(str).value_counts()
+        return {
+            "kind": "categorical",
+            "n": int(len(series)),
+            "missing": missing,
+            "counts": {str(k): int(v) for k, v in counts.items()},
+        }
+
+    values = series.dropna().to_numpy(dtype=np.float64)
+    if len(values) == 0:
+        edges, quantiles, stats = [], [], {"mean": None, "std": None, "min": None, "max": None}
+    else:
+        # Equal-frequency bins of the reference, open at both ends
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, N_BINS + 1))[1:-1])
+        quantiles = np.quantile(values, SKETCH_QUANTILES).tolist()
+        stats = {
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+        }
+    return {
+        "kind": "numerical",
+        "n": int(len(series)),
+        "missing": missing,
+        "edges": list(map(float, edges)),
+        "counts": bin_counts(values, edges).tolist(),
+        "quantiles": quantiles,
+        **stats,
+    }
+
+
+def bin_counts(values, edges):
+    edges = np.asarray(edges, dtype=np.float64)
+    return np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+
+
+def build_profile(reference, columns):
+    return {
+        "version": PROFILE_VERSION,
+        "n_rows": int(len(reference)),
+        "columns": {col: profile_column(reference[col]) for col in columns},
+    }
+
+
+class ColumnAccumulator:
+    """Summary of the current data of one column, binned like its reference profile.
+
+    Accumulators can be updated chunk by chunk and merged, so the current side
+    never has to be held in memory at once.
+    """
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.n = 0
+        self.missing = 0
+        self.below_range = 0
+        self.above_range = 0
+        if reference["kind"] == "numerical":
+            self.counts = np.zeros(len(reference["edges"]) + 1, dtype=np.int64)
+        else:
+            self.counts = {}
+
+    def update(self, series):
+        self.n += len(series)
+        self.missing += int(series.isna().sum())
+
+        if self.reference["kind"] == "numerical":
+            values = series.dropna().to_numpy(dtype=np.float64)
+            self.counts += bin_counts(values, self.reference["edges"])
+            if self.reference["min"] is not None:
+                self.below_range += int((values < self.reference["min"]).sum())
+                self.above_range += int((values > self.reference["max"]).sum())
+        else:
+            for key, count in series.dropna().astype(str).value_counts().items():
+                self.counts[key] = self.counts.get(key, 0) + int(count)
+        return self
+
+    def merge(self, other):
+        self.n += other.n
+        self.missing += other.missing
+        self.below_range += other.below_range
+        self.above_range += other.above_range
+        if self.reference["kind"] == "numerical":
+            self.counts = self.counts + other.counts
+        else:
+            for key, count in other.counts.items():
+                self.counts[key] = self.counts.get(key, 0) + count
+        return self
+
+    def compare(self):
+        """Drift statistics of the accumulated data against the reference."""
+        from scipy.spatial.distance import jensenshannon
+
+        reference = self.reference
+        if reference["kind"] == "numerical":
+            p = np.asarray(reference["counts"], dtype=np.float64)
+            q = self.counts.astype(np.float64)
+            new_categories = []
+        else:
+            keys = sorted(set(reference["counts"]) | set(self.counts))
+            p = np.array([reference["counts"].get(k, 0) for k in keys], dtype=np.float64)
+            q = np.array([self.counts.get(k, 0) for k in keys], dtype=np.float64)
+            new_categories = [k for k in keys if k not in reference["counts"]]
+
+        if p.sum() == 0 or q.sum() == 0:
+            distance, psi = None, None
+        else:
+            p, q = p / p.sum(), q / q.sum()
+            distance = float(jensenshannon(p, q))
+            eps = 1e-6
+            psi = float(np.sum((q - p) * np.log((q + eps) / (p + eps))))
+
+        return {
+            "kind": reference["kind"],
+            "jensenshannon": distance,
+            "psi": psi,
+            "drift_detected": distance is not None and distance > DRIFT_THRESHOLD,
+            "missing_share_reference": reference["missing"] / reference["n"] if reference["n"] else None,
+            "missing_share_current": self.missing / self.n if self.n else None,
+            "out_of_range_share": (self.below_range + self.above_range) / self.n if self.n else None,
+            "new_categories": new_categories,
+        }
+
+
+def compare_accumulators(accumulators):
+    columns = {col: acc.compare() for col, acc in accumulators.items()}
+    n_drifted = sum(result["drift_detected"] for result in columns.values())
+    share = n_drifted / len(columns) if columns else 0.0
+    return {
+        "n_rows": max((acc.n for acc in accumulators.values()), default=0),
+        "n_drifted_columns": n_drifted,
+        "share_drifted_columns": share,
+        "dataset_drift": share >= DATASET_DRIFT_SHARE,
+        "columns": columns,
+    }
+
+
+def compare_profile(profile, current):
+    """Drift of the ``current`` DataFrame against a reference profile."""
+    accumulators = {
+        col: ColumnAccumulator(reference).update(current[col])
+        for col, reference in profile["columns"].items()
+    }
+    return compare_accumulators(accumulators)
+
+
+def reference_profile(dataset_path, cutoff_year, columns, load_reference, method="full"):
+    """Cached profile of the reference slice of ``dataset_path``.
+
+    ``load_reference`` is only called on a cache miss and returns the reference
+    rows. ``method`` names how it selects them, e.g. the size of a sample, so
+    profiles built from different rows are cached separately.
+    """
+    key = cache_key(dataset_fingerprint(dataset_path), cutoff_year, sorted(columns), method, PROFILE_VERSION)
+    path = cache_root() / "profiles" / f"{key}.json"
+
+    if path.exists():
+        touch(path)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    profile = build_profile(load_reference(), columns)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f".{key}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f)
+    os.replace(tmp_path, path)
+    return profile
+
+
+def save_drift_report(result, path, title="Data drift against the reference profile"):
+    """Write a drift result as a small standalone HTML report."""
+    table = pd.DataFrame.from_dict(result["columns"], orient="index")
+    summary = (
+        f"<p>Rows: {result['n_rows']}, drifted columns: {result['n_drifted_columns']} "
+        f"({result['share_drifted_columns']:.0%}), dataset drift: {result['dataset_drift']}</p>"
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"<html><head><title>{title}</title></head><body><h1>{title}</h1>{summary}{table.to_html()}</body></html>")
@@ -0,0 +1,149 @@
+"""Columns and compact dtypes of the preprocessed Steam games dataset.
+
+``training_flow/task1`` writes, and every later task reads, the columns of
+``COLUMNS``. ``apply_schema`` gives them compact dtypes:
+
+* counts as int32 and the small scores as int8 instead of int64,
+* the price as float32 if it has at most two decimals, so that ``widen``
+  restores the original float64 values exactly,
+* ``estimated_owners`` as categorical over the owner buckets, ordered by their
+  lower bound, instead of Python strings,
+* the platform flags as bool.
+
+The dataset readers and writers in ``flow_common.dataset_io`` apply it, so
+Parquet and Feather files store these types and CSV files are converted when
+read. ``label_dtype`` is the categorical dtype of the labels of several label
+arrays together; ``flow_common.metrics`` encodes true and predicted labels with
+it and computes the metrics over the integer codes, which gives the same values
+as over the label strings at a fraction of the cost.
+"""
+import numpy as np
+import pandas as pd
+
+
+DATE_COLUMN = "release_date"
+TARGET_COLUMN = "estimated_owners"
+FEATURE_COLUMNS = [
+    "price", "positive_reviews", "negative_reviews", "metacritic_score", "peak_ccu",
+    "recommendations", "required_age", "on_linux", "on_mac", "on_windows",
+]
+COLUMNS = ["name", DATE_COLUMN, TARGET_COLUMN, *FEATURE_COLUMNS]
+
+DTYPES = {
+    "price": np.float32,
+    "positive_reviews": np.int32,
+    "negative_reviews": np.int32,
+    "metacritic_score": np.int8,
+    "peak_ccu": np.int32,
+    "recommendations": np.int32,
+    "required_age": np.int8,
+    "on_linux": np.bool_,
+    "on_mac": np.bool_,
+    "on_windows": np.bool_,
+}
+# Decimals of the float32 columns, used to restore their float64 values exactly
+FLOAT_DECIMALS = {"price": 2}
+
+OWNER_BUCKETS = [
+    "0 - 0",
+    "0 - 20000",
+    "20000 - 50000",
+    "50000 - 100000",
+    "100000 - 200000",
+    "200000 - 500000",
+    "500000 - 1000000",
+    "1000000 - 2000000",
+    "2000000 - 5000000",
+    "5000000 - 10000000",
+    "10000000 - 20000000",
+    "20000000 - 50000000",
+    "50000000 - 100000000",
+    "100000000 - 200000000",
+]
+
+
+def _bucket_order(bucket):
+    try:
+        return 0, int(str(bucket).split(" - ")[0]), str(bucket)
+    except ValueError:
+        return 1, 0, str(bucket)
+
+
+def owners_dtype(values=()):
+    """Categorical dtype of ``estimated_owners``, extended by any bucket of ``values`` not in ``OWNER_BUCKETS``."""
+    extra = set(pd.Series(values, dtype=object).dropna().unique()) - set(OWNER_BUCKETS)
+    return pd.CategoricalDtype(sorted([*OWNER_BUCKETS, *extra], key=_bucket_order), ordered=True)
+
+
+OWNERS_DTYPE = owners_dtype()
+
+
+def _compact_dtype(column, series, dtype):
+    """``dtype`` if ``series`` converts to it without losing values, else None (keep the column as it is)."""
+    if series.dtype == dtype:
+        return None
+    if column in FLOAT_DECIMALS:
+        values = series.to_numpy(dtype=np.float64)
+        restored = np.round(values.astype(dtype).astype(np.float64), FLOAT_DECIMALS[column])
+        return dtype if np.array_equal(restored, values, equal_nan=True) else None
+    if series.isna().any():
+        # Integers and bools cannot hold missing values
+        return None
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        if len(series) and (series.min() < info.min or series.max() > info.max):
+            return None
+    return dtype
+
+
+def apply_schema(dataset):
+    """``dataset`` with the compact dtypes for all of its columns that are part of the schema."""
+    dtypes = {}
+    for column, dtype in DTYPES.items():
+        if column in dataset.columns:
+            compact = _compact_dtype(column, dataset[column], dtype)
+            if compact is not None:
+                dtypes[column] = compact
+
+    if TARGET_COLUMN in dataset.columns:
+        target = dataset[TARGET_COLUMN]
+        categories = target.cat.categories if isinstance(target.dtype, pd.CategoricalDtype) else target
+        dtype = owners_dtype(categories)
+        if target.dtype != dtype:
+            dtypes[TARGET_COLUMN] = dtype
+
+    if DATE_COLUMN in dataset.columns and not pd.api.types.is_datetime64_any_dtype(dataset[DATE_COLUMN]):
+        dataset = dataset.assign(**{DATE_COLUMN: pd.to_datetime(dataset[DATE_COLUMN])})
+
+    return dataset.astype(dtypes, copy=False) if dtypes else dataset
+
+
+def widen(dataset):
+    """``dataset`` with the float32 columns restored to the float64 values they were read from.
+
+    Content hashes of rows (see ``training_flow/incremental.py``) stay the same
+    as before the schema was introduced: integer widths and categorical versus
+    string labels do not change ``pd.util.hash_pandas_object``, float32 does.
+    """
+    columns = {
+        column: np.round(dataset[column].to_numpy(dtype=np.float64), decimals)
+        for column, decimals in FLOAT_DECIMALS.items()
+        if column in dataset.columns and dataset[column].dtype == np.float32
+    }
+    return dataset.assign(**columns) if columns else dataset
+
+
+def row_hashes(dataset):
+    """64-bit content hash of every row, independent of the index and of the compact dtypes."""
+    return pd.util.hash_pandas_object(widen(dataset), index=False).to_numpy()
+
+
+def label_dtype(*labels):
+    """Categorical dtype over the owner buckets and every label of the label arrays ``labels``."""
+    values = []
+    for array in labels:
+        if isinstance(getattr(array, "dtype", None), pd.CategoricalDtype):
+            values.append(pd.Series(array.cat.categories if hasattr(array, "cat") else array.categories))
+        else:
+            values.append(pd.Series(pd.unique(np.asarray(array, dtype=object))))
+    return owners_dtype(pd.concat(values, ignore_index=True))
@@ -0,0 +1,365 @@
+"""Long-lived local worker that runs flows without starting a new interpreter.
+
+``python <flow>/flow.py '<json>'`` pays for importing prefect, mlflow,
+scikit-learn and evidently and for loading the models on every run. The worker
+imports every flow once, keeps the libraries, the in-process model and
+prediction caches and the dataset read cache warm, and runs flows for the same
+JSON blob (see ``flow_common.payload``) sent over a Unix socket or local HTTP::
+
+    python -m flow_common.worker serve --max-concurrency 2
+    python -m flow_common.worker run training_flow '{"args": [...], "kwargs": {...}, "commit_id": "..."}'
+
+Payloads can carry pickled code (the split functions of the A/B test flow), so
+whoever can reach the worker can run code as its user. ``--address`` (or
+``FLOW_WORKER_ADDRESS``) is therefore by default the Unix socket
+``unix:FLOW_CACHE_DIR/worker.sock``, which only its owner may connect to (mode
+0600). ``<host>:<port>`` serves HTTP on a loopback address instead, other
+addresses are refused; every TCP request has to send the shared secret of
+``FLOW_WORKER_TOKEN`` in the ``X-Flow-Worker-Token`` header, and the worker
+does not start on TCP without one. At most ``--max-concurrency``
+flows run at the same time, further requests wait up to ``--queue-timeout``
+seconds for a slot and are rejected with 503 after that. The client only
+imports the standard library, so a run costs a few milliseconds on top of the
+flow itself.
+
+Endpoints: ``POST /run/<flow>`` with the JSON blob as body answers with
+``{"flow_id", "artifact_id", "seconds"}`` once the flow finished, ``GET /health``
+lists the loaded flows and the number of running ones.
+"""
+import argparse
+import hmac
+import http.client
+import importlib.util
+import ipaddress
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from flow_common.cache import cache_root
+from flow_common.payload import parse_payload
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FLOWS = ["training_flow", "abtest_flow", "monitoring_flow", "backtest_flow"]
+TOKEN_HEADER = "X-Flow-Worker-Token"
+DEFAULT_MAX_CONCURRENCY = 2
+DEFAULT_QUEUE_TIMEOUT = 600.0
+
+_import_lock = threading.Lock()
+
+
+def default_address():
+    return os.environ.get("FLOW_WORKER_ADDRESS", f"unix:{cache_root() / 'worker.sock'}")
+
+
+def _token():
+    return os.environ.get("FLOW_WORKER_TOKEN") or None
+
+
+def load_flow(flow_dir):
+    """Import ``<flow_dir>/flow.py`` and its task modules under names of their own.
+
+    Every flow directory has its own ``task1`` / ``task2`` / ``task3`` modules,
+    so after importing one flow its modules are renamed to ``<flow>_<module>``
+    in ``sys.modules`` and the next flow imports its own ``task1``.
+    """
+    flow_dir = Path(flow_dir).resolve()
+    local_names = {path.stem for path in flow_dir.glob("*.py")}
+
+    with _import_lock:
+        for name in local_names & set(sys.modules):
+            del sys.modules[name]
+        sys.path.insert(0, str(flow_dir))
+        try:
+            spec = importlib.util.spec_from_file_location(f"{flow_dir.name}_flow", flow_dir / "flow.py")
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(str(flow_dir))
+            for name in local_names & set(sys.modules):
+                sys.modules[f"{flow_dir.name}_{name}"] = sys.modules.pop(name)
+    return module
+
+
+def warm_up(model_uris=()):
+    """Import the libraries the tasks import lazily and load ``model_uris`` into the model cache."""
+    for name in ("mlflow", "sklearn.ensemble", "sklearn.metrics", "evidently"):
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Not preloading {name}: {e}")
+
+    if model_uris:
+        from flow_common.model_cache import load_model, resolve_model_uri
+        from flow_common.predictions import load_predictor
+
+        for uri in model_uris:
+            resolved_uri = resolve_model_uri(uri)
+            load_model(resolved_uri)
+            # The compiled forest too, small batches are scored by it
+            load_predictor(resolved_uri, n_rows=1)
+            print(f"Loaded {uri} ({resolved_uri})")
+
+
+class FlowWorker:
+    def __init__(self, flows=FLOWS, max_concurrency=DEFAULT_MAX_CONCURRENCY, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.flows = {name: load_flow(REPO_ROOT / name) for name in flows}
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._running = 0
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._running
+
+    def run(self, flow_name, payload):
+        """Run one flow like its ``main()`` does, return ``(flow_id, artifact_id)``.
+
+        Raises ``KeyError`` for unknown flows and ``TimeoutError`` if no slot
+        became free within the queue timeout.
+        """
+        runner = self.flows[flow_name].myflow_runner
+        args, kwargs, commit_id = parse_payload(payload)
+        kwargs.update({"commit_id": commit_id})
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise TimeoutError(f"No free slot within {self.queue_timeout:.0f}s, {self.max_concurrency} flows running")
+        with self._lock:
+            self._running += 1
+        try:
+            return runner(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FlowWorker/1.0"
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.token
+        if token is None:
+            return True
+        if hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode("utf-8"), token.encode("utf-8")):
+            return True
+        self._reply(401, {"error": f"Missing or wrong {TOKEN_HEADER} header"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path != "/health":
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        worker = self.server.worker
+        self._reply(200, {"flows": sorted(worker.flows), "running": worker.running,
+                          "max_concurrency": worker.max_concurrency})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        prefix = "/run/"
+        if not self.path.startswith(prefix):
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        flow_name = self.path[len(prefix):]
+        worker = self.server.worker
+        if flow_name not in worker.flows:
+            self._reply(404, {"error": f"Unknown flow {flow_name}, the worker runs {sorted(worker.flows)}"})
+            return
+
+        try:
+            payload = self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}"
+            parse_payload(payload)
+        except ValueError as e:
+            self._reply(400, {"error": f"Failed to parse args: {e}"})
+            return
+
+        start = time.perf_counter()
+        try:
+            flow_id, artifact_id = worker.run(flow_name, payload)
+        except TimeoutError as e:
+            self._reply(503, {"error": str(e)})
+            return
+        except Exception as e:
+            traceback.print_exc()
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._reply(200, {"flow_id": str(flow_id), "artifact_id": str(artifact_id),
+                          "seconds": time.perf_counter() - start})
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Created without permissions for group and others, only the owner can connect
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+        self.server_name, self.server_port = "localhost", 0
+
+
+def _parse_address(address):
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host.strip("[]") or "127.0.0.1", int(port))
+
+
+def _is_loopback(host):
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+def serve(address=None, flows=FLOWS, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+          queue_timeout=DEFAULT_QUEUE_TIMEOUT, model_uris=()):
+    from flow_common.dataset_io import enable_read_cache
+
+    address = address or default_address()
+    kind, target = _parse_address(address)
+    token = None
+    if kind == "tcp":
+        if not _is_loopback(target[0]):
+            raise ValueError(f"Refusing to serve on {address}, the worker runs code from its payloads; "
+                             f"use a loopback address or a unix: socket")
+        token = _token()
+        if token is None:
+            raise ValueError("Serving on TCP needs a shared secret in FLOW_WORKER_TOKEN, "
+                             "or use the default unix: socket")
+
+    start = time.perf_counter()
+    worker = FlowWorker(flows, max_concurrency, queue_timeout)
+    warm_up(model_uris)
+    enable_read_cache()
+    print(f"Loaded {', '.join(worker.flows)} in {time.perf_counter() - start:.1f}s")
+
+    if kind == "unix":
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        Path(target).unlink(missing_ok=True)
+        server = _UnixHTTPServer(target, _Handler)
+    else:
+        server = ThreadingHTTPServer(target, _Handler)
+    server.worker = worker
+    server.token = token
+
+    print(f"Worker listening on {address}, at most {max_concurrency} concurrent flows")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if kind == "unix":
+            Path(target).unlink(missing_ok=True)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def _request(method, path, body=None, address=None, timeout=None):
+    kind, target = _parse_address(address or default_address())
+    if kind == "unix":
+        conn = _UnixHTTPConnection(target, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(*target, timeout=timeout)
+    headers = {"Content-Type": "application/json"}
+    if kind == "tcp" and _token() is not None:
+        headers[TOKEN_HEADER] = _token()
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        conn.close()
+
+
+def submit(flow_name, payload, address=None, timeout=None):
+    """Run ``flow_name`` on the worker and wait for it, return the response of the worker.
+
+    ``payload`` is the JSON blob of ``python <flow>/flow.py`` as string or dict.
+    Raises ``RuntimeError`` if the flow could not be run.
+    """
+    body = payload if isinstance(payload, str) else json.dumps(payload)
+    status, response = _request("POST", f"/run/{flow_name}", body.encode("utf-8"), address, timeout)
+    if status != 200:
+        raise RuntimeError(f"Worker answered {status}: {response.get('error')}")
+    return response
+
+
+def health(address=None, timeout=5):
+    return _request("GET", "/health", address=address, timeout=timeout)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run flows in a long-lived worker process")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Start the worker")
+    serve_parser.add_argument("--address", default=None, help="unix:<path> (default FLOW_CACHE_DIR/worker.sock) or a loopback <host>:<port>, which needs FLOW_WORKER_TOKEN")
+    serve_parser.add_argument("--flows", nargs="+", default=FLOWS)
+    serve_parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    serve_parser.add_argument("--queue-timeout", type=float, default=DEFAULT_QUEUE_TIMEOUT)
+    serve_parser.add_argument("--model", action="append", default=[], help="Model URI to load at startup, e.g. models:/INC/latest")
+
+    run_parser = subparsers.add_parser("run", help="Run a flow on the worker, like python <flow>/flow.py '<json>'")
+    run_parser.add_argument("flow")
+    run_parser.add_argument("payload", nargs="?", default="{}")
+    run_parser.add_argument("--address", default=None)
+    run_parser.add_argument("--timeout", type=float, default=None)
+
+    health_parser = subparsers.add_parser("health", help="Show the loaded flows and the running ones")
+    health_parser.add_argument("--address", default=None)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.address, args.flows, args.max_concurrency, args.queue_timeout, args.model)
+    elif args.command == "run":
+        try:
+            response = submit(args.flow, args.payload, args.address, args.timeout)
+        except (OSError, RuntimeError) as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"Flow ID: {response['flow_id']}, Artifact ID: {response['artifact_id']}")
+    else:
+        print(json.dumps(health(args.address), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 from prefect import flow, task
 from datetime import datetime
-timestamp = datetime.now()
 from pathlib import Path
 import warnings
 warnings.filterwarnings("ignore")
@@ -11,19 +10,29 @@ import os
 import json
 import sys
 
+# The flows share helper modules in flow_common/ at the repository root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from flow_common.instrumentation import export_step_metrics, instrumented, record_steps
+from flow_common.batch import main as batch_main
+from flow_common.payload import parse_payload
+from flow_common.ledger import record_flow_run
+
 
 
 from task1 import main as run_drift_test
 @task(
     name="Step 1 of Monitoring Flow"
 )
+@instrumented("step_one")
 def step_one(*args, **kwargs):
-    run_drift_test(*args, **kwargs)
+    return run_drift_test(*args, **kwargs)
 
 
 @flow(
     name="MLOpsEx3 Monitoring Flow",
-    flow_run_name=f"MLOpsEx3 model monitoring flow at {timestamp.strftime('%Y%m%d-%H%M')}",
+    # Evaluated per run, a warm worker runs the same flow many times
+    flow_run_name=lambda: f"MLOpsEx3 model monitoring flow at {datetime.now().strftime('%Y%m%d-%H%M')}",
     description="This flow monitors the performance of a particular model on unseen data, by performing drift tests.",
     version="1.0.0",
     retries=0,
@@ -38,16 +47,24 @@ def myflow_runner(
         model_alias=None,
         model_path=None,
         cutoff_year=2020,
+        drift_mode="evidently",
+        drift_window="M",
+        rolling_windows=1,
         commit_id=None
 ):
-    step_one(Path(working_dir),
-             dataset_name,
-             report_name,
-             model_name,
-             model_version=model_version,
-             model_alias=model_alias,
-             model_path=model_path,
-             cutoff_year=cutoff_year)
+    timestamp = datetime.now()
+    steps = record_steps()
+    drift_result = step_one(Path(working_dir),
+                            dataset_name,
+                            report_name,
+                            model_name,
+                            model_version=model_version,
+                            model_alias=model_alias,
+                            model_path=model_path,
+                            cutoff_year=cutoff_year,
+                            drift_mode=drift_mode,
+                            drift_window=drift_window,
+                            rolling_windows=rolling_windows)
 
     flow_id = get_run_context().flow_run.id
 
@@ -58,12 +75,17 @@ def myflow_runner(
             "dataset_name": dataset_name,
             "report_name": report_name,
             "model_name": model_name,
-            "cutoff_year": cutoff_year
+            "cutoff_year": cutoff_year,
+            "drift_mode": drift_mode,
+            "drift_window": drift_window,
+            "rolling_windows": rolling_windows
         },
         "git_commit_hexsha": commit_id,
         "model_version": model_version,
         "model_alias": model_alias,
         "model_path_full": model_path,
+        "drift": drift_result,
+        "steps": steps,
         "timestamp_start": timestamp.isoformat(),
         "timestamp_end": datetime.now().isoformat(),
     }
@@ -78,9 +100,9 @@ def myflow_runner(
         description="Flow metadata serialized as JSON"
     )
 
-    # Dump the artifact locally too
-    with open("Flow_Artifacts_Local.txt", "a+", encoding="utf-8") as f:
-        f.write(metadata_json)
+    # Record the run in the local ledger too
+    record_flow_run("monitoring-flow", metadata)
+    export_step_metrics("monitoring-flow", str(flow_id), steps)
 
     with open("Flow_Ids.txt", "a+", encoding="utf-8") as f:
         f.write(str(flow_id) + '\n')
@@ -91,14 +113,15 @@ def myflow_runner(
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        # python flow.py --batch <payloads.jsonl> [--concurrency N] [--output results.csv]
+        batch_main(sys.argv[2:], flow_name="monitoring_flow", myflow_runner=myflow_runner)
+        return
+
     if len(sys.argv) > 1:
         try:
             # sys.argv[1] is a JSON string
-            param_blob = sys.argv[1]
-            params = json.loads(param_blob)
-            args = params.get("args", [])
-            kwargs = params.get("kwargs", {})
-            commit_id = params.get("commit_id", None)
+            args, kwargs, commit_id = parse_payload(sys.argv[1])
         except Exception as e:
             print(f"❌ Failed to parse args: {e}")
             args = []
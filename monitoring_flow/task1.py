@@ -1,11 +1,11 @@
-import mlflow.sklearn
 import pandas as pd
 from pathlib import Path
-from sklearn.metrics import balanced_accuracy_score, accuracy_score, f1_score
 
-from evidently.test_suite import TestSuite
-from evidently.tests import TestAccuracyScore, TestF1Score, TestRecallByClass
-from evidently.test_preset import MulticlassClassificationTestPreset, DataDriftTestPreset, DataStabilityTestPreset
+from flow_common.cpu import cpu_allocation
+from flow_common.feature_store import feature_store
+from flow_common.schema import FEATURE_COLUMNS
+from flow_common.profiles import compare_profile, reference_profile, save_drift_report
+from flow_common.drift_stream import save_drift_timeseries_report, streaming_drift
 
 def main(
         infile_dir,
@@ -16,46 +16,49 @@ def main(
         model_alias=None,
         model_path=None,
         cutoff_year=2020,
+        drift_mode="evidently",
+        drift_window="M",
+        rolling_windows=1,
 ):
-    input_path = infile_dir / infile_name
-    dataset = pd.read_csv(input_path, index_col=False)
-    dataset.release_date = pd.to_datetime(dataset.release_date)
+    """Test the post-cutoff data for drift against the pre-cutoff data.
 
-    model_version = "latest" if model_version is None else model_version
+    drift_mode "evidently" runs the evidently drift and stability presets on the raw rows,
+    "profile" compares against a cached profile of the reference slice, so the reference
+    statistics are only computed once per dataset, cutoff year and column set.
+    "streaming" reads the dataset in chunks and reports drift against the same profile
+    per drift_window (a pandas period frequency, merged over rolling_windows windows).
+    """
+    if drift_mode not in ("evidently", "profile", "streaming"):
+        raise ValueError(f"Unknown drift_mode '{drift_mode}', expected 'evidently', 'profile' or 'streaming'")
 
+    input_cols = FEATURE_COLUMNS
 
-    # Load the model from the Model Registry
-    if model_path is not None:
-        model_uri = model_path
-    elif model_alias is not None:
-        model_uri = f"models:/{model_name}@{model_alias}"
-    else:
-        model_uri = f"models:/{model_name}/{model_version}"
+    input_path = infile_dir / infile_name
 
-    model = mlflow.sklearn.load_model(model_uri)
+    # Streaming mode never holds the full dataset in memory
+    if drift_mode == "streaming":
+        timeseries = streaming_drift(input_path, cutoff_year, input_cols, window=drift_window, rolling_windows=rolling_windows)
+        timeseries.to_csv(infile_dir / (Path(report_name).stem + "_timeseries.csv"), index=False)
+        save_drift_timeseries_report(timeseries, infile_dir / report_name)
+        return timeseries.to_dict(orient="records")
 
-    input_cols = ['price', 'positive_reviews', 'negative_reviews', 'metacritic_score', 'peak_ccu', 'recommendations', 'required_age', 'on_linux', 'on_mac', 'on_windows']
-    X, y = dataset[input_cols], dataset['estimated_owners']
+    store = feature_store(input_path)
 
-    mask = dataset.release_date.dt.year >= cutoff_year
-    X_old = X[~mask]
-    y_old = y[~mask]
-    y_old_pred = model.predict(X_old)
+    # The drift tests only look at the features, the model is not loaded
+    old_rows, new_rows = store.before(cutoff_year), store.from_year(cutoff_year)
 
-    X_new = X[mask]
-    y_new = y[mask]
-    y_new_pred = model.predict(X_new)
+    # The drift tests get the features with their schema dtypes, e.g. the platform flags as bool
+    X_new = store.frame(new_rows)
 
-    # Create a DataFrame with actual and predicted values
-    df_old = pd.DataFrame({
-        'target': y_old,
-        'prediction': y_old_pred
-    })
-    df_new = pd.DataFrame({
-        'target': y_new,
-        'prediction': y_new_pred
-    })
+    if drift_mode == "profile":
+        profile = reference_profile(input_path, cutoff_year, input_cols, lambda: store.frame(old_rows))
+        result = compare_profile(profile, X_new)
+        save_drift_report(result, infile_dir / report_name)
+        return result
 
+    # evidently is only imported in the mode that uses it, it takes seconds to load
+    from evidently.test_suite import TestSuite
+    from evidently.test_preset import DataDriftTestPreset, DataStabilityTestPreset
 
     # Define test suite
     test_suite = TestSuite(
@@ -65,8 +68,9 @@ def main(
         ]
     )
 
-    # Run the test suite
-    test_suite.run(reference_data=X_old, current_data=X_new)
+    # Run the test suite, on one core of the host CPU budget
+    with cpu_allocation("monitoring_flow/task1", want=1):
+        test_suite.run(reference_data=store.frame(old_rows), current_data=X_new)
 
     # Save the test results to HTML
     test_suite.save_html(str(infile_dir / report_name))
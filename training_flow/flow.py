@@ -1,6 +1,5 @@
 from prefect import flow, task
 from datetime import datetime
-timestamp = datetime.now()
 from pathlib import Path
 import warnings
 warnings.filterwarnings("ignore")
@@ -11,6 +10,14 @@ import os
 import json
 import sys
 
+# The flows share helper modules in flow_common/ at the repository root
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from flow_common.instrumentation import export_step_metrics, instrumented, record_steps
+from flow_common.batch import main as batch_main
+from flow_common.payload import parse_payload
+from flow_common.ledger import record_flow_run
+
 
 
 from task1 import main as run_data_tests
@@ -20,12 +27,14 @@ from task3 import main as test_model
 @task(
     name="Step 1 of Training Flow"
 )
+@instrumented("step_one")
 def step_one(*args, **kwargs):
     run_data_tests(*args, **kwargs)
 
 @task(
     name="Step 2 of Training Flow"
 )
+@instrumented("step_two")
 def step_two(*args, **kwargs):
     model_info = train_model(*args, **kwargs)
     return model_info
@@ -35,13 +44,15 @@ def step_two(*args, **kwargs):
     retries=0,
     timeout_seconds=60,
 )
+@instrumented("step_three")
 def step_three(*args, **kwargs):
     metrics = test_model(*args, **kwargs)
     return metrics
 
 @flow(
     name="MLOpsEx3 Training Flow",
-    flow_run_name=f"MLOpsEx3 model training flow at {timestamp.strftime('%Y%m%d-%H%M')}",
+    # Evaluated per run, a warm worker runs the same flow many times
+    flow_run_name=lambda: f"MLOpsEx3 model training flow at {datetime.now().strftime('%Y%m%d-%H%M')}",
     description="This flow includes data tests of the Steam Games Dataset, training of a Random Forest Model and validation of the model on a test set",
     version="2.0.0",
     retries=0,
@@ -53,18 +64,31 @@ def myflow_runner(
         report_name,
         model_name,
         cutoff_year=2020,
+        use_dataset_cache=True,
+        hyperparameter_file=None,
+        incremental=False,
+        partition_by_year=False,
+        streaming=False,
+        evidently_report=True,
         commit_id=None
 ):
+    timestamp = datetime.now()
+    steps = record_steps()
     output_dir_pth = Path(output_dir)
 
     step_one(output_dir_pth,
              outfile_name,
-             report_name)
+             report_name,
+             use_cache=use_dataset_cache,
+             partition_by_year=partition_by_year)
 
     model_training_results = step_two(output_dir_pth,
                                       outfile_name,
                                       model_name,
                                       cutoff_year,
+                                      hyperparameter_file=hyperparameter_file,
+                                      incremental=incremental,
+                                      streaming=streaming,
                                       return_state=True)
 
 
@@ -90,7 +114,8 @@ def myflow_runner(
                          model_alias=model_alias,
                          cutoff_year=cutoff_year,
                          acc_threshold=0.9*train_metrics['accuracy'],
-                         f1_threshold=0.9*train_metrics['f1'])
+                         f1_threshold=0.9*train_metrics['f1'],
+                         evidently_report=evidently_report)
 
     flow_id = get_run_context().flow_run.id
 
@@ -101,7 +126,13 @@ def myflow_runner(
             "outfile_name": outfile_name,
             "report_name": report_name,
             "model_name": model_name,
-            "cutoff_year": cutoff_year
+            "cutoff_year": cutoff_year,
+            "use_dataset_cache": use_dataset_cache,
+            "hyperparameter_file": hyperparameter_file,
+            "incremental": incremental,
+            "partition_by_year": partition_by_year,
+            "streaming": streaming,
+            "evidently_report": evidently_report
         },
         "git_commit_hexsha": commit_id,
         "metrics": {
@@ -111,6 +142,7 @@ def myflow_runner(
         },
         "model_training_successful": not model_training_results.is_failed(),
         "model_path_full": model_path_full,
+        "steps": steps,
         "timestamp_start": timestamp.isoformat(),
         "timestamp_end": datetime.now().isoformat(),
     }
@@ -125,9 +157,9 @@ def myflow_runner(
         description="Flow metadata serialized as JSON"
     )
 
-    # Dump the artifact locally too
-    with open("Flow_Artifacts_Local.txt", "a+", encoding="utf-8") as f:
-        f.write(metadata_json)
+    # Record the run in the local ledger too
+    record_flow_run("training-flow", metadata)
+    export_step_metrics("training-flow", str(flow_id), steps)
 
     with open("Flow_Ids.txt", "a+", encoding="utf-8") as f:
         f.write(str(flow_id) + '\n')
@@ -138,14 +170,15 @@ def myflow_runner(
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        # python flow.py --batch <payloads.jsonl> [--concurrency N] [--output results.csv]
+        batch_main(sys.argv[2:], flow_name="training_flow", myflow_runner=myflow_runner)
+        return
+
     if len(sys.argv) > 1:
         try:
             # sys.argv[1] is a JSON string
-            param_blob = sys.argv[1]
-            params = json.loads(param_blob)
-            args = params.get("args", [])
-            kwargs = params.get("kwargs", {})
-            commit_id = params.get("commit_id", None)
+            args, kwargs, commit_id = parse_payload(sys.argv[1])
         except Exception as e:
             print(f"❌ Failed to parse args: {e}")
             args = []
@@ -0,0 +1,78 @@
+from flow_common.estimators import get_backend
+
+
+def is_search_config(config):
+    """A hyperparameter file with a "search_space" entry describes a search instead of a single model.
+
+    Besides the search space the file may set "fixed" parameters shared by all candidates,
+    the "strategy" ("grid" or "random" with "n_candidates"), the halving "resource"
+    (by default "n_estimators", or "max_iter" for the "estimator" "hist_gradient_boosting",
+    or "n_samples" for a growing data subsample), "min_resources",
+    "max_resources", "factor", "cv", "scoring" and "n_jobs".
+    See model_hyperparameters_search.txt for an example.
+    """
+    return "search_space" in config
+
+
+def run_search(config, X_train, y_train, backend=None, n_jobs=None):
+    """Successive halving over the search space, evaluating the candidates on a process pool.
+
+    Every round only the best 1/factor of the candidates survive and get more of the
+    resource (trees / boosting iterations or training rows), so weak configurations
+    are cut early. ``backend`` is the estimator backend of the candidates, random
+    forest by default; ``n_jobs`` overrides the size of the pool from the config.
+    """
+    from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+    from sklearn.model_selection import HalvingGridSearchCV, HalvingRandomSearchCV
+
+    backend = backend or get_backend()
+    fixed = config.get("fixed", {})
+    resource = config.get("resource", backend.size_param)
+    max_resources = config.get("max_resources", "auto" if resource == "n_samples" else fixed.get(resource, 100))
+
+    search_kwargs = dict(
+        factor=config.get("factor", 3),
+        resource=resource,
+        min_resources=config.get("min_resources", "exhaust"),
+        max_resources=max_resources,
+        cv=config.get("cv", 3),
+        scoring=config.get("scoring", "f1_macro"),
+        n_jobs=n_jobs if n_jobs is not None else config.get("n_jobs", -1),
+        random_state=fixed.get("random_state"),
+        refit=True,
+    )
+
+    estimator = backend.make(fixed)
+    strategy = config.get("strategy", "grid")
+    if strategy == "grid":
+        search = HalvingGridSearchCV(estimator, config["search_space"], **search_kwargs)
+    elif strategy == "random":
+        search = HalvingRandomSearchCV(
+            estimator, config["search_space"], n_candidates=config.get("n_candidates", "exhaust"), **search_kwargs
+        )
+    else:
+        raise ValueError(f"Unknown search strategy '{strategy}', expected 'grid' or 'random'")
+
+    search.fit(X_train, y_train)
+    return search
+
+
+def best_params(config, search):
+    """Parameters of the registered ``best_estimator_``, including the resource it was refit with."""
+    return {**config.get("fixed", {}), **search.best_params_}
+
+
+def log_trials(search):
+    """Log every evaluated (candidate, halving round) pair as a nested MLflow run of the active run."""
+    import mlflow
+
+    results = search.cv_results_
+    for i, params in enumerate(results["params"]):
+        with mlflow.start_run(run_name=f"Trial {i}", nested=True):
+            mlflow.log_params(params)
+            mlflow.log_params({
+                "halving_iteration": int(results["iter"][i]),
+                search.resource: int(results["n_resources"][i]),
+            })
+            mlflow.log_metric("cv_score_mean", float(results["mean_test_score"][i]))
+            mlflow.log_metric("cv_score_std", float(results["std_test_score"][i]))
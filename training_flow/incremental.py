@@ -0,0 +1,70 @@
+import copy
+import hashlib
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from flow_common.model_cache import load_model, resolve_model_uri
+
+
+ROW_HASHES_ARTIFACT = "training_data/row_hashes.npy"
+
+
+def data_fingerprint(row_hashes):
+    return hashlib.sha256(np.unique(row_hashes).tobytes()).hexdigest()
+
+
+def log_row_hashes(row_hashes):
+    """Store the hashes of all rows the model has seen with the active MLflow run."""
+    import mlflow
+
+    row_hashes = np.unique(row_hashes)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / Path(ROW_HASHES_ARTIFACT).name
+        np.save(path, row_hashes)
+        mlflow.log_artifact(str(path), artifact_path=str(Path(ROW_HASHES_ARTIFACT).parent))
+    mlflow.set_tag("data_fingerprint", data_fingerprint(row_hashes))
+
+
+def load_previous_version(model_name):
+    """Latest registered version of ``model_name``: a private copy of the model, its version and row hashes."""
+    import mlflow
+    from mlflow.tracking import MlflowClient
+
+    model_uri = resolve_model_uri(f"models:/{model_name}/latest")
+    version = model_uri.rsplit("/", 1)[-1]
+
+    run_id = MlflowClient().get_model_version(model_name, version).run_id
+    try:
+        path = mlflow.artifacts.download_artifacts(run_id=run_id, artifact_path=ROW_HASHES_ARTIFACT)
+    except Exception as e:
+        raise ValueError(f"Model version {model_uri} has no data fingerprint, train it from scratch first: {e}")
+
+    # The cached instance is shared within the process, warm starting must not modify it
+    model = copy.deepcopy(load_model(model_uri))
+    return model, version, np.load(path)
+
+
+def add_trees(model, X_new, y_new, n_new_trees):
+    """Grow the forest by ``n_new_trees`` trees fitted on the new rows only."""
+    new_classes = set(np.unique(y_new))
+    unknown = new_classes - set(model.classes_)
+    if unknown:
+        raise ValueError(f"New rows contain classes {sorted(unknown)} the previous model has never seen, retrain from scratch")
+
+    # Warm starting re-derives classes_ from y, so classes missing from the new rows
+    # are added as zero-weight rows: they keep the class order of the existing trees
+    # without influencing the new ones
+    missing = [c for c in model.classes_ if c not in new_classes]
+    sample_weight = np.ones(len(X_new))
+    if missing:
+        X_new = pd.concat([X_new, X_new.iloc[[0] * len(missing)]])
+        y_new = pd.concat([y_new, pd.Series(missing, index=X_new.index[-len(missing):], dtype=y_new.dtype)])
+        sample_weight = np.concatenate([sample_weight, np.zeros(len(missing))])
+
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_new_trees)
+    model.fit(X_new, y_new, sample_weight=sample_weight)
+    model.set_params(warm_start=False)
+    return model
@@ -0,0 +1,147 @@
+"""Out-of-core training: a random forest grown chunk by chunk over datasets larger than memory.
+
+The regular training materializes the features of the whole dataset
+(``flow_common.feature_store``) and splits them with ``train_test_split``. In
+streaming mode the rows before the cutoff year are read in chunks
+(``flow_common.dataset_io.iter_dataset``) instead, so at most about three chunks
+of rows are in memory at a time:
+
+* The test rows are held out by their content hash (``schema.row_hashes``, the
+  hashes incremental training logs): a row is a test row if its hash falls in
+  the first ``test_size`` of the hash range. The split is deterministic and the
+  same for every chunk size and dataset layout, and duplicates of a row are
+  always on the same side.
+* Every chunk of ``chunksize`` training rows gets its own forest, with its
+  share of the ``n_estimators`` trees of the hyperparameters, and the trees of
+  all chunks are joined into one ``RandomForestClassifier``. A first pass over
+  the labels collects the classes of all rows; classes a chunk lacks are added
+  to it as zero-weight rows, like in ``incremental.add_trees``, so all trees
+  predict over the same classes in the same order.
+* The test rows are predicted in a second pass, once the forest is complete,
+  and only their confusion matrix (``flow_common.metrics``) is kept, merged
+  over the chunks.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from flow_common.dataset_io import iter_dataset
+from flow_common.metrics import ConfusionMatrix
+from flow_common.schema import FEATURE_COLUMNS, TARGET_COLUMN, row_hashes
+
+
+DEFAULT_CHUNKSIZE = 250_000
+DEFAULT_TEST_SIZE = 0.2
+HASH_BUCKETS = 10_000
+INPUT_EXAMPLE_ROWS = 5
+
+
+def is_test_row(hashes, test_size=DEFAULT_TEST_SIZE):
+    """Deterministic hold out of about ``test_size`` of the rows with content ``hashes``."""
+    return hashes % HASH_BUCKETS < round(test_size * HASH_BUCKETS)
+
+
+def _scan(dataset_path, cutoff_year, chunksize):
+    """Number of rows before ``cutoff_year`` and the labels among them, from the label column only."""
+    n_rows, labels = 0, set()
+    for chunk in iter_dataset(dataset_path, columns=[TARGET_COLUMN], chunksize=chunksize, before_year=cutoff_year):
+        n_rows += len(chunk)
+        labels.update(chunk[TARGET_COLUMN].dropna().unique())
+    return n_rows, sorted(labels)
+
+
+def _split_chunks(dataset_path, cutoff_year, chunksize, test_size):
+    """Features, labels and test row mask of the rows before ``cutoff_year``, chunk by chunk."""
+    columns = [*FEATURE_COLUMNS, TARGET_COLUMN]
+    for chunk in iter_dataset(dataset_path, columns=columns, chunksize=chunksize, before_year=cutoff_year):
+        # Float32 like the materialized features, the dtype the compiled forests compare in
+        X = pd.DataFrame(chunk[FEATURE_COLUMNS].to_numpy(dtype=np.float32), columns=FEATURE_COLUMNS)
+        y = chunk[TARGET_COLUMN].to_numpy(dtype=object)
+        yield X, y, is_test_row(row_hashes(chunk[columns]), test_size)
+
+
+def _training_chunks(chunks, chunksize):
+    """Training rows of ``chunks`` regrouped into blocks of ``chunksize`` rows.
+
+    The rows left at the end are split into two blocks of at least half a
+    ``chunksize`` each, rather than leaving a small last block.
+    """
+    X_parts, y_parts, n_buffered = [], [], 0
+    for X, y, is_test in chunks:
+        X_parts.append(X[~is_test])
+        y_parts.append(y[~is_test])
+        n_buffered += len(y_parts[-1])
+        if n_buffered >= 2 * chunksize:
+            X_all, y_all = pd.concat(X_parts, ignore_index=True), np.concatenate(y_parts)
+            while len(y_all) >= 2 * chunksize:
+                yield X_all.iloc[:chunksize], y_all[:chunksize]
+                X_all, y_all = X_all.iloc[chunksize:].reset_index(drop=True), y_all[chunksize:]
+            X_parts, y_parts, n_buffered = [X_all], [y_all], len(y_all)
+    if n_buffered:
+        X_all, y_all = pd.concat(X_parts, ignore_index=True), np.concatenate(y_parts)
+        split = n_buffered // 2 if n_buffered > chunksize else n_buffered
+        yield X_all.iloc[:split].reset_index(drop=True), y_all[:split]
+        if split < n_buffered:
+            yield X_all.iloc[split:].reset_index(drop=True), y_all[split:]
+
+
+def _fit_chunk(backend, params, X, y, classes, n_trees, chunk_index):
+    present = set(y)
+    missing = [label for label in classes if label not in present]
+    sample_weight = np.ones(len(y))
+    if missing:
+        X = pd.concat([X, X.iloc[[0] * len(missing)]], ignore_index=True)
+        y = np.concatenate([y, np.array(missing, dtype=object)])
+        sample_weight = np.concatenate([sample_weight, np.zeros(len(missing))])
+
+    params = dict(params, n_estimators=n_trees)
+    if isinstance(params.get("random_state"), int):
+        # Same seed for every chunk would draw the same features and bootstrap positions in all of them
+        params["random_state"] += chunk_index
+    forest = backend.make(params)
+    forest.fit(X, y, sample_weight=sample_weight)
+    return forest
+
+
+def fit_streaming(dataset_path, cutoff_year, backend, params, chunksize=DEFAULT_CHUNKSIZE, test_size=DEFAULT_TEST_SIZE):
+    """Forest trained chunk by chunk on the rows before ``cutoff_year``, evaluated on the held out ones.
+
+    Returns the forest, a few training rows and their labels (the input example
+    of the logged model) and the confusion matrix of the test rows.
+    """
+    if not backend.compilable:
+        raise ValueError(f"Streaming training joins the trees of one forest per chunk, it does not support '{backend.name}'")
+
+    n_rows, classes = _scan(dataset_path, cutoff_year, chunksize)
+    # The test rows are only known after hashing, the trees are spread over the expected number of chunks
+    n_chunks = max(1, math.ceil(n_rows * (1 - test_size) / chunksize))
+    n_estimators = params.get("n_estimators", 100)
+    print(f"Streaming {n_rows} rows in chunks of {chunksize}, about {n_chunks} forests of {n_estimators / n_chunks:.1f} trees")
+
+    model, X_example, y_example, n_train = None, None, None, 0
+    chunks = _training_chunks(_split_chunks(dataset_path, cutoff_year, chunksize, test_size), chunksize)
+    for i, (X, y) in enumerate(chunks):
+        # Trees due for the rows trained on so far, at least one per chunk
+        n_trees = max(1, round(n_estimators * (i + 1) / n_chunks) - (len(model.estimators_) if model is not None else 0))
+        forest = _fit_chunk(backend, params, X, y, classes, n_trees, i)
+        if model is None:
+            model, X_example, y_example = forest, X.head(INPUT_EXAMPLE_ROWS), pd.Series(y[:INPUT_EXAMPLE_ROWS])
+        else:
+            model.estimators_ += forest.estimators_
+        model.n_estimators = len(model.estimators_)
+        n_train += len(y)
+        print(f"Chunk {i + 1}: {len(y)} rows, {n_trees} trees, {model.n_estimators} trees in total")
+
+    if model is None or n_train < 1000:
+        raise ValueError('Training set is too small to produce a good model')
+
+    matrix = ConfusionMatrix()
+    for X, y, is_test in _split_chunks(dataset_path, cutoff_year, chunksize, test_size):
+        if is_test.any():
+            matrix += ConfusionMatrix.from_labels(y[is_test], model.predict(X[is_test]))
+    if len(matrix) == 0:
+        raise ValueError('No rows were held out for testing')
+    print(f"Trained on {n_train} rows, tested on {len(matrix)} held out rows")
+
+    return model, X_example, y_example, matrix
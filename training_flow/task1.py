@@ -1,47 +1,91 @@
-from huggingface_hub import hf_hub_download
 import pandas as pd
 import numpy as np
 
-from evidently.future.datasets import Dataset, DataDefinition
-from evidently.test_suite import TestSuite
-from evidently.tests import *
-
 from pathlib import Path
 
+from flow_common.cpu import cpu_allocation
+from flow_common.dataset_cache import DatasetCache
+from flow_common.dataset_io import write_dataset
+from flow_common.schema import apply_schema
 
 
-def main(
-        output_dir: Path,
-        outfile_name: Path,
-        report_name: Path,
-):
-    REPO_ID = "FronkonGames/steam-games-dataset"
-    FILENAME = "games.csv"
+REPO_ID = "FronkonGames/steam-games-dataset"
+FILENAME = "games.csv"
+REVISION = "7e8915c96cd1a237d0655b8309dd1e8062ac841f"
 
-    dataset = pd.read_csv(
-        hf_hub_download(repo_id=REPO_ID, filename=FILENAME, repo_type="dataset", revision="7e8915c96cd1a237d0655b8309dd1e8062ac841f"),
-    )
+# Bump whenever preprocess() changes, so stale cache entries are no longer used
+PREPROCESSING_VERSION = 2
 
+
+# Filter to only keep relevant columns, rename to make it easier to adress
+useful_columns_rename = {
+    "Name" : "name",
+    "Release date" : "release_date",
+    "Estimated owners": "estimated_owners",
+    "Price": "price",
+    "Positive" : "positive_reviews",
+    "Negative" : "negative_reviews",
+    "Metacritic score" : "metacritic_score",
+    "Peak CCU": "peak_ccu",
+    "Recommendations": "recommendations",
+    "Required age": "required_age",
+    "Windows": "on_windows",
+    "Linux": "on_linux",
+    "Mac": "on_mac"
+}
+
+
+def preprocess(dataset):
     dataset['Release date'] = pd.to_datetime(dataset['Release date'], format="%b %d, %Y", errors="coerce")
 
-    # Filter to only keep relevant columns, rename to make it easier to adress
-    useful_columns_rename = {
-        "Name" : "name",
-        "Release date" : "release_date",
-        "Estimated owners": "estimated_owners",
-        "Price": "price",
-        "Positive" : "positive_reviews",
-        "Negative" : "negative_reviews",
-        "Metacritic score" : "metacritic_score",
-        "Peak CCU": "peak_ccu",
-        "Recommendations": "recommendations",
-        "Required age": "required_age",
-        "Windows": "on_windows",
-        "Linux": "on_linux",
-        "Mac": "on_mac"
-    }
     dataset = dataset[[col for col in useful_columns_rename.keys()]]
     dataset.rename(columns=useful_columns_rename, inplace=True)
+    return apply_schema(dataset)
+
+
+def load_dataset(use_cache=True):
+    """Download and preprocess the pinned dataset revision, or load it from the local cache.
+
+    A warm cache needs no network access at all, so the flow can run offline.
+    """
+    cache = DatasetCache()
+    key = cache.key(REPO_ID, FILENAME, REVISION, PREPROCESSING_VERSION)
+
+    if use_cache:
+        dataset = cache.get(key)
+        if dataset is not None:
+            print(f"Loaded preprocessed dataset from cache {cache.path(key)}")
+            return dataset
+
+    from huggingface_hub import hf_hub_download
+
+    # Only the used columns are parsed, the raw file also holds long free text columns
+    dataset = pd.read_csv(
+        hf_hub_download(repo_id=REPO_ID, filename=FILENAME, repo_type="dataset", revision=REVISION),
+        usecols=list(useful_columns_rename.keys()),
+        dtype={"Estimated owners": "category"},
+    )
+    dataset = preprocess(dataset)
+
+    if use_cache:
+        cache.put(key, dataset)
+
+    return dataset
+
+
+def main(
+        output_dir: Path,
+        outfile_name: Path,
+        report_name: Path,
+        use_cache: bool = True,
+        partition_by_year: bool = False,
+):
+    # evidently takes seconds to import, so it is only loaded when the tests actually run
+    from evidently.future.datasets import DataDefinition
+    from evidently.test_suite import TestSuite
+    from evidently.tests import TestColumnDrift, TestColumnNumberOfMissingValues, TestColumnQuantile
+
+    dataset = load_dataset(use_cache=use_cache)
 
 
     definition = DataDefinition(
@@ -71,7 +115,9 @@ def main(
 
     def run_data_drift_tests(reference_data, current_data, tests, column_mapping=None):
         data_drift_test_suite = TestSuite(tests=tests)
-        data_drift_test_suite.run(reference_data=reference_data, current_data=current_data, column_mapping=column_mapping)
+        # The suite runs single threaded, its lease keeps the core out of the budget of concurrent fits
+        with cpu_allocation("training_flow/task1", want=1):
+            data_drift_test_suite.run(reference_data=reference_data, current_data=current_data, column_mapping=column_mapping)
         return data_drift_test_suite
 
     result = run_data_drift_tests(reference_data=dataset_reference, current_data=dataset_current, tests=tests)
@@ -79,7 +125,8 @@ def main(
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    dataset.to_csv(output_dir / outfile_name, index=False)
+    # Partitioned by release year, later tasks only open the years on their side of the cutoff
+    write_dataset(dataset, output_dir / outfile_name, partition_by_year=partition_by_year)
     result.save_html(str(output_dir / report_name))
 
     return
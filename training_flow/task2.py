@@ -1,53 +1,116 @@
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import mean_squared_error
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, f1_score, balanced_accuracy_score, classification_report
+import numpy as np
 import pandas as pd
 from pathlib import Path
-import mlflow
 import json
 
+from flow_common.cpu import cpu_allocation
+from flow_common.estimators import ESTIMATOR_KEY, backend_of, split_params
+from flow_common.feature_store import feature_store
+from flow_common.metrics import ConfusionMatrix
+from flow_common.forest_engine import log_compiled_forest
+from hyperparameter_search import best_params, is_search_config, log_trials, run_search
+from incremental import add_trees, load_previous_version, log_row_hashes
+from streaming import DEFAULT_CHUNKSIZE, fit_streaming
+
+DEFAULT_HYPERPARAMETER_FILE = Path("./flows_git/training_flow/model_hyperparameters.txt")
+
 def main(infile_dir,
          infile_name,
          model_name,
-         cutoff_year=2020):
-    input_path = infile_dir / infile_name
-    dataset = pd.read_csv(input_path, index_col=False)
-    dataset.release_date = pd.to_datetime(dataset.release_date)
-
-    mask = dataset.release_date.dt.year < cutoff_year
-    dataset = dataset[mask]
-
-    input_cols = ['price', 'positive_reviews', 'negative_reviews', 'metacritic_score', 'peak_ccu', 'recommendations', 'required_age', 'on_linux', 'on_mac', 'on_windows']
-
-    X, y = dataset[input_cols], dataset['estimated_owners']
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2
-    )
-
-    if len(X_train) < 1000:
-        raise ValueError('Training set is too small to produce a good model')
-
-
-
-    hp_path = Path("./flows_git/training_flow/model_hyperparameters.txt")
-    try:
-        with open(hp_path, "r", encoding="utf-8") as f:
-            params = json.loads(f.read())
-    except FileNotFoundError as e:
-        raise FileNotFoundError(f"Could not find (or read) hyperparameter file at {hp_path} : {e}")
-
-    model = RandomForestClassifier(**params)
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
-
-    # Calculate metrics
-    accuracy = accuracy_score(y_test, y_pred)
-    f1 = f1_score(y_test, y_pred, average='macro')
-    balanced_accuracy = balanced_accuracy_score(y_test, y_pred)
-    metrics = {'accuracy': accuracy, 'balanced_accuracy':balanced_accuracy, "f1": f1}
+         cutoff_year=2020,
+         hyperparameter_file=None,
+         incremental=False,
+         incremental_trees=None,
+         streaming=False,
+         chunksize=DEFAULT_CHUNKSIZE):
+    # sklearn and mlflow are only imported once a model is actually trained, to keep flow startup fast
+    import mlflow
+    from sklearn.model_selection import train_test_split
+
+    if streaming:
+        # The dataset is read chunk by chunk in training (streaming.py), nothing is materialized
+        if incremental:
+            raise ValueError('Incremental training needs the row hashes of all rows, it cannot be combined with streaming')
+    else:
+        # Rows of the materialized features are sorted by release year, the training rows are a slice of them
+        store = feature_store(infile_dir / infile_name)
+        rows = store.before(cutoff_year)
+        X, y = store.X(rows), store.y(rows)
+        row_hashes = store.row_hashes(rows)
+
+        # In incremental mode only the rows the latest registered version has not seen yet are used
+        X_fit, y_fit = X, y
+        if incremental:
+            model, base_version, seen_row_hashes = load_previous_version(model_name)
+            is_new = ~np.isin(row_hashes, seen_row_hashes)
+            X_fit, y_fit, row_hashes = X[is_new], y[is_new], row_hashes[is_new]
+            print(f"Warm starting from version {base_version} with {len(X_fit)} new rows")
+
+            if len(X_fit) < 10:
+                raise ValueError(f'Only {len(X_fit)} new rows since model version {base_version}, nothing to train on')
+
+        X_train, X_test, y_train, y_test, train_row_hashes, _ = train_test_split(
+            X_fit, y_fit, row_hashes, test_size=0.2
+        )
+        # Only the fitted rows count as seen, the test rows are new to the next incremental run
+        row_hashes = np.union1d(seen_row_hashes, train_row_hashes) if incremental else train_row_hashes
+
+        if not incremental and len(X_train) < 1000:
+            raise ValueError('Training set is too small to produce a good model')
+
+
+    params = {}
+    if not incremental:
+        hp_path = Path(hyperparameter_file) if hyperparameter_file is not None else DEFAULT_HYPERPARAMETER_FILE
+        try:
+            with open(hp_path, "r", encoding="utf-8") as f:
+                params = json.loads(f.read())
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"Could not find (or read) hyperparameter file at {hp_path} : {e}")
+
+    # The "estimator" of the file picks the backend (flow_common.estimators), random forest by default
+    backend, estimator_params = split_params(params)
+
+    # The fit runs on the cores the host CPU budget grants, "n_jobs" of the file only caps the request
+    search = None
+    with cpu_allocation("training_flow/task2", want=params.get("n_jobs")) as cores:
+        if incremental:
+            backend = backend_of(model)
+            if backend is None or not backend.compilable:
+                raise ValueError(f"Incremental training adds trees to a random forest, version {base_version} is a {type(model).__name__}")
+            # By default the new trees get the same share of the forest as the new rows have of all fitted rows
+            n_new_trees = incremental_trees or max(1, round(len(model.estimators_) * len(X_train) / len(row_hashes)))
+            add_trees(model, X_train, y_train, n_new_trees)
+            params = {
+                "warm_start_from_version": base_version,
+                "n_new_rows": len(X_fit),
+                "n_new_trees": n_new_trees,
+                "n_estimators": model.n_estimators,
+            }
+        elif streaming:
+            if is_search_config(params):
+                raise ValueError('A hyperparameter search needs all training rows at once, it cannot be combined with streaming')
+            model, X_train, y_train, matrix = fit_streaming(
+                infile_dir / infile_name, cutoff_year, backend, estimator_params, chunksize=chunksize
+            )
+            # Only a few training rows are kept, for the signature and input example of the logged model
+            X, y = X_train, y_train
+            params = {**params, "n_estimators": model.n_estimators, "streaming_chunksize": chunksize}
+        # Either train the single configuration from the file, or search its space for the best one
+        elif is_search_config(params):
+            search = run_search(estimator_params, X_train, y_train, backend=backend, n_jobs=cores)
+            params = {ESTIMATOR_KEY: backend.name, **best_params(estimator_params, search)}
+            model = search.best_estimator_
+        else:
+            # n_jobs=None takes the granted cores from the allocation, and does not pin them in the logged model
+            model = backend.make(estimator_params)
+            model.fit(X_train, y_train)
+        if not streaming:
+            matrix = ConfusionMatrix.from_labels(y_test, model.predict(X_test))
+
+    # All metrics come from one confusion matrix of the test rows
+    metrics = matrix.metrics()
+    accuracy, balanced_accuracy, f1 = metrics["accuracy"], metrics["balanced_accuracy"], metrics["f1"]
 
     mlflow.set_experiment("MLOpsEx3")
 
@@ -56,16 +119,28 @@ def main(infile_dir,
         mlflow.log_metric("f1_score_macro", f1)
         mlflow.log_metric("balanced_accuracy", balanced_accuracy)
 
-        mlflow.set_tag("Training Info", "Basic RF model for steam games dataset")
+        mlflow.set_tag("Training Info", backend.description)
 
-        signature = mlflow.models.infer_signature(X.loc[0].to_dict(), y.loc[0])
+        signature = mlflow.models.infer_signature(X.iloc[0].to_dict(), y.iloc[0])
 
         mlflow.log_params(params)
 
+        # Lets a later incremental run find the rows this version has not seen
+        if not streaming:
+            log_row_hashes(row_hashes)
+
+        # Only the winner is registered, the candidates are kept as child runs
+        if search is not None:
+            log_trials(search)
+
+        # Logged before registering, so every registered forest comes with its compiled version
+        if backend.compilable:
+            log_compiled_forest(model)
+
         model_info = mlflow.sklearn.log_model(
             sk_model=model,
             signature=signature,
-            artifact_path="random_forest_model",
+            artifact_path=f"{backend.name}_model",
             input_example=X_train,
             registered_model_name=model_name
         )
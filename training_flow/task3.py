@@ -1,11 +1,9 @@
-import mlflow.sklearn
 import pandas as pd
 from pathlib import Path
-from sklearn.metrics import balanced_accuracy_score, accuracy_score, f1_score
 
-from evidently.test_suite import TestSuite
-from evidently.tests import TestAccuracyScore, TestF1Score, TestRecallByClass
-from evidently.test_preset import MulticlassClassificationTestPreset
+from flow_common.feature_store import feature_store
+from flow_common.metrics import ConfusionMatrix, save_classification_report
+from flow_common.predictions import predict
 
 def main(
         infile_dir,
@@ -15,15 +13,17 @@ def main(
          model_alias=None,
          cutoff_year=2020,
          acc_threshold=0,
-         f1_threshold=0
+         f1_threshold=0,
+         evidently_report=True
     ):
+    """Evaluate the model on the rows from ``cutoff_year`` on.
 
-    input_path = infile_dir / infile_name
-    dataset = pd.read_csv(input_path, index_col=False)
-    dataset.release_date = pd.to_datetime(dataset.release_date)
-
-    mask = dataset.release_date.dt.year >= cutoff_year
-    dataset = dataset[mask]
+    The report is an evidently test suite, or with ``evidently_report=False``
+    the same accuracy and F1 tests checked on the confusion matrix the metrics
+    are computed from, without loading evidently.
+    """
+    store = feature_store(infile_dir / infile_name)
+    rows = store.from_year(cutoff_year)
 
     model_version = "latest" if model_version is None else model_version
 
@@ -36,36 +36,43 @@ def main(
 
     print(model_uri)
 
-    model = mlflow.sklearn.load_model(model_uri)
-
-    input_cols = ['price', 'positive_reviews', 'negative_reviews', 'metacritic_score', 'peak_ccu', 'recommendations', 'required_age', 'on_linux', 'on_mac', 'on_windows']
-    X, y = dataset[input_cols], dataset['estimated_owners']
-    y_pred = model.predict(X)
-
-    # Create a DataFrame with actual and predicted values
-    df = pd.DataFrame({
-        'target': y,
-        'prediction': y_pred
-    })
-
-    # Define test suite
-    test_suite = TestSuite(
-        tests=[
-            TestAccuracyScore(gte=acc_threshold),
-            TestF1Score(gte=f1_threshold),
-            TestRecallByClass(label='0 - 20000')
-        ]
-    )
-
-    # Run the test suite
-    test_suite.run(reference_data=None, current_data=df)
-
-    # Save the test results to HTML
-    test_suite.save_html(str(infile_dir / "classifier_results.html"))
-
-    accuracy = accuracy_score(y, y_pred)
-    f1 = f1_score(y, y_pred, average='macro')
-    balanced_accuracy = balanced_accuracy_score(y, y_pred)
+    X, y = store.X(rows), store.y(rows)
+    y_pred = predict(model_uri, X)
+
+    matrix = ConfusionMatrix.from_labels(y, y_pred)
+    metrics = matrix.metrics()
+    accuracy, balanced_accuracy, f1 = metrics["accuracy"], metrics["balanced_accuracy"], metrics["f1"]
+
+    if evidently_report:
+        # Imported on first use, it takes seconds to load
+        from evidently.test_suite import TestSuite
+        from evidently.tests import TestAccuracyScore, TestF1Score, TestRecallByClass
+
+        # Create a DataFrame with actual and predicted values
+        df = pd.DataFrame({
+            'target': y.to_numpy(),
+            'prediction': y_pred
+        })
+
+        # Define test suite
+        test_suite = TestSuite(
+            tests=[
+                TestAccuracyScore(gte=acc_threshold),
+                TestF1Score(gte=f1_threshold),
+                TestRecallByClass(label='0 - 20000')
+            ]
+        )
+
+        # Run the test suite
+        test_suite.run(reference_data=None, current_data=df)
+
+        # Save the test results to HTML
+        test_suite.save_html(str(infile_dir / "classifier_results.html"))
+    else:
+        save_classification_report(
+            matrix, infile_dir / "classifier_results.html",
+            checks=[("Accuracy", accuracy, acc_threshold), ("F1 score (macro)", f1, f1_threshold)],
+        )
 
     print(f"Accuracy: {accuracy:.4f}")
     print(f"F1 Score (macro): {f1:.4f}")